@@ -0,0 +1,162 @@
+"""
+Benchmark de Concurrencia del Ejecutor de Inferencia
+Sistema de Recomendación de Películas - Grupo 8
+
+Arranca la API (un worker de uvicorn) sobre el fixture sintético de
+benchmark_inference.py con cada modo de INFERENCE_EXECUTOR y la satura con
+muchas peticiones concurrentes. La mezcla incluye /health como petición ligera.
+
+Con inline, la inferencia bloquea el event loop: /health espera detrás de las
+recomendaciones. Además, las sesiones de BD abiertas por las peticiones
+detenidas agotan el pool de SQLAlchemy, y el servidor acaba en timeouts.
+
+Con thread o process, el loop sigue libre y la cola acotada rechaza el exceso
+con 503 en lugar de dejar crecer la latencia.
+
+Con --microbatch-ms se repite cada modo con el micro-batching de
+request_coalescer.py activado para cada ventana indicada.
+
+Uso:
+    python benchmark_concurrency.py                           # inline, thread y process
+    python benchmark_concurrency.py --modes inline,thread --max-in-flight 64
+    python benchmark_concurrency.py --modes thread --microbatch-ms 0,2,5 --mix from-db=70,predict=30
+    python benchmark_concurrency.py --output benchmarks/concurrency.json
+"""
+
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+from typing import Dict, List
+
+import httpx
+
+from benchmark_inference import build_fixture
+from benchmark_workers import _free_port, start_server, stop_server, wait_ready
+from load_test import Workload, parse_mix, run_load, summarize
+
+CONCURRENCY_MIX = "from-db=45,similar=25,popular=10,health=20"
+
+
+def run_case(workdir: str, mode: str, args, mix: Dict[str, float], microbatch_ms: float = 0) -> Dict:
+    """Arranca la API con INFERENCE_EXECUTOR=mode (y la ventana de micro-batching) y lanza la carga"""
+    port = _free_port()
+    log_path = os.path.join(workdir, f"server_{mode}_{microbatch_ms:g}.log")
+    process = start_server(workdir, "private", 1, port, log_path, extra_env={
+        "INFERENCE_EXECUTOR": mode,
+        "INFERENCE_WORKERS": str(args.inference_workers),
+        "INFERENCE_QUEUE_SIZE": str(args.queue_size),
+        "INFERENCE_TIMEOUT": str(args.inference_timeout),
+        "MICROBATCH_WINDOW_MS": str(microbatch_ms)
+    })
+    try:
+        wait_ready(process, log_path, 1)
+        user_ids = [str(u) for u in range(1, args.users + 1)]
+        workload = Workload(user_ids, [str(i) for i in range(1, args.items + 1)])
+
+        async def load():
+            limits = httpx.Limits(max_connections=args.max_in_flight, max_keepalive_connections=args.max_in_flight)
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits) as client:
+                return await run_load(client, workload, mix, args.rate, args.duration,
+                                      args.max_in_flight, args.client_timeout)
+
+        report = summarize(asyncio.run(load()), [], args.rate)
+    finally:
+        stop_server(process)
+
+    statuses: Dict[str, int] = {}
+    for endpoint in report["endpoints"].values():
+        for status, count in endpoint["statuses"].items():
+            statuses[status] = statuses.get(status, 0) + count
+    health = report["endpoints"].get("health", {})
+    return {
+        "mode": mode,
+        "microbatch_ms": microbatch_ms,
+        "requests": report["requests"],
+        "throughput_rps": report["throughput_rps"],
+        "ok_rate": round(statuses.get("200", 0) / report["requests"], 4) if report["requests"] else 0.0,
+        "rejected_503": statuses.get("503", 0),
+        "client_timeouts": sum(c for s, c in statuses.items() if "Timeout" in s),
+        "p50_ms": report["p50_ms"],
+        "p99_ms": report["p99_ms"],
+        "health_p50_ms": health.get("p50_ms"),
+        "health_p99_ms": health.get("p99_ms"),
+        "statuses": statuses,
+        "endpoints": report["endpoints"]
+    }
+
+
+def format_results(results: List[Dict]) -> List[str]:
+    lines = [f"{'Modo':<9}{'Lote ms':>8}{'req/s':>8}{'OK':>8}{'503':>7}{'Timeout':>9}"
+             f"{'p50 ms':>9}{'p99 ms':>10}{'health p50':>12}{'health p99':>12}"]
+    for r in results:
+        lines.append(
+            f"{r['mode']:<9}{r['microbatch_ms']:>8g}{r['throughput_rps']:>8.1f}{r['ok_rate']:>8.1%}{r['rejected_503']:>7}"
+            f"{r['client_timeouts']:>9}{r['p50_ms'] or 0:>9.1f}{r['p99_ms'] or 0:>10.1f}"
+            f"{r['health_p50_ms'] or 0:>12.1f}{r['health_p99_ms'] or 0:>12.1f}"
+        )
+    return lines
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Latencia de cola con y sin ejecutor de inferencia')
+    parser.add_argument('--modes', default='inline,thread,process', help='Modos de INFERENCE_EXECUTOR a comparar')
+    parser.add_argument('--users', type=int, default=6040, help='Usuarios del modelo sintético')
+    parser.add_argument('--items', type=int, default=3700, help='Películas del modelo sintético')
+    parser.add_argument('--factors', type=int, default=100, help='Factores latentes del modelo sintético')
+    parser.add_argument('--rate', type=float, default=300, help='Peticiones por segundo ofrecidas')
+    parser.add_argument('--duration', type=float, default=5, help='Segundos de carga por modo')
+    parser.add_argument('--max-in-flight', type=int, default=64,
+                        help='Máximo de peticiones concurrentes (por encima del pool de conexiones de la BD)')
+    parser.add_argument('--client-timeout', type=float, default=5, help='Timeout de cada petición del cliente')
+    parser.add_argument('--inference-workers', type=int, default=4, help='INFERENCE_WORKERS')
+    parser.add_argument('--queue-size', type=int, default=8, help='INFERENCE_QUEUE_SIZE')
+    parser.add_argument('--inference-timeout', type=float, default=2, help='INFERENCE_TIMEOUT (segundos)')
+    parser.add_argument('--microbatch-ms', default='0',
+                        help='Ventanas de micro-batching (MICROBATCH_WINDOW_MS) separadas por comas; 0 = sin agrupar')
+    parser.add_argument('--mix', default=CONCURRENCY_MIX, help=f'Mezcla de endpoints (por defecto: {CONCURRENCY_MIX})')
+    parser.add_argument('--workdir', help='Directorio del fixture (por defecto, uno temporal)')
+    parser.add_argument('--output', help='Guardar los resultados en este JSON')
+    args = parser.parse_args()
+
+    modes = [m.strip() for m in args.modes.split(",")]
+    windows = [float(w) for w in args.microbatch_ms.split(",")]
+    mix = parse_mix(args.mix)
+
+    print("="*70)
+    print("BENCHMARK DE CONCURRENCIA - EJECUTOR DE INFERENCIA")
+    print("="*70)
+    print(f"CPUs disponibles: {os.cpu_count()} | modos {modes} | {args.max_in_flight} peticiones concurrentes")
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_concurrency_")
+    results = []
+    try:
+        print(f"\nConstruyendo fixture sintético en {workdir}...")
+        fixture = build_fixture(workdir, n_users=args.users, n_items=args.items, n_factors=args.factors)
+        fixture['engine'].dispose()
+        for mode in modes:
+            for window in windows:
+                print(f"  ⏱️  INFERENCE_EXECUTOR={mode}, MICROBATCH_WINDOW_MS={window:g}...")
+                results.append(run_case(workdir, mode, args, mix, window))
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print("\n" + "="*70)
+    for line in format_results(results):
+        print(line)
+    print("="*70)
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({
+                "fixture": {'n_users': args.users, 'n_items': args.items, 'n_factors': args.factors},
+                "cpu_count": os.cpu_count(),
+                "max_in_flight": args.max_in_flight,
+                "results": results
+            }, f, indent=2)
+        print(f"✓ Resultados guardados en {args.output}")
@@ -0,0 +1,392 @@
+"""
+Benchmark de Inferencia de MovieRecommenderDB
+Sistema de Recomendación de Películas - Grupo 8
+
+Construye un fixture sintético (modelo SVD publicado en un registro temporal,
+metadata de películas y base de datos SQLite propia) y mide las operaciones
+de inferencia: latencia por llamada (media, p50, p95, p99), memoria asignada
+por llamada (tracemalloc) y comparación con una línea base guardada en JSON
+para detectar regresiones entre versiones.
+
+Uso:
+    python benchmark_inference.py                      # ejecutar y comparar con la línea base
+    python benchmark_inference.py --save-baseline      # guardar resultados como línea base
+    python benchmark_inference.py --only predict_rating similar_movies
+"""
+
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Dict, List
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from surprise import SVD, Dataset, Reader
+
+from database import Base, RatingCRUD, UserCRUD
+from item_neighbors import NEIGHBORS_FILE, neighbor_arrays
+from model_registry import ModelRegistry
+
+DEFAULT_BASELINE_PATH = "benchmarks/inference_baseline.json"
+
+# Usuarios del fixture para los tres casos de get_recommendations_from_db
+TRAINSET_USER = "1"
+NEW_USER_WITH_RATINGS = "bench_new"
+NEW_USER_WITHOUT_RATINGS = "bench_cold"
+
+
+# ============================================================================
+# FIXTURE SINTÉTICO
+# ============================================================================
+
+def synthetic_ratings(n_users: int, n_items: int, seed: int = 42) -> pd.DataFrame:
+    """Ratings sintéticos con popularidad de cola larga y estructura latente"""
+    rng = np.random.default_rng(seed)
+    user_factors = rng.normal(0, 0.5, (n_users, 8))
+    item_factors = rng.normal(0, 0.5, (n_items, 8))
+    item_bias = rng.normal(0, 0.4, n_items)
+    popularity = 1.0 / np.arange(1, n_items + 1) ** 0.9
+    popularity /= popularity.sum()
+
+    users, items, ratings = [], [], []
+    for u in range(n_users):
+        k = int(rng.integers(20, 200))
+        rated = rng.choice(n_items, size=min(k, n_items), replace=False, p=popularity)
+        scores = 3.6 + item_bias[rated] + item_factors[rated] @ user_factors[u] + rng.normal(0, 0.6, len(rated))
+        users.extend([str(u + 1)] * len(rated))
+        items.extend(str(i + 1) for i in rated)
+        ratings.extend(np.clip(np.rint(scores), 1, 5))
+    return pd.DataFrame({'user': users, 'item': items, 'rating': ratings})
+
+
+def build_fixture(
+    workdir: str,
+    n_users: int = 1000,
+    n_items: int = 1500,
+    n_factors: int = 50,
+    seed: int = 42
+) -> Dict:
+    """
+    Crea en workdir un modelo publicado en models/registry, data/movies.dat y
+    una base de datos SQLite con los usuarios de los tres casos de recomendación.
+
+    Returns:
+        dict con model_path, movies_path, database_url, session_factory y df
+    """
+    models_dir = os.path.join(workdir, "models")
+    data_dir = os.path.join(workdir, "data")
+    os.makedirs(models_dir, exist_ok=True)
+    os.makedirs(data_dir, exist_ok=True)
+
+    df = synthetic_ratings(n_users, n_items, seed)
+    data = Dataset.load_from_df(df[['user', 'item', 'rating']], Reader(rating_scale=(1, 5)))
+    trainset = data.build_full_trainset()
+    model = SVD(n_factors=n_factors, n_epochs=5, random_state=seed).fit(trainset)
+
+    model_path = os.path.join(models_dir, "svd_model_1m.pkl")
+    ModelRegistry.for_model_path(model_path).publish({
+        'model': model,
+        'trainset': trainset,
+        'n_users': trainset.n_users,
+        'n_items': trainset.n_items,
+        'global_mean': trainset.global_mean,
+        'version': '2.0'
+    }, {'n_ratings': trainset.n_ratings, 'params': {'n_factors': n_factors, 'synthetic': True}},
+        arrays={NEIGHBORS_FILE: neighbor_arrays(model)})
+
+    movies_path = os.path.join(data_dir, "movies.dat")
+    genres = ["Action", "Comedy", "Drama", "Thriller", "Romance", "Sci-Fi", "Animation", "Horror"]
+    with open(movies_path, "w", encoding="utf-8") as f:
+        for i in range(1, n_items + 1):
+            f.write(f"{i}::Synthetic Movie {i} ({1950 + i % 70})::{genres[i % len(genres)]}|{genres[(i * 7) % len(genres)]}\n")
+
+    database_url = f"sqlite:///{os.path.join(data_dir, 'benchmark.db')}"
+    engine = create_engine(database_url, connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    rng = np.random.default_rng(seed + 1)
+    db = session_factory()
+    try:
+        for user_id in (TRAINSET_USER, NEW_USER_WITH_RATINGS, NEW_USER_WITHOUT_RATINGS):
+            UserCRUD.create_user(db, user_id, f"{user_id}@bench.local", user_id, "bench")
+        # Usuario nuevo con historial: varias películas que le gustaron
+        for movie in rng.choice(np.arange(1, min(n_items, 200) + 1), size=8, replace=False):
+            RatingCRUD.create_rating(db, NEW_USER_WITH_RATINGS, str(movie), float(rng.choice([4.0, 4.5, 5.0])))
+        # Usuario del trainset con algunas valoraciones en la app
+        for movie in rng.choice(np.arange(1, n_items + 1), size=5, replace=False):
+            RatingCRUD.create_rating(db, TRAINSET_USER, str(movie), float(rng.integers(1, 6)))
+    finally:
+        db.close()
+
+    return {
+        'workdir': workdir,
+        'model_path': model_path,
+        'movies_path': movies_path,
+        'database_url': database_url,
+        'engine': engine,
+        'session_factory': session_factory,
+        'ratings_df': df,
+        'n_users': n_users,
+        'n_items': n_items,
+        'n_factors': n_factors
+    }
+
+
+# ============================================================================
+# MEDICIÓN
+# ============================================================================
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    return float(np.percentile(sorted_values, q)) if sorted_values else 0.0
+
+
+def measure(fn: Callable[[int], object], iterations: int, warmup: int = 3, alloc_iterations: int = 5) -> Dict:
+    """
+    Mide fn(i) durante `iterations` llamadas tras `warmup` de calentamiento.
+    Las asignaciones se miden aparte con tracemalloc para no distorsionar los tiempos.
+    """
+    for i in range(warmup):
+        fn(i)
+
+    samples = []
+    for i in range(iterations):
+        start = time.perf_counter_ns()
+        fn(i)
+        samples.append((time.perf_counter_ns() - start) / 1e6)
+    samples.sort()
+
+    tracemalloc.start()
+    peaks = []
+    try:
+        for i in range(alloc_iterations):
+            tracemalloc.reset_peak()
+            base, _ = tracemalloc.get_traced_memory()
+            fn(i)
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - base)
+    finally:
+        tracemalloc.stop()
+
+    mean = float(np.mean(samples))
+    return {
+        'iterations': iterations,
+        'mean_ms': round(mean, 4),
+        'p50_ms': round(_percentile(samples, 50), 4),
+        'p95_ms': round(_percentile(samples, 95), 4),
+        'p99_ms': round(_percentile(samples, 99), 4),
+        'max_ms': round(samples[-1], 4),
+        'ops_per_sec': round(1000.0 / mean, 2) if mean else None,
+        'peak_alloc_kb': round(float(np.median(peaks)) / 1024, 1)
+    }
+
+
+def build_cases(recommender, db, n_items: int) -> Dict[str, Dict]:
+    """Operaciones medidas: nombre -> {fn(i), iterations}"""
+    rng = np.random.default_rng(7)
+    item_ids = [str(i) for i in rng.integers(1, n_items + 1, size=1000)]
+    update_movies = [str(i) for i in rng.integers(1, n_items + 1, size=10)]
+
+    return {
+        'predict_rating': {
+            'fn': lambda i: recommender.predict_rating(TRAINSET_USER, item_ids[i % len(item_ids)]),
+            'iterations': 2000
+        },
+        'recommendations_trainset_user': {
+            'fn': lambda i: recommender.get_recommendations_from_db(db, TRAINSET_USER, n=10),
+            'iterations': 30
+        },
+        'recommendations_new_user_with_ratings': {
+            'fn': lambda i: recommender.get_recommendations_from_db(db, NEW_USER_WITH_RATINGS, n=10),
+            'iterations': 20
+        },
+        'recommendations_new_user_without_ratings': {
+            'fn': lambda i: recommender.get_recommendations_from_db(db, NEW_USER_WITHOUT_RATINGS, n=10),
+            'iterations': 20
+        },
+        'similar_movies': {
+            'fn': lambda i: recommender.get_similar_movies(item_ids[i % len(item_ids)], n=10),
+            'iterations': 50
+        },
+        'popular_movies': {
+            'fn': lambda i: recommender.get_popular_movies(n=10),
+            'iterations': 20
+        },
+        # Actualiza siempre el mismo puñado de películas para que el coste sea estable
+        'add_rating_and_get_recommendations': {
+            'fn': lambda i: recommender.add_rating_and_get_recommendations(
+                db, TRAINSET_USER, update_movies[i % len(update_movies)], float(1 + i % 5)
+            ),
+            'iterations': 30
+        }
+    }
+
+
+def run_benchmarks(fixture: Dict, only: List[str] = None, scale: float = 1.0) -> Dict:
+    """Ejecuta los casos sobre el fixture y devuelve los resultados por caso"""
+    from model_inference_with_db import MovieRecommenderDB
+
+    recommender = MovieRecommenderDB(fixture['model_path'], movies_path=fixture['movies_path'])
+    recommender.warm_up()
+    db = fixture['session_factory']()
+    try:
+        results = {}
+        for name, case in build_cases(recommender, db, fixture['n_items']).items():
+            if only and name not in only:
+                continue
+            iterations = max(3, int(case['iterations'] * scale))
+            print(f"  ⏱️  {name} ({iterations} iteraciones)...")
+            results[name] = measure(case['fn'], iterations)
+        return results
+    finally:
+        db.close()
+
+
+# ============================================================================
+# LÍNEA BASE
+# ============================================================================
+
+def environment_info() -> Dict:
+    import surprise
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'surprise': surprise.__version__
+    }
+
+
+def save_baseline(path: str, results: Dict, fixture_params: Dict):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({
+            'created_at': datetime.now().isoformat(),
+            'environment': environment_info(),
+            'fixture': fixture_params,
+            'results': results
+        }, f, indent=2)
+
+
+def compare_with_baseline(results: Dict, baseline: Dict, threshold: float, min_delta_ms: float = 0.05,
+                          metrics: tuple = ('p50_ms', 'p95_ms')) -> List[Dict]:
+    """
+    Casos cuyo p50 o p95 (o las métricas indicadas) supera la línea base en más
+    de `threshold` veces. Las diferencias menores que min_delta_ms se ignoran
+    (ruido en casos de microsegundos).
+    """
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous:
+            continue
+        for metric in metrics:
+            too_slow = current[metric] > previous[metric] * threshold
+            if previous[metric] and too_slow and current[metric] - previous[metric] >= min_delta_ms:
+                regressions.append({
+                    'case': name,
+                    'metric': metric,
+                    'baseline': previous[metric],
+                    'current': current[metric],
+                    'ratio': round(current[metric] / previous[metric], 2)
+                })
+    return regressions
+
+
+def format_results(results: Dict, baseline: Dict = None) -> List[str]:
+    header = (f"{'Caso':<42}{'p50 (ms)':>10}{'p95 (ms)':>10}{'p99 (ms)':>10}"
+              f"{'ops/s':>10}{'KB/llamada':>12}")
+    if baseline:
+        header += f"{'vs base':>9}"
+    lines = [header]
+    for name, r in results.items():
+        line = (f"{name:<42}{r['p50_ms']:>10.3f}{r['p95_ms']:>10.3f}{r['p99_ms']:>10.3f}"
+                f"{r['ops_per_sec'] or 0:>10.1f}{r['peak_alloc_kb']:>12.1f}")
+        previous = (baseline or {}).get('results', {}).get(name)
+        if previous and previous['p50_ms']:
+            line += f"{r['p50_ms'] / previous['p50_ms']:>8.2f}x"
+        lines.append(line)
+    return lines
+
+
+# ============================================================================
+# MAIN
+# ============================================================================
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark de inferencia de MovieRecommenderDB')
+    parser.add_argument('--users', type=int, default=1000, help='Usuarios del modelo sintético')
+    parser.add_argument('--items', type=int, default=1500, help='Películas del modelo sintético')
+    parser.add_argument('--factors', type=int, default=50, help='Factores latentes del modelo sintético')
+    parser.add_argument('--scale', type=float, default=1.0, help='Multiplicador del número de iteraciones')
+    parser.add_argument('--only', nargs='*', help='Ejecutar solo estos casos')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE_PATH, help='Fichero JSON de la línea base')
+    parser.add_argument('--save-baseline', action='store_true', help='Guardar los resultados como línea base')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='Factor de p50/p95 sobre la línea base que se considera regresión')
+    parser.add_argument('--min-delta-ms', type=float, default=0.05,
+                        help='Diferencia mínima en ms para considerar regresión')
+    parser.add_argument('--output', help='Guardar también los resultados en este JSON')
+    parser.add_argument('--workdir', help='Directorio del fixture (por defecto, uno temporal)')
+    args = parser.parse_args()
+
+    print("="*70)
+    print("BENCHMARK DE INFERENCIA - MovieRecommenderDB")
+    print("="*70)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_inference_")
+    fixture_params = {'n_users': args.users, 'n_items': args.items, 'n_factors': args.factors}
+    try:
+        print(f"\nConstruyendo fixture sintético en {workdir}...")
+        start = time.perf_counter()
+        fixture = build_fixture(workdir, **fixture_params)
+        print(f"✓ Fixture listo en {time.perf_counter() - start:.1f}s "
+              f"({len(fixture['ratings_df'])} ratings)")
+
+        print("\nEjecutando casos:")
+        results = run_benchmarks(fixture, only=args.only, scale=args.scale)
+        fixture['engine'].dispose()
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get('fixture') != fixture_params:
+            print(f"\n⚠️ La línea base usa otro fixture ({baseline.get('fixture')}); no se compara")
+            baseline = None
+
+    print("\n" + "="*70)
+    for line in format_results(results, baseline):
+        print(line)
+    print("="*70)
+
+    if args.output:
+        save_baseline(args.output, results, fixture_params)
+        print(f"✓ Resultados guardados en {args.output}")
+
+    if args.save_baseline:
+        save_baseline(args.baseline, results, fixture_params)
+        print(f"✓ Línea base guardada en {args.baseline}")
+    elif baseline:
+        regressions = compare_with_baseline(results, baseline, args.threshold, args.min_delta_ms)
+        if regressions:
+            print(f"\n❌ Regresiones (> {args.threshold}x la línea base):")
+            for r in regressions:
+                print(f"   • {r['case']} {r['metric']}: {r['baseline']:.3f} → {r['current']:.3f} ms ({r['ratio']}x)")
+            sys.exit(1)
+        print(f"\n✅ Sin regresiones respecto a la línea base (umbral {args.threshold}x)")
+    else:
+        print("\nℹ️ Sin línea base; ejecuta con --save-baseline para crearla")
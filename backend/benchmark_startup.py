@@ -0,0 +1,175 @@
+"""
+Benchmark de Arranque de la API
+Sistema de Recomendación de Películas - Grupo 8
+
+Lanza varias veces un proceso nuevo que importa main.py, ejecuta el evento de
+startup (tablas, modelo y títulos) y sirve una primera petición, sobre el
+fixture sintético de benchmark_inference.py. Mide cada paso por separado
+(import, startup, pasos internos de STARTUP_TIMINGS, primera petición y
+proceso completo) y lo compara con una línea base en JSON para detectar
+regresiones en el tiempo de arranque.
+
+Uso:
+    python benchmark_startup.py                        # ejecutar y comparar con la línea base
+    python benchmark_startup.py --save-baseline        # guardar resultados como línea base
+    python benchmark_startup.py --runs 10 --users 6040 --items 3700
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+from benchmark_inference import _percentile, build_fixture, compare_with_baseline, save_baseline
+
+DEFAULT_BASELINE_PATH = "benchmarks/startup_baseline.json"
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Proceso hijo: mide el import de main, el startup y la primera petición
+CHILD_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+from starlette.testclient import TestClient
+with TestClient(main.app) as client:
+    started = time.perf_counter()
+    status = client.get("/health").status_code
+    served = time.perf_counter()
+print("STARTUP_RESULT " + json.dumps({
+    "status": status,
+    "import_main": imported - start,
+    "startup": started - imported,
+    "first_request": served - started,
+    **main.STARTUP_TIMINGS
+}))
+"""
+
+
+def run_once(workdir: str) -> Dict[str, float]:
+    """Un arranque en un proceso nuevo; devuelve los segundos de cada paso"""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = BACKEND_DIR + os.pathsep + env.get("PYTHONPATH", "")
+    env["MODEL_RELOAD_INTERVAL"] = "0"
+    env.pop("TRACING_SAMPLE_RATE", None)
+    env.pop("QUERY_PROFILER", None)
+
+    start = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-c", CHILD_SCRIPT], cwd=workdir, env=env, capture_output=True, text=True
+    )
+    elapsed = time.perf_counter() - start
+    for line in completed.stdout.splitlines():
+        if line.startswith("STARTUP_RESULT "):
+            result = json.loads(line[len("STARTUP_RESULT "):])
+            if result.pop("status") != 200:
+                raise RuntimeError("La primera petición no devolvió 200")
+            result["process_total"] = elapsed
+            return result
+    raise RuntimeError(f"El proceso de arranque falló:\n{completed.stderr[-2000:]}")
+
+
+def run_benchmarks(workdir: str, runs: int = 5, warmup: int = 1) -> Dict[str, Dict]:
+    """
+    Ejecuta `warmup` arranques descartados (generan la tabla de títulos) y
+    `runs` medidos; devuelve p50/p95/media en ms por paso
+    """
+    for _ in range(warmup):
+        run_once(workdir)
+    samples: Dict[str, List[float]] = {}
+    for i in range(runs):
+        print(f"  ⏱️  arranque {i + 1}/{runs}...")
+        for step, seconds in run_once(workdir).items():
+            samples.setdefault(step, []).append(seconds * 1000)
+
+    results = {}
+    for step, values in samples.items():
+        ordered = sorted(values)
+        results[step] = {
+            'mean_ms': round(sum(ordered) / len(ordered), 3),
+            'p50_ms': round(_percentile(ordered, 50), 3),
+            'p95_ms': round(_percentile(ordered, 95), 3),
+            'runs': len(ordered)
+        }
+    return results
+
+
+def format_results(results: Dict, baseline: Dict = None) -> List[str]:
+    header = f"{'Paso':<28}{'p50 (ms)':>10}{'p95 (ms)':>10}{'media (ms)':>12}"
+    if baseline:
+        header += f"{'vs base':>9}"
+    lines = [header]
+    for step, r in results.items():
+        line = f"{step:<28}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['mean_ms']:>12.1f}"
+        previous = (baseline or {}).get('results', {}).get(step)
+        if previous and previous['p50_ms']:
+            line += f"{r['p50_ms'] / previous['p50_ms']:>8.2f}x"
+        lines.append(line)
+    return lines
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark del arranque de la API')
+    parser.add_argument('--users', type=int, default=6040, help='Usuarios del modelo sintético')
+    parser.add_argument('--items', type=int, default=3700, help='Películas del modelo sintético')
+    parser.add_argument('--factors', type=int, default=100, help='Factores latentes del modelo sintético')
+    parser.add_argument('--runs', type=int, default=5, help='Arranques medidos')
+    parser.add_argument('--warmup', type=int, default=1, help='Arranques previos descartados')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE_PATH, help='Fichero JSON de la línea base')
+    parser.add_argument('--save-baseline', action='store_true', help='Guardar los resultados como línea base')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='Ratio sobre la línea base a partir del cual hay regresión')
+    parser.add_argument('--min-delta-ms', type=float, default=30.0,
+                        help='Diferencia mínima en ms para contar como regresión')
+    parser.add_argument('--workdir', help='Directorio del fixture (por defecto, uno temporal)')
+    args = parser.parse_args()
+
+    print("="*70)
+    print("BENCHMARK DE ARRANQUE - API")
+    print("="*70)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_startup_")
+    fixture_params = {'n_users': args.users, 'n_items': args.items, 'n_factors': args.factors}
+    try:
+        print(f"\nConstruyendo fixture sintético en {workdir}...")
+        fixture = build_fixture(workdir, **fixture_params)
+        fixture['engine'].dispose()
+        print(f"\nEjecutando {args.runs} arranques (+{args.warmup} de calentamiento):")
+        results = run_benchmarks(workdir, args.runs, args.warmup)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get('fixture') != fixture_params:
+            print(f"\n⚠️ La línea base usa otro fixture ({baseline.get('fixture')}); no se compara")
+            baseline = None
+
+    print("\n" + "="*70)
+    for line in format_results(results, baseline):
+        print(line)
+    print("="*70)
+
+    if args.save_baseline:
+        save_baseline(args.baseline, results, fixture_params)
+        print(f"✓ Línea base guardada en {args.baseline}")
+    elif baseline:
+        # Con pocos arranques el p95 es casi el máximo; solo se compara la mediana
+        regressions = compare_with_baseline(results, baseline, args.threshold, args.min_delta_ms, ('p50_ms',))
+        if regressions:
+            print(f"\n❌ Regresiones (> {args.threshold}x la línea base):")
+            for r in regressions:
+                print(f"   • {r['case']} {r['metric']}: {r['baseline']:.1f} → {r['current']:.1f} ms ({r['ratio']}x)")
+            sys.exit(1)
+        print(f"\n✅ Sin regresiones respecto a la línea base (umbral {args.threshold}x)")
+    else:
+        print("\nℹ️ Sin línea base; ejecuta con --save-baseline para crearla")
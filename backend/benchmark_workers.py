@@ -0,0 +1,239 @@
+"""
+Benchmark Multi-Worker de la API
+Sistema de Recomendación de Películas - Grupo 8
+
+Arranca la API con 1, 2, 4 y 8 workers de uvicorn sobre el fixture sintético
+de benchmark_inference.py, en dos modos:
+- private: cada worker deserializa su propia copia del modelo.
+- shared: el supervisor de shared_model_store.py publica el modelo una vez y
+  los workers lo mapean en solo lectura.
+
+Para cada combinación satura el servidor con la carga de load_test.py (solo
+endpoints de lectura) y mide:
+- Throughput y latencias.
+- Memoria del árbol de procesos completo: RSS y PSS. El PSS reparte cada
+  página compartida entre los procesos que la usan, así que es la medida real
+  de memoria total.
+
+Uso:
+    python benchmark_workers.py                             # 1, 2, 4 y 8 workers, ambos modos
+    python benchmark_workers.py --workers 1,2 --modes shared --duration 5
+    python benchmark_workers.py --output benchmarks/workers.json
+"""
+
+import asyncio
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import httpx
+
+from benchmark_inference import build_fixture
+from load_test import Workload, parse_mix, run_load, summarize
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+READ_ONLY_MIX = "from-db=60,similar=25,popular=15"
+READY_LINE = "Application startup complete"
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _process_tree(root_pid: int) -> List[int]:
+    """PIDs del proceso y todos sus descendientes (Linux)"""
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # El nombre del proceso va entre paréntesis y puede contener espacios
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    pids, pending = [], [root_pid]
+    while pending:
+        pid = pending.pop()
+        pids.append(pid)
+        pending.extend(children.get(pid, []))
+    return pids
+
+
+def tree_memory(root_pid: int) -> Dict[str, int]:
+    """RSS y PSS (bytes) sumados sobre el árbol de procesos"""
+    totals = {"processes": 0, "rss_bytes": 0, "pss_bytes": 0}
+    for pid in _process_tree(root_pid):
+        try:
+            with open(f"/proc/{pid}/smaps_rollup") as f:
+                fields = dict(line.split(":", 1) for line in f.read().splitlines()[1:])
+        except OSError:
+            continue
+        totals["processes"] += 1
+        totals["rss_bytes"] += int(fields["Rss"].split()[0]) * 1024
+        totals["pss_bytes"] += int(fields["Pss"].split()[0]) * 1024
+    return totals
+
+
+def start_server(workdir: str, mode: str, workers: int, port: int, log_path: str,
+                 extra_env: Dict[str, str] = None) -> subprocess.Popen:
+    """Arranca uvicorn (private) o el supervisor del almacén compartido (shared)"""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = BACKEND_DIR + os.pathsep + env.get("PYTHONPATH", "")
+    env["MODEL_RELOAD_INTERVAL"] = "0"
+    env.pop("SHARED_MODEL_STORE", None)
+    env.pop("TRACING_SAMPLE_RATE", None)
+    # Sin log de acceso (uvicorn lee sus opciones de las variables UVICORN_*)
+    env["UVICORN_ACCESS_LOG"] = "false"
+    env.update(extra_env or {})
+    if mode == "shared":
+        command = [sys.executable, os.path.join(BACKEND_DIR, "shared_model_store.py"),
+                   "serve", "--workers", str(workers), "--host", "127.0.0.1", "--port", str(port)]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", BACKEND_DIR,
+                   "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers)]
+    log = open(log_path, "w")
+    # Grupo de procesos propio para poder parar supervisor, uvicorn y workers juntos
+    return subprocess.Popen(command, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT,
+                            start_new_session=True)
+
+
+def stop_server(process: subprocess.Popen):
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=30)
+    except (ProcessLookupError, subprocess.TimeoutExpired):
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+
+
+def wait_ready(process: subprocess.Popen, log_path: str, workers: int, timeout: float = 300) -> float:
+    """Espera a que los `workers` procesos hayan terminado su startup; devuelve los segundos"""
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if process.poll() is not None:
+            with open(log_path) as f:
+                raise RuntimeError(f"El servidor terminó al arrancar:\n{f.read()[-2000:]}")
+        with open(log_path) as f:
+            if f.read().count(READY_LINE) >= workers:
+                return time.perf_counter() - start
+        time.sleep(0.1)
+    raise TimeoutError(f"Los {workers} workers no arrancaron en {timeout}s")
+
+
+def run_case(workdir: str, mode: str, workers: int, args, mix: Dict[str, float]) -> Dict:
+    """Arranca el servidor, mide la memoria en reposo y bajo carga, y la carga saturada"""
+    port = _free_port()
+    log_path = os.path.join(workdir, f"server_{mode}_{workers}.log")
+    process = start_server(workdir, mode, workers, port, log_path)
+    try:
+        ready_seconds = wait_ready(process, log_path, workers)
+        idle = tree_memory(process.pid)
+
+        user_ids = [str(u) for u in range(1, args.users + 1)]
+        workload = Workload(user_ids, [str(i) for i in range(1, args.items + 1)])
+        url = f"http://127.0.0.1:{port}"
+
+        async def load():
+            limits = httpx.Limits(max_connections=args.max_in_flight, max_keepalive_connections=args.max_in_flight)
+            async with httpx.AsyncClient(base_url=url, limits=limits) as client:
+                return await run_load(client, workload, mix, args.rate, args.duration, args.max_in_flight, 30)
+
+        report = summarize(asyncio.run(load()), [], args.rate)
+        loaded = tree_memory(process.pid)
+    finally:
+        stop_server(process)
+
+    return {
+        "mode": mode,
+        "workers": workers,
+        "ready_seconds": round(ready_seconds, 3),
+        "throughput_rps": report["throughput_rps"],
+        "error_rate": report["error_rate"],
+        "p50_ms": report["p50_ms"],
+        "p99_ms": report["p99_ms"],
+        "processes": loaded["processes"],
+        "idle_rss_mb": round(idle["rss_bytes"] / 2**20, 1),
+        "idle_pss_mb": round(idle["pss_bytes"] / 2**20, 1),
+        "rss_mb": round(loaded["rss_bytes"] / 2**20, 1),
+        "pss_mb": round(loaded["pss_bytes"] / 2**20, 1)
+    }
+
+
+def format_results(results: List[Dict]) -> List[str]:
+    lines = [f"{'Modo':<9}{'Workers':>8}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}{'Errores':>9}"
+             f"{'Arranque s':>11}{'RSS MB':>9}{'PSS MB':>9}"]
+    for r in results:
+        lines.append(
+            f"{r['mode']:<9}{r['workers']:>8}{r['throughput_rps']:>9.1f}{r['p50_ms'] or 0:>9.1f}"
+            f"{r['p99_ms'] or 0:>9.1f}{r['error_rate']:>9.1%}{r['ready_seconds']:>11.2f}"
+            f"{r['rss_mb']:>9.1f}{r['pss_mb']:>9.1f}"
+        )
+    return lines
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark de throughput y memoria por número de workers')
+    parser.add_argument('--workers', default='1,2,4,8', help='Números de workers separados por comas')
+    parser.add_argument('--modes', default='private,shared', help='Modos: private (pickle por worker) y/o shared')
+    parser.add_argument('--users', type=int, default=6040, help='Usuarios del modelo sintético')
+    parser.add_argument('--items', type=int, default=3700, help='Películas del modelo sintético')
+    parser.add_argument('--factors', type=int, default=100, help='Factores latentes del modelo sintético')
+    parser.add_argument('--rate', type=float, default=300, help='Peticiones por segundo ofrecidas (por encima de la capacidad)')
+    parser.add_argument('--duration', type=float, default=10, help='Segundos de carga por caso')
+    parser.add_argument('--max-in-flight', type=int, default=8,
+                        help='Máximo de peticiones concurrentes (por debajo del pool de conexiones de la BD)')
+    parser.add_argument('--mix', default=READ_ONLY_MIX, help=f'Mezcla de endpoints (por defecto: {READ_ONLY_MIX})')
+    parser.add_argument('--workdir', help='Directorio del fixture (por defecto, uno temporal)')
+    parser.add_argument('--output', help='Guardar los resultados en este JSON')
+    args = parser.parse_args()
+
+    worker_counts = [int(w) for w in args.workers.split(",")]
+    modes = [m.strip() for m in args.modes.split(",")]
+    mix = parse_mix(args.mix)
+
+    print("="*70)
+    print("BENCHMARK MULTI-WORKER - API")
+    print("="*70)
+    print(f"CPUs disponibles: {os.cpu_count()} | workers {worker_counts} | modos {modes}")
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_workers_")
+    results = []
+    try:
+        print(f"\nConstruyendo fixture sintético en {workdir}...")
+        fixture = build_fixture(workdir, n_users=args.users, n_items=args.items, n_factors=args.factors)
+        fixture['engine'].dispose()
+        for mode in modes:
+            for workers in worker_counts:
+                print(f"  ⏱️  {mode} con {workers} workers...")
+                results.append(run_case(workdir, mode, workers, args, mix))
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print("\n" + "="*70)
+    for line in format_results(results):
+        print(line)
+    print("="*70)
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({
+                "fixture": {'n_users': args.users, 'n_items': args.items, 'n_factors': args.factors},
+                "cpu_count": os.cpu_count(),
+                "results": results
+            }, f, indent=2)
+        print(f"✓ Resultados guardados en {args.output}")
@@ -4,14 +4,12 @@ Sistema de Recomendación de Películas - Grupo 8
 """
 
 from sqlalchemy import create_engine, Column, Integer, Float, String, DateTime, ForeignKey
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
 import os
 
-# Crear directorio para la base de datos si no existe
-os.makedirs("data", exist_ok=True)
-
 # URL de la base de datos
 DATABASE_URL = "sqlite:///./data/movie_recommender.db"
 
@@ -58,12 +56,31 @@ class User(Base):
         return f"<User(user_id={self.user_id}, mail={self.mail}, user_name={self.user_name})>"
 
 
+class RetrainSignal(Base):
+    """
+    Contadores publicados por la escritura de ratings desde el último reentrenamiento.
+    Tabla de una sola fila compartida entre la API y el planificador de reentrenamiento.
+    """
+    __tablename__ = "retrain_signals"
+    
+    id = Column(Integer, primary_key=True)
+    new_ratings = Column(Integer, default=0, nullable=False)
+    new_users = Column(Integer, default=0, nullable=False)
+    rating_sum = Column(Float, default=0.0, nullable=False)
+    rating_sq_sum = Column(Float, default=0.0, nullable=False)
+    last_event_at = Column(DateTime, nullable=True)
+    
+    def __repr__(self):
+        return f"<RetrainSignal(new_ratings={self.new_ratings}, new_users={self.new_users})>"
+
+
 # ============================================================================
 # FUNCIONES AUXILIARES
 # ============================================================================
 
 def create_database():
-    """Crea todas las tablas en la base de datos"""
+    """Crea el directorio y todas las tablas de la base de datos"""
+    os.makedirs("data", exist_ok=True)
     Base.metadata.create_all(bind=engine)
     print("✓ Base de datos creada exitosamente")
 
@@ -107,17 +124,20 @@ class RatingCRUD:
             # Actualizar rating existente
             existing.rating = rating
             existing.timestamp = datetime.utcnow()
+            RetrainSignalCRUD.record_rating(db, rating, is_new_user=False)
             db.commit()
             db.refresh(existing)
             return existing
         else:
             # Crear nuevo rating
+            is_new_user = db.query(Rating.id).filter(Rating.user_id == user_id).first() is None
             new_rating = Rating(
                 user_id=user_id,
                 movie_id=movie_id,
                 rating=rating
             )
             db.add(new_rating)
+            RetrainSignalCRUD.record_rating(db, rating, is_new_user=is_new_user)
             db.commit()
             db.refresh(new_rating)
             return new_rating
@@ -161,6 +181,24 @@ class RatingCRUD:
             query = query.limit(limit)
         return query.all()
     
+    @staticmethod
+    def get_ratings_for_users(db, user_ids: list, batch_size: int = 500):
+        """(user_id, movie_id, rating) de varios usuarios, con IN de batch_size ids como mucho"""
+        rows = []
+        for start in range(0, len(user_ids), batch_size):
+            rows.extend(db.query(Rating.user_id, Rating.movie_id, Rating.rating).filter(
+                Rating.user_id.in_(user_ids[start:start + batch_size])
+            ).all())
+        return rows
+
+    @staticmethod
+    def get_user_ids_after(db, after_user_id: str = None, limit: int = 500):
+        """Ids de usuario con ratings, ordenados, a partir de after_user_id (paginación por cursor)"""
+        query = db.query(Rating.user_id).distinct()
+        if after_user_id is not None:
+            query = query.filter(Rating.user_id > after_user_id)
+        return [row[0] for row in query.order_by(Rating.user_id).limit(limit).all()]
+
     @staticmethod
     def count_user_ratings(db, user_id: str):
         """Cuenta cuántas películas ha valorado un usuario"""
@@ -206,6 +244,77 @@ class UserCRUD:
         return db.query(User).all()
 
 
+class RetrainSignalCRUD:
+    """Contadores de disparo del reentrenamiento (fila única id=1)"""
+    
+    SIGNAL_ID = 1
+    
+    @staticmethod
+    def record_rating(db, rating: float, is_new_user: bool):
+        """
+        Incrementa los contadores dentro de la transacción de la escritura del rating.
+        Es un único INSERT ... ON CONFLICT DO UPDATE: crea la fila con el primer
+        rating y la incrementa después, así que varios procesos pueden publicar
+        a la vez (también cuando la fila aún no existe).
+        """
+        now = datetime.utcnow()
+        new_users = 1 if is_new_user else 0
+        stmt = sqlite_insert(RetrainSignal).values(
+            id=RetrainSignalCRUD.SIGNAL_ID,
+            new_ratings=1,
+            new_users=new_users,
+            rating_sum=rating,
+            rating_sq_sum=rating * rating,
+            last_event_at=now
+        )
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=[RetrainSignal.id],
+            set_={
+                "new_ratings": RetrainSignal.new_ratings + 1,
+                "new_users": RetrainSignal.new_users + new_users,
+                "rating_sum": RetrainSignal.rating_sum + rating,
+                "rating_sq_sum": RetrainSignal.rating_sq_sum + rating * rating,
+                "last_event_at": now
+            }
+        ))
+    
+    @staticmethod
+    def get_signals(db):
+        """Devuelve los contadores actuales como dict"""
+        signal = db.query(RetrainSignal).filter(
+            RetrainSignal.id == RetrainSignalCRUD.SIGNAL_ID
+        ).first()
+        if signal is None:
+            return {
+                "new_ratings": 0, "new_users": 0,
+                "rating_sum": 0.0, "rating_sq_sum": 0.0,
+                "last_event_at": None
+            }
+        return {
+            "new_ratings": signal.new_ratings,
+            "new_users": signal.new_users,
+            "rating_sum": signal.rating_sum,
+            "rating_sq_sum": signal.rating_sq_sum,
+            "last_event_at": signal.last_event_at
+        }
+    
+    @staticmethod
+    def consume(db, snapshot: dict):
+        """
+        Descuenta de los contadores lo incluido en un reentrenamiento.
+        Los eventos llegados durante el entrenamiento se conservan.
+        """
+        db.query(RetrainSignal).filter(
+            RetrainSignal.id == RetrainSignalCRUD.SIGNAL_ID
+        ).update({
+            RetrainSignal.new_ratings: RetrainSignal.new_ratings - snapshot["new_ratings"],
+            RetrainSignal.new_users: RetrainSignal.new_users - snapshot["new_users"],
+            RetrainSignal.rating_sum: RetrainSignal.rating_sum - snapshot["rating_sum"],
+            RetrainSignal.rating_sq_sum: RetrainSignal.rating_sq_sum - snapshot["rating_sq_sum"]
+        }, synchronize_session=False)
+        db.commit()
+
+
 # ============================================================================
 # INICIALIZACIÓN
 # ============================================================================
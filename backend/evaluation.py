@@ -0,0 +1,355 @@
+"""
+Evaluación Offline Vectorizada del Modelo SVD
+Sistema de Recomendación de Películas - Grupo 8
+
+model.test() crea un objeto Prediction por rating de test y accuracy.rmse /
+accuracy.mae los recorren de nuevo. Aquí el testset se convierte una sola vez
+en arrays de índices internos y todas las estimaciones se calculan juntas con
+las filas de factores y un producto escalar por fila, reproduciendo las reglas
+de SVD.estimate (usuarios/ítems desconocidos y recorte a la escala).
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+from surprise import accuracy
+
+from serving_model import trainset_arrays
+
+
+def _inner_ids(raw_to_inner: Dict, raw_ids) -> np.ndarray:
+    """Traduce ids raw a ids internos en bloque (-1 si no están en el trainset)"""
+    index = pd.Index(list(raw_to_inner.keys()))
+    inner = np.fromiter(raw_to_inner.values(), dtype=np.int64, count=len(raw_to_inner))
+    pos = index.get_indexer(pd.Index(raw_ids))
+    return np.where(pos >= 0, inner[np.maximum(pos, 0)], -1)
+
+
+def testset_arrays(trainset, testset) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Convierte un testset de Surprise en arrays (usuarios, ítems, ratings) internos"""
+    users = _inner_ids(trainset._raw2inner_id_users, [t[0] for t in testset])
+    items = _inner_ids(trainset._raw2inner_id_items, [t[1] for t in testset])
+    ratings = np.fromiter((t[2] for t in testset), dtype=np.float64, count=len(testset))
+    return users, items, ratings
+
+
+def _rowwise_dot(pu, qi, users, items, chunk_size=8192) -> np.ndarray:
+    """pu[users] · qi[items] fila a fila, por bloques para no copiar todos los factores"""
+    out = np.empty(len(users), dtype=np.float64)
+    for start in range(0, len(users), chunk_size):
+        end = start + chunk_size
+        out[start:end] = np.einsum('ij,ij->i', pu[users[start:end]], qi[items[start:end]])
+    return out
+
+
+def estimate_batch(model, trainset, users: np.ndarray, items: np.ndarray) -> np.ndarray:
+    """
+    Estimaciones de un SVD para pares (usuario, ítem) internos, con las mismas
+    reglas que SVD.estimate + predict: -1 indica usuario/ítem desconocido.
+    """
+    global_mean = trainset.global_mean
+    known_user = users >= 0
+    known_item = items >= 0
+    both = known_user & known_item
+    u = np.where(known_user, users, 0)
+    i = np.where(known_item, items, 0)
+
+    if model.biased:
+        est = np.full(len(users), global_mean, dtype=np.float64)
+        est += np.where(known_user, model.bu[u], 0.0)
+        est += np.where(known_item, model.bi[i], 0.0)
+        est[both] += _rowwise_dot(model.pu, model.qi, u[both], i[both])
+    else:
+        # Sin sesgos, SVD lanza PredictionImpossible y Surprise usa la media global
+        est = np.full(len(users), global_mean, dtype=np.float64)
+        est[both] = _rowwise_dot(model.pu, model.qi, u[both], i[both])
+
+    lower, upper = trainset.rating_scale
+    return np.clip(est, lower, upper)
+
+
+def _errors_summary(errors: np.ndarray) -> Dict:
+    if len(errors) == 0:
+        return {'n': 0, 'rmse': None, 'mae': None}
+    return {
+        'n': int(len(errors)),
+        'rmse': float(np.sqrt(np.mean(errors ** 2))),
+        'mae': float(np.mean(np.abs(errors)))
+    }
+
+
+def evaluate_ratings(
+    model,
+    trainset,
+    testset,
+    cold_user_max_ratings: int = 20,
+    head_share: float = 0.8
+) -> Dict:
+    """
+    RMSE/MAE de un modelo sobre un testset y su desglose por segmentos.
+
+    Args:
+        model: Modelo de la familia SVD ya entrenado (otros modelos usan model.test)
+        trainset: Trainset con el que se entrenó el modelo
+        testset: Lista de tuplas (user, item, rating) raw
+        cold_user_max_ratings: Usuarios con hasta este nº de ratings de train son "fríos"
+        head_share: Los ítems más populares que suman esta fracción de los ratings
+            de train forman la cabeza; el resto es la cola larga
+
+    Returns:
+        dict con rmse, mae, n y segments (cold_users, warm_users, long_tail_items, head_items)
+    """
+    if not hasattr(model, 'pu'):
+        predictions = model.test(testset)
+        return {
+            'rmse': float(accuracy.rmse(predictions, verbose=False)),
+            'mae': float(accuracy.mae(predictions, verbose=False)),
+            'n': len(predictions),
+            'segments': {}
+        }
+
+    users, items, ratings = testset_arrays(trainset, testset)
+    errors = ratings - estimate_batch(model, trainset, users, items)
+
+    user_counts = np.array([len(trainset.ur[u]) for u in range(trainset.n_users)], dtype=np.int64)
+    item_counts = np.array([len(trainset.ir[i]) for i in range(trainset.n_items)], dtype=np.int64)
+
+    # Usuarios fríos: pocos ratings en train (o ninguno si son desconocidos)
+    test_user_counts = np.where(users >= 0, user_counts[np.maximum(users, 0)], 0)
+    cold = test_user_counts <= cold_user_max_ratings
+
+    # Cola larga: ítems fuera de la cabeza de popularidad (o desconocidos)
+    by_popularity = np.argsort(-item_counts, kind='stable')
+    cumulative = np.cumsum(item_counts[by_popularity])
+    n_head = int(np.searchsorted(cumulative, head_share * cumulative[-1])) + 1 if len(cumulative) else 0
+    is_head = np.zeros(trainset.n_items, dtype=bool)
+    is_head[by_popularity[:n_head]] = True
+    tail = ~np.where(items >= 0, is_head[np.maximum(items, 0)], False)
+
+    overall = _errors_summary(errors)
+    return {
+        'rmse': overall['rmse'],
+        'mae': overall['mae'],
+        'n': overall['n'],
+        'segments': {
+            'cold_users': _errors_summary(errors[cold]),
+            'warm_users': _errors_summary(errors[~cold]),
+            'long_tail_items': _errors_summary(errors[tail]),
+            'head_items': _errors_summary(errors[~tail])
+        }
+    }
+
+
+def format_segments(result: Dict) -> list:
+    """Líneas legibles con el desglose por segmentos"""
+    labels = {
+        'cold_users': 'Usuarios fríos',
+        'warm_users': 'Usuarios con historial',
+        'long_tail_items': 'Películas cola larga',
+        'head_items': 'Películas populares'
+    }
+    lines = []
+    for key, label in labels.items():
+        segment = result.get('segments', {}).get(key)
+        if not segment:
+            continue
+        if segment['n'] == 0:
+            lines.append(f"  {label:<24} n=0")
+        else:
+            lines.append(f"  {label:<24} n={segment['n']:<8} RMSE {segment['rmse']:.5f}  MAE {segment['mae']:.5f}")
+    return lines
+
+
+def _csr_from_pairs(n_rows: int, rows: np.ndarray, cols: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """(indptr, indices) de una matriz dispersa fila -> columnas"""
+    order = np.argsort(rows, kind='stable')
+    indptr = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n_rows), out=indptr[1:])
+    return indptr, cols[order]
+
+
+def _block_mask(indptr: np.ndarray, indices: np.ndarray, block_users: np.ndarray, n_items: int) -> np.ndarray:
+    """Matriz booleana (usuarios del bloque × ítems) a partir de una CSR"""
+    starts, ends = indptr[block_users], indptr[block_users + 1]
+    lengths = ends - starts
+    mask = np.zeros((len(block_users), n_items), dtype=bool)
+    if lengths.sum():
+        rows = np.repeat(np.arange(len(block_users)), lengths)
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        mask[rows, indices[np.repeat(starts, lengths) + offsets]] = True
+    return mask
+
+
+def _rank_block(model, global_mean, train_csr, relevant_csr, n_relevant, block_users, k):
+    """Top-K de un bloque de usuarios y sus métricas por usuario"""
+    n_items = model.qi.shape[0]
+    scores = model.pu[block_users] @ model.qi.T
+    if model.biased:
+        scores += global_mean + model.bu[block_users][:, None] + model.bi[None, :]
+    # Las películas ya valoradas en train no se recomiendan
+    scores[_block_mask(*train_csr, block_users, n_items)] = -np.inf
+
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    top = np.take_along_axis(top, np.argsort(-top_scores, axis=1, kind='stable'), axis=1)
+
+    relevant = _block_mask(*relevant_csr, block_users, n_items)
+    hits = np.take_along_axis(relevant, top, axis=1)
+    n_rel = n_relevant[block_users]
+
+    n_hits = hits.sum(axis=1)
+    discounts = 1.0 / np.log2(np.arange(2, k + 2))
+    dcg = (hits * discounts).sum(axis=1)
+    idcg = np.cumsum(discounts)[np.minimum(n_rel, k) - 1]
+    precision_at_rank = np.cumsum(hits, axis=1) / np.arange(1, k + 1)
+    average_precision = (precision_at_rank * hits).sum(axis=1) / np.minimum(n_rel, k)
+
+    return {
+        'precision': n_hits / k,
+        'recall': n_hits / n_rel,
+        'ndcg': dcg / idcg,
+        'ap': average_precision,
+        'items': np.unique(top)
+    }
+
+
+def evaluate_ranking(
+    model,
+    trainset,
+    testset,
+    k: int = 10,
+    relevance_threshold: float = 4.0,
+    block_size: int = 512,
+    n_jobs: int = None
+) -> Dict:
+    """
+    Métricas top-K (precision, recall, NDCG, MAP y cobertura del catálogo).
+
+    Puntúa a todos los usuarios por bloques (usuarios × películas) con los
+    factores del modelo, excluye lo que ya valoraron en train y toma el top-K
+    con argpartition. Los bloques se reparten entre hilos (NumPy libera el GIL
+    en el producto de matrices y la selección).
+
+    Args:
+        model: SVD entrenado con trainset
+        trainset: Trainset del modelo (sus ratings se excluyen del ranking)
+        testset: Ratings reservados (user, item, rating) raw
+        k: Tamaño de la lista recomendada
+        relevance_threshold: Rating mínimo para considerar relevante una película de test
+        block_size: Usuarios por bloque de puntuación
+        n_jobs: Hilos de trabajo (por defecto, uno por núcleo)
+
+    Returns:
+        dict con precision, recall, ndcg, map, coverage, k y users evaluados
+    """
+    n_users, n_items = trainset.n_users, trainset.n_items
+    k = min(k, n_items)
+
+    train_users, train_items, _ = trainset_arrays(trainset)
+    train_csr = _csr_from_pairs(n_users, train_users, train_items)
+
+    # Relevantes: ratings de test >= umbral. Los de películas desconocidas
+    # cuentan en el denominador del recall aunque no se puedan recomendar
+    users, items, ratings = testset_arrays(trainset, testset)
+    liked = (ratings >= relevance_threshold) & (users >= 0)
+    n_relevant = np.bincount(users[liked], minlength=n_users)
+    known = liked & (items >= 0)
+    relevant_csr = _csr_from_pairs(n_users, users[known], items[known])
+
+    eval_users = np.flatnonzero(n_relevant > 0)
+    empty = {'k': k, 'users': 0, 'precision': None, 'recall': None, 'ndcg': None, 'map': None, 'coverage': None}
+    if len(eval_users) == 0:
+        return empty
+
+    global_mean = trainset.global_mean
+    blocks = [eval_users[s:s + block_size] for s in range(0, len(eval_users), block_size)]
+    with ThreadPoolExecutor(max_workers=n_jobs or os.cpu_count() or 1) as pool:
+        results = list(pool.map(
+            lambda block: _rank_block(model, global_mean, train_csr, relevant_csr, n_relevant, block, k),
+            blocks
+        ))
+
+    def mean_of(key):
+        return float(np.concatenate([r[key] for r in results]).mean())
+
+    recommended = np.unique(np.concatenate([r['items'] for r in results]))
+    return {
+        'k': k,
+        'users': int(len(eval_users)),
+        'precision': mean_of('precision'),
+        'recall': mean_of('recall'),
+        'ndcg': mean_of('ndcg'),
+        'map': mean_of('ap'),
+        'coverage': float(len(recommended) / n_items)
+    }
+
+
+def format_ranking(result: Dict) -> list:
+    """Líneas legibles con las métricas de ranking"""
+    if not result.get('users'):
+        return ["  Ranking: sin usuarios con películas relevantes en test"]
+    k = result['k']
+    return [
+        f"  Precision@{k}: {result['precision']:.4f}   Recall@{k}: {result['recall']:.4f}",
+        f"  NDCG@{k}:      {result['ndcg']:.4f}   MAP@{k}:    {result['map']:.4f}",
+        f"  Cobertura del catálogo: {result['coverage']:.1%} ({result['users']} usuarios)"
+    ]
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    from surprise.model_selection import train_test_split
+
+    from model_registry import ModelRegistry
+    from retrain_model import ModelRetrainer
+
+    parser = argparse.ArgumentParser(description='Evaluación offline (RMSE/MAE y ranking top-K)')
+    parser.add_argument('--model', default='models/svd_model_1m.pkl', help='Modelo cuyos parámetros se reutilizan')
+    parser.add_argument('--k', type=int, default=10, help='Tamaño de la lista recomendada')
+    parser.add_argument('--threshold', type=float, default=4.0, help='Rating mínimo para considerar relevante')
+    parser.add_argument('--jobs', type=int, default=None, help='Hilos de trabajo (por defecto, uno por núcleo)')
+    args = parser.parse_args()
+
+    print("="*70)
+    print("EVALUACIÓN OFFLINE - RMSE/MAE Y RANKING TOP-K")
+    print("="*70)
+
+    # Mismos datos y split que el reentrenamiento; parámetros del modelo actual
+    manifest = ModelRegistry.for_model_path(args.model).get_manifest() or {}
+    params = manifest.get('params') or {}
+    retrainer = ModelRetrainer(args.model)
+    data = retrainer.combine_datasets(
+        retrainer.load_original_movielens_data(),
+        retrainer.load_database_ratings()
+    )
+    trainset, testset = train_test_split(data, test_size=0.2, random_state=42)
+    model = retrainer._build_model(
+        params.get('n_factors', 100),
+        params.get('n_epochs', 20),
+        params.get('lr_all', 0.005),
+        params.get('reg_all', 0.02),
+        verbose=False
+    )
+    print(f"\nAjustando modelo de evaluación con {trainset.n_ratings} ratings...")
+    model.fit(trainset)
+
+    start = time.perf_counter()
+    ratings_result = evaluate_ratings(model, trainset, testset)
+    ratings_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    ranking_result = evaluate_ranking(model, trainset, testset, k=args.k,
+                                      relevance_threshold=args.threshold, n_jobs=args.jobs)
+    ranking_seconds = time.perf_counter() - start
+
+    print(f"\nRMSE: {ratings_result['rmse']:.5f}   MAE: {ratings_result['mae']:.5f}   ({ratings_seconds:.2f}s)")
+    for line in format_segments(ratings_result):
+        print(line)
+    print(f"\nRanking top-{ranking_result['k']} ({ranking_seconds:.2f}s):")
+    for line in format_ranking(ranking_result):
+        print(line)
+    print("="*70)
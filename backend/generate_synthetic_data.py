@@ -0,0 +1,383 @@
+"""
+Generador de Datos Sintéticos a Gran Escala
+Sistema de Recomendación de Películas - Grupo 8
+
+Genera usuarios, películas y ratings sintéticos para probar la API, la capa
+SQLite y los entrenadores a la escala prevista (p. ej. 500k usuarios y 50M
+ratings) en lugar de los 6k usuarios de MovieLens 1M:
+
+- Popularidad de las películas y actividad de los usuarios según leyes de
+  potencia (parámetros de sesgo --item-skew y --user-skew)
+- Ratings a partir de sesgos y factores latentes, con ruido, para que el
+  corpus sea aprendible por el SVD
+- Generación por bloques de usuarios con semilla propia por bloque: la misma
+  configuración produce siempre el mismo corpus
+
+Salidas:
+- Corpus columnar en un directorio: user_id.npy, movie_id.npy, rating.npy y
+  timestamp.npy (se pueden abrir con mmap), movies.dat y meta.json
+- Tablas users y ratings de movie_recommender.db, cargadas con executemany
+  en transacciones grandes (no se tocan los contadores de reentrenamiento)
+
+Uso:
+    python generate_synthetic_data.py --users 500000 --movies 20000 --ratings 50000000
+    python generate_synthetic_data.py --users 20000 --ratings 1000000 --db-ratings 0
+    python retrain_model.py --corpus data/synthetic --no-backup
+"""
+
+import json
+import os
+import time
+from typing import Dict, Iterator, Optional
+
+import numpy as np
+import pandas as pd
+
+GENRES = [
+    "Action", "Adventure", "Animation", "Children's", "Comedy", "Crime", "Documentary",
+    "Drama", "Fantasy", "Film-Noir", "Horror", "Musical", "Mystery", "Romance",
+    "Sci-Fi", "Thriller", "War", "Western"
+]
+
+COLUMNS = {"user_id": np.int32, "movie_id": np.int32, "rating": np.float32, "timestamp": np.int64}
+
+# Rango de fechas de MovieLens 1M (abril de 2000 a febrero de 2003)
+TIMESTAMP_START = 956703932
+TIMESTAMP_END = 1046454590
+
+N_LATENT = 8
+
+
+def power_law_weights(n: int, skew: float, rng: np.random.Generator) -> np.ndarray:
+    """Pesos normalizados rank^-skew asignados a los n elementos en orden aleatorio"""
+    weights = 1.0 / np.arange(1, n + 1) ** skew
+    rng.shuffle(weights)
+    return weights / weights.sum()
+
+
+def user_activity(
+    n_users: int,
+    n_ratings: int,
+    n_movies: int,
+    skew: float,
+    min_ratings: int,
+    rng: np.random.Generator
+) -> np.ndarray:
+    """
+    Ratings por usuario: min_ratings a cada uno y el resto repartido según una
+    ley de potencia, con un tope de la mitad del catálogo. La suma es exacta.
+    """
+    cap = max(min_ratings, n_movies // 2)
+    if n_ratings < n_users * min_ratings or n_ratings > n_users * cap:
+        raise ValueError(
+            f"{n_ratings} ratings no caben entre {n_users * min_ratings} y {n_users * cap} "
+            f"({min_ratings}-{cap} por usuario)"
+        )
+
+    counts = np.full(n_users, min_ratings, dtype=np.int64)
+    remaining = n_ratings - counts.sum()
+    weights = power_law_weights(n_users, skew, rng)
+    while remaining > 0:
+        room = cap - counts
+        share = np.where(room > 0, weights, 0.0)
+        extra = np.minimum(np.floor(share / share.sum() * remaining).astype(np.int64), room)
+        if extra.sum() == 0:
+            # Restos del redondeo: uno más a los usuarios más activos con hueco
+            order = np.argsort(-share)
+            extra[order[:remaining]] = 1
+            extra = np.minimum(extra, room)
+        counts += extra
+        remaining = n_ratings - counts.sum()
+    return counts
+
+
+def generate_movies(n_movies: int, rng: np.random.Generator) -> pd.DataFrame:
+    """Catálogo con títulos, años y de 1 a 3 géneros por película"""
+    years = rng.integers(1919, 2001, n_movies)
+    n_genres = rng.integers(1, 4, n_movies)
+    genre_ids = rng.integers(0, len(GENRES), (n_movies, 3))
+    genres = [
+        "|".join(dict.fromkeys(GENRES[g] for g in genre_ids[i, :n_genres[i]]))
+        for i in range(n_movies)
+    ]
+    return pd.DataFrame({
+        "movieId": np.arange(1, n_movies + 1),
+        "title": [f"Synthetic Movie {i} ({y})" for i, y in zip(range(1, n_movies + 1), years)],
+        "genres": genres
+    })
+
+
+def _sample_items(cdf: np.ndarray, size: int, rng: np.random.Generator) -> np.ndarray:
+    return np.searchsorted(cdf, rng.random(size) * cdf[-1], side="right")
+
+
+def _user_items(
+    first_user: int,
+    counts: np.ndarray,
+    cdf: np.ndarray,
+    n_movies: int,
+    rng: np.random.Generator
+):
+    """
+    Películas distintas para cada usuario del bloque: se muestrea con
+    reemplazo según la popularidad, se eliminan duplicados y se repone el
+    déficit; lo que falte tras varias rondas se completa uniformemente.
+    """
+    user_index = np.repeat(np.arange(len(counts), dtype=np.int64), counts)
+    keys = np.unique(user_index * n_movies + _sample_items(cdf, len(user_index), rng))
+    for _ in range(10):
+        deficit = counts - np.bincount(keys // n_movies, minlength=len(counts))
+        if not deficit.any():
+            break
+        extra_users = np.repeat(np.arange(len(counts), dtype=np.int64), deficit)
+        keys = np.unique(np.concatenate([keys, extra_users * n_movies + _sample_items(cdf, len(extra_users), rng)]))
+    else:
+        deficit = counts - np.bincount(keys // n_movies, minlength=len(counts))
+        extra = []
+        for u in np.flatnonzero(deficit):
+            rated = keys[(keys // n_movies) == u] % n_movies
+            free = np.setdiff1d(np.arange(n_movies), rated)
+            extra.append(u * n_movies + rng.choice(free, deficit[u], replace=False))
+        if extra:
+            keys = np.unique(np.concatenate([keys] + extra))
+
+    return first_user + keys // n_movies, keys % n_movies
+
+
+def generate_ratings(
+    n_users: int,
+    n_movies: int,
+    n_ratings: int,
+    item_skew: float = 1.0,
+    user_skew: float = 1.0,
+    min_ratings: int = 20,
+    seed: int = 42,
+    chunk_users: int = 20000
+) -> Iterator[Dict[str, np.ndarray]]:
+    """
+    Genera los ratings por bloques de usuarios. Cada bloque devuelve las
+    columnas de COLUMNS (ids 1-based) y usa su propia semilla derivada de
+    (seed, índice del bloque).
+    """
+    rng = np.random.default_rng(seed)
+    counts = user_activity(n_users, n_ratings, n_movies, user_skew, min_ratings, rng)
+    popularity = power_law_weights(n_movies, item_skew, rng)
+    cdf = np.cumsum(popularity)
+
+    # Las películas populares se valoran algo mejor, como en MovieLens
+    log_pop = np.log(popularity)
+    item_bias = 0.25 * (log_pop - log_pop.mean()) / log_pop.std() + rng.normal(0, 0.3, n_movies)
+    # Centrado con la frecuencia esperada de cada película: como un usuario no
+    # repite película, las más populares aparecen menos de lo que indica p
+    values, multiplicity = np.unique(counts, return_counts=True)
+    expected = sum(m * -np.expm1(c * np.log1p(-popularity)) for c, m in zip(values, multiplicity))
+    item_bias -= expected @ item_bias / expected.sum()
+    item_factors = rng.normal(0, 0.35, (n_movies, N_LATENT))
+
+    for chunk_index, first in enumerate(range(0, n_users, chunk_users)):
+        last = min(first + chunk_users, n_users)
+        chunk_rng = np.random.default_rng([seed, chunk_index])
+        user_bias = chunk_rng.normal(0, 0.35, last - first)
+        user_factors = chunk_rng.normal(0, 0.35, (last - first, N_LATENT))
+
+        users, items = _user_items(first, counts[first:last], cdf, n_movies, chunk_rng)
+        local = users - first
+        # Base algo mayor que 3.58: el recorte a 1-5 pesa más por arriba
+        scores = (
+            3.7 + user_bias[local] + item_bias[items]
+            + np.einsum("ij,ij->i", user_factors[local], item_factors[items])
+            + chunk_rng.normal(0, 0.8, len(users))
+        )
+        yield {
+            "user_id": (users + 1).astype(np.int32),
+            "movie_id": (items + 1).astype(np.int32),
+            "rating": np.clip(np.rint(scores), 1, 5).astype(np.float32),
+            "timestamp": chunk_rng.integers(TIMESTAMP_START, TIMESTAMP_END, len(users), dtype=np.int64)
+        }
+
+
+def write_corpus(
+    output_dir: str,
+    n_users: int,
+    n_movies: int,
+    n_ratings: int,
+    item_skew: float = 1.0,
+    user_skew: float = 1.0,
+    min_ratings: int = 20,
+    seed: int = 42,
+    chunk_users: int = 20000
+) -> Dict:
+    """Escribe el corpus columnar (.npy por columna), movies.dat y meta.json"""
+    os.makedirs(output_dir, exist_ok=True)
+    start = time.perf_counter()
+
+    movies = generate_movies(n_movies, np.random.default_rng([seed, 2**31]))
+    with open(os.path.join(output_dir, "movies.dat"), "w", encoding="latin-1") as f:
+        for row in movies.itertuples(index=False):
+            f.write(f"{row.movieId}::{row.title}::{row.genres}\n")
+
+    columns = {
+        name: np.lib.format.open_memmap(
+            os.path.join(output_dir, f"{name}.npy"), mode="w+", dtype=dtype, shape=(n_ratings,)
+        )
+        for name, dtype in COLUMNS.items()
+    }
+    offset = 0
+    for chunk in generate_ratings(n_users, n_movies, n_ratings, item_skew, user_skew,
+                                  min_ratings, seed, chunk_users):
+        size = len(chunk["user_id"])
+        for name, column in columns.items():
+            column[offset:offset + size] = chunk[name]
+        offset += size
+        print(f"  • {offset:,}/{n_ratings:,} ratings ({100 * offset / n_ratings:.0f}%)", end="\r")
+    print()
+    for column in columns.values():
+        column.flush()
+
+    ratings = columns["rating"]
+    meta = {
+        "n_users": n_users,
+        "n_movies": n_movies,
+        "n_ratings": int(offset),
+        "item_skew": item_skew,
+        "user_skew": user_skew,
+        "min_ratings": min_ratings,
+        "seed": seed,
+        "chunk_users": chunk_users,
+        "mean_rating": round(float(ratings.mean(dtype=np.float64)), 4),
+        "generated_at": pd.Timestamp.now().isoformat(),
+        "generation_seconds": round(time.perf_counter() - start, 2)
+    }
+    with open(os.path.join(output_dir, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    del columns
+    return meta
+
+
+def load_corpus(corpus_dir: str, mmap: bool = True) -> Dict[str, np.ndarray]:
+    """Columnas del corpus (por defecto mapeadas en memoria, sin copiarlas)"""
+    return {
+        name: np.load(os.path.join(corpus_dir, f"{name}.npy"), mmap_mode="r" if mmap else None)
+        for name in COLUMNS
+    }
+
+
+def corpus_dataset(corpus_dir: str):
+    """Dataset de Surprise con los ratings del corpus (ids como cadenas, igual que ml-1m)"""
+    from surprise import Dataset, Reader
+
+    columns = load_corpus(corpus_dir)
+    df = pd.DataFrame({
+        "user": columns["user_id"].astype(str),
+        "item": columns["movie_id"].astype(str),
+        "rating": np.asarray(columns["rating"], dtype=np.float64)
+    })
+    return Dataset.load_from_df(df, Reader(rating_scale=(1, 5)))
+
+
+def fill_database(
+    corpus_dir: str,
+    database_url: Optional[str] = None,
+    user_prefix: str = "syn",
+    max_ratings: Optional[int] = None,
+    batch_size: int = 200000
+) -> Dict:
+    """
+    Carga usuarios y ratings del corpus en las tablas users y ratings con
+    executemany del driver, una transacción por lote y PRAGMAs de carga masiva.
+    Los ids de usuario llevan user_prefix para no chocar con los de MovieLens.
+    """
+    from sqlalchemy import create_engine, text
+    from database import DATABASE_URL, Base
+
+    engine = create_engine(database_url or DATABASE_URL)
+    Base.metadata.create_all(bind=engine)
+    columns = load_corpus(corpus_dir)
+    n_ratings = len(columns["user_id"]) if max_ratings is None else min(max_ratings, len(columns["user_id"]))
+    n_users = int(columns["user_id"][:n_ratings].max()) if n_ratings else 0
+    start = time.perf_counter()
+
+    with engine.connect() as conn:
+        existing = conn.execute(
+            text("SELECT COUNT(*) FROM users WHERE user_id LIKE :prefix"), {"prefix": f"{user_prefix}%"}
+        ).scalar()
+        if existing:
+            print(f"⚠️ Ya hay {existing} usuarios con el prefijo '{user_prefix}'; no se cargan de nuevo")
+            return {"users": 0, "ratings": 0, "seconds": 0.0}
+
+        conn.exec_driver_sql("PRAGMA synchronous = OFF")
+        conn.exec_driver_sql("PRAGMA journal_mode = MEMORY")
+        conn.commit()
+
+        for first in range(0, n_users, batch_size):
+            ids = range(first + 1, min(first + batch_size, n_users) + 1)
+            conn.exec_driver_sql(
+                "INSERT INTO users (user_id, mail, user_name, password) VALUES (?, ?, ?, ?)",
+                [(f"{user_prefix}{i}", f"{user_prefix}{i}@example.com", f"{user_prefix}{i}", "synthetic")
+                 for i in ids]
+            )
+            conn.commit()
+
+        for first in range(0, n_ratings, batch_size):
+            last = min(first + batch_size, n_ratings)
+            user_ids = np.char.add(user_prefix, columns["user_id"][first:last].astype(str))
+            timestamps = np.char.add(
+                np.char.replace(np.datetime_as_string(columns["timestamp"][first:last].astype("datetime64[s]")), "T", " "),
+                ".000000"
+            )
+            conn.exec_driver_sql(
+                "INSERT INTO ratings (user_id, movie_id, rating, timestamp) VALUES (?, ?, ?, ?)",
+                list(zip(
+                    user_ids.tolist(),
+                    columns["movie_id"][first:last].astype(str).tolist(),
+                    columns["rating"][first:last].astype(float).tolist(),
+                    timestamps.tolist()
+                ))
+            )
+            conn.commit()
+            print(f"  • {last:,}/{n_ratings:,} ratings en la BD", end="\r")
+        print()
+
+    engine.dispose()
+    return {"users": n_users, "ratings": n_ratings, "seconds": round(time.perf_counter() - start, 2)}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Genera usuarios, películas y ratings sintéticos')
+    parser.add_argument('--users', type=int, default=500000, help='Número de usuarios')
+    parser.add_argument('--movies', type=int, default=20000, help='Número de películas')
+    parser.add_argument('--ratings', type=int, default=50000000, help='Número total de ratings')
+    parser.add_argument('--item-skew', type=float, default=1.0, help='Exponente de la popularidad de películas')
+    parser.add_argument('--user-skew', type=float, default=1.0, help='Exponente de la actividad de usuarios')
+    parser.add_argument('--min-ratings', type=int, default=20, help='Ratings mínimos por usuario')
+    parser.add_argument('--seed', type=int, default=42, help='Semilla')
+    parser.add_argument('--chunk-users', type=int, default=20000, help='Usuarios por bloque de generación')
+    parser.add_argument('--output', default='data/synthetic', help='Directorio del corpus')
+    parser.add_argument('--database-url', default=None, help='BD a rellenar (por defecto la de database.py)')
+    parser.add_argument('--db-ratings', type=int, default=None,
+                        help='Ratings a cargar en la BD (por defecto todos; 0 para no tocarla)')
+    parser.add_argument('--user-prefix', default='syn', help='Prefijo de los ids de usuario en la BD')
+    parser.add_argument('--batch-size', type=int, default=200000, help='Filas por transacción en la BD')
+    args = parser.parse_args()
+
+    print("="*70)
+    print("GENERACIÓN DE DATOS SINTÉTICOS")
+    print("="*70)
+    print(f"{args.users:,} usuarios | {args.movies:,} películas | {args.ratings:,} ratings | "
+          f"sesgo películas {args.item_skew} | sesgo usuarios {args.user_skew} | semilla {args.seed}")
+
+    meta = write_corpus(
+        args.output, args.users, args.movies, args.ratings, args.item_skew, args.user_skew,
+        args.min_ratings, args.seed, args.chunk_users
+    )
+    print(f"✓ Corpus escrito en {args.output} ({meta['generation_seconds']} s, "
+          f"rating medio {meta['mean_rating']})")
+
+    if args.db_ratings != 0:
+        loaded = fill_database(args.output, args.database_url, args.user_prefix, args.db_ratings, args.batch_size)
+        if loaded["ratings"]:
+            print(f"✓ BD rellenada: {loaded['users']:,} usuarios y {loaded['ratings']:,} ratings "
+                  f"({loaded['seconds']} s)")
+    print("="*70)
@@ -0,0 +1,268 @@
+"""
+Ejecutor de Inferencia Fuera del Event Loop
+Sistema de Recomendación de Películas - Grupo 8
+
+Los handlers de main.py son async def, pero las llamadas al recomendador
+(puntuar el catálogo, leer y escribir ratings en SQLite) son síncronas y
+bloquean el event loop: una recomendación lenta retrasa /health y el resto de
+peticiones. InferenceExecutor ejecuta esas llamadas en un pool, que puede ser
+de hilos (por defecto) o de procesos.
+
+Límites del pool:
+- Cola acotada: si ya hay INFERENCE_WORKERS + INFERENCE_QUEUE_SIZE tareas
+  pendientes, la petición se rechaza al momento en lugar de encolarse sin fin.
+- Timeout: si una petición espera más de INFERENCE_TIMEOUT segundos, deja de
+  esperar. La tarea sale de la cola si aún no ha empezado.
+En ambos casos se lanza InferenceRejected, que la API devuelve como 503 con
+Retry-After.
+
+Las tareas que leen o escriben en la BD (run(..., with_db=True)) abren su
+propia sesión dentro del pool y la cierran al terminar. La sesión de la
+petición no se pasa nunca al pool: tras un timeout la API responde y la
+cerraría mientras la tarea aún la usa. Las sesiones salen de la fábrica del
+ejecutor (database.SessionLocal por defecto; load_test.py la cambia por la
+del fixture con set_session_factory).
+
+Modos (INFERENCE_EXECUTOR):
+- thread: pool de hilos que comparte el recomendador del proceso y propaga
+  el contexto (spans de tracing.py).
+- process: pool de procesos (spawn). Cada proceso carga su propio
+  recomendador; conviene usarlo con SHARED_MODEL_STORE para mapear el modelo
+  en vez de deserializarlo. Cada proceso abre sus propias sesiones de BD, y
+  sus métricas y spans no llegan al proceso de la API.
+- inline: ejecuta en el event loop, como antes (solo para comparar en
+  benchmarks).
+"""
+
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional
+
+from metrics import INFERENCE_PENDING, INFERENCE_QUEUE_WAIT, INFERENCE_REJECTED
+
+MODES = ("thread", "process", "inline")
+
+
+class InferenceRejected(Exception):
+    """La petición no se ejecuta: cola llena (overload) o espera agotada (timeout)"""
+
+    def __init__(self, reason: str, retry_after: int = 1):
+        super().__init__(
+            "Servidor saturado, inténtalo de nuevo en unos segundos" if reason == "overload"
+            else "Tiempo de espera de inferencia agotado"
+        )
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+# ============================================================================
+# PROCESOS DEL POOL (modo process)
+# ============================================================================
+
+_process_recommender = None
+_process_config = {}
+
+
+def _init_process(model_path: str, movies_path: str, shared_store: Optional[str]):
+    global _process_recommender
+    from model_inference_with_db import MovieRecommenderDB
+
+    _process_config.update(model_path=model_path, movies_path=movies_path, shared_store=shared_store)
+    _process_recommender = MovieRecommenderDB(model_path, movies_path=movies_path, shared_store=shared_store)
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def _current_version() -> Optional[str]:
+    """Versión CURRENT del almacén compartido o del registro (solo lee el puntero)"""
+    if _process_config['shared_store']:
+        from shared_model_store import SharedModelStore
+        return SharedModelStore(_process_config['shared_store']).current_generation()
+    from model_registry import ModelRegistry
+    return ModelRegistry.for_model_path(_process_config['model_path']).current_version()
+
+
+def _ensure_current_model(model_version: str):
+    """
+    Recarga el recomendador del proceso solo si no tiene ya la versión CURRENT.
+    Tras una publicación, la API puede seguir pidiendo la versión anterior
+    hasta su siguiente comprobación: el proceso no recarga por eso, y cada
+    versión pedida distinta de la cargada se comprueba una sola vez.
+    """
+    global _process_recommender
+    loaded = _process_recommender.model_version
+    if model_version == loaded or _process_config.get('checked') == (model_version, loaded):
+        return
+    _process_config['checked'] = (model_version, loaded)
+    current = _current_version()
+    if current is None or current == loaded:
+        return
+    from model_inference_with_db import MovieRecommenderDB
+    _process_recommender = MovieRecommenderDB(
+        _process_config['model_path'], movies_path=_process_config['movies_path'],
+        shared_store=_process_config['shared_store']
+    )
+
+
+def _call_in_process(model_version: str, method: str, with_db: bool, args: tuple, kwargs: dict):
+    """Ejecuta recommender.<method> en el proceso, con la versión CURRENT del modelo"""
+    _ensure_current_model(model_version)
+    bound = getattr(_process_recommender, method)
+    if not with_db:
+        return bound(*args, **kwargs)
+    from database import SessionLocal
+    return _call_with_session(SessionLocal, bound, args, kwargs)
+
+
+def _call_with_session(session_factory: Callable, bound, args: tuple, kwargs: dict):
+    """
+    Ejecuta bound(db, *args, **kwargs) con una sesión propia de la tarea: si
+    la API deja de esperar (timeout), la sesión sigue siendo solo de la tarea
+    y se cierra cuando esta termina
+    """
+    db = session_factory()
+    try:
+        return bound(db, *args, **kwargs)
+    finally:
+        db.close()
+
+
+# ============================================================================
+# EJECUTOR
+# ============================================================================
+
+class InferenceExecutor:
+    """Pool acotado para las llamadas síncronas al recomendador"""
+
+    def __init__(self, mode: str = "thread", workers: int = 4, queue_size: int = 32, timeout: float = 10.0,
+                 session_factory: Optional[Callable] = None):
+        """
+        Args:
+            mode: thread, process o inline
+            workers: Hilos o procesos del pool
+            queue_size: Tareas que pueden esperar además de las que se ejecutan
+            timeout: Segundos máximos de espera por petición (0 = sin límite)
+            session_factory: Crea las sesiones de las tareas con with_db
+                (por defecto database.SessionLocal)
+        """
+        if mode not in MODES:
+            raise ValueError(f"Modo de ejecutor desconocido: {mode} (válidos: {', '.join(MODES)})")
+        self.mode = mode
+        self.workers = max(1, workers)
+        self.queue_size = max(0, queue_size)
+        self.timeout = timeout
+        self.max_pending = self.workers + self.queue_size
+        self.pending = 0
+        self._pending_lock = threading.Lock()
+        self._executor: Optional[Executor] = None
+        self._session_factory = session_factory
+
+    @property
+    def session_factory(self) -> Callable:
+        if self._session_factory is None:
+            from database import SessionLocal
+            self._session_factory = SessionLocal
+        return self._session_factory
+
+    def set_session_factory(self, session_factory: Optional[Callable]):
+        """
+        Cambia la fábrica de sesiones de los modos thread e inline (None vuelve
+        a database.SessionLocal). Los procesos del modo process siempre usan
+        database.SessionLocal.
+        """
+        self._session_factory = session_factory
+
+    @classmethod
+    def from_env(cls) -> "InferenceExecutor":
+        """INFERENCE_EXECUTOR, INFERENCE_WORKERS, INFERENCE_QUEUE_SIZE e INFERENCE_TIMEOUT"""
+        mode = os.getenv("INFERENCE_EXECUTOR", "thread")
+        default_workers = (os.cpu_count() or 1) if mode == "process" else 4
+        return cls(
+            mode=mode,
+            workers=int(os.getenv("INFERENCE_WORKERS", str(default_workers))),
+            queue_size=int(os.getenv("INFERENCE_QUEUE_SIZE", "32")),
+            timeout=float(os.getenv("INFERENCE_TIMEOUT", "10"))
+        )
+
+    def start(self, model_path: str = None, movies_path: str = None, shared_store: str = None):
+        """Crea el pool (en modo process, cada proceso carga su recomendador)"""
+        if self.mode == "thread":
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="inference")
+        elif self.mode == "process":
+            import multiprocessing
+            # spawn: un fork desde un proceso con hilos (event loop, pools) no es seguro
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_process,
+                initargs=(model_path, movies_path, shared_store)
+            )
+            # Los procesos se crean al recibir tareas: se arrancan todos ahora y se
+            # espera a que carguen el modelo, para no servir con el pool a medio cargar
+            for future in [self._executor.submit(_ping) for _ in range(self.workers)]:
+                future.result()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def run(self, recommender, method: str, *args, with_db: bool = False, **kwargs):
+        """
+        Ejecuta recommender.<method>(*args, **kwargs) en el pool. Con with_db,
+        la tarea abre su propia sesión de BD y la pasa como primer argumento
+        (nunca la sesión de la petición, que se cierra al responder). Lanza
+        InferenceRejected si la cola está llena o si se agota el timeout.
+        """
+        bound = getattr(recommender, method)
+        if self.mode == "inline" or self._executor is None:
+            if with_db:
+                return _call_with_session(self.session_factory, bound, args, kwargs)
+            return bound(*args, **kwargs)
+
+        with self._pending_lock:
+            if self.pending >= self.max_pending:
+                INFERENCE_REJECTED.inc(method, "overload")
+                raise InferenceRejected("overload")
+            self.pending += 1
+        INFERENCE_PENDING.inc()
+
+        submitted = time.perf_counter()
+        if self.mode == "thread":
+            if with_db:
+                call = functools.partial(_call_with_session, self.session_factory, bound, args, kwargs)
+            else:
+                call = functools.partial(bound, *args, **kwargs)
+
+            def task():
+                INFERENCE_QUEUE_WAIT.observe(time.perf_counter() - submitted, method)
+                return call()
+
+            # Copia del contexto para que los spans de la petición sigan abiertos en el hilo
+            future = self._executor.submit(contextvars.copy_context().run, task)
+        else:
+            future = self._executor.submit(
+                _call_in_process, recommender.model_version, method, with_db, args, kwargs
+            )
+
+        # El hueco se libera cuando la tarea termina de verdad, no cuando se deja de esperarla
+        future.add_done_callback(self._release)
+
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout or None)
+        except asyncio.TimeoutError:
+            INFERENCE_REJECTED.inc(method, "timeout")
+            raise InferenceRejected("timeout") from None
+
+    def _release(self, _future):
+        # Se llama desde el hilo que completa la tarea
+        with self._pending_lock:
+            self.pending -= 1
+        INFERENCE_PENDING.dec()
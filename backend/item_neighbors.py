@@ -0,0 +1,126 @@
+"""
+Tabla de Vecinos Película-Película
+Sistema de Recomendación de Películas - Grupo 8
+
+get_similar_movies recorre el catálogo entero en cada consulta, y el caso 2
+de las recomendaciones (usuario nuevo con ratings) la llama una vez por cada
+película que le gustó al usuario. Al entrenar (train_model.py y
+retrain_model.py) se calculan las K películas más parecidas a cada película
+(similitud coseno sobre qi, la misma que get_similar_movies) y se guardan
+junto al modelo en el registro como neighbors.npz. La tabla tiene forma
+(películas x K): ids internos en int32 y similitudes en float32.
+
+El cálculo va por bloques de filas: cada bloque es un producto de matrices
+(bloque x catálogo) del que se extrae el top-K con argpartition. Los bloques
+se reparten entre hilos (numpy libera el GIL en el producto), así que la
+memoria es O(bloque x catálogo) y no O(catálogo²).
+
+En servicio (ver serving_model.py), una consulta de similares es un slice de
+la tabla. Si con filtros y exclusiones quedan menos de n vecinos en las K
+filas guardadas, se vuelve a puntuar el catálogo entero.
+
+Uso:
+    python item_neighbors.py                 # calcula la tabla de la versión actual si no la tiene
+    python item_neighbors.py --k 200 --force
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+NEIGHBORS_FILE = "neighbors.npz"
+DEFAULT_K = 100
+
+
+def _block_neighbors(qi: np.ndarray, norms: np.ndarray, start: int, stop: int, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Top-k de las filas [start, stop): ordenadas por similitud y, a igualdad, por id"""
+    similarities = (qi[start:stop] @ qi.T) / (norms[start:stop, None] * norms[None, :])
+    rows = np.arange(stop - start)
+    # Una película no es vecina de sí misma
+    similarities[rows, np.arange(start, stop)] = -np.inf
+    top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+    top_sims = np.take_along_axis(similarities, top, axis=1)
+    # Mismo orden que argsort(-sim, kind='stable') en get_similar_movies: desempate por id
+    order = np.lexsort((top, -top_sims), axis=1)
+    ids = np.take_along_axis(top, order, axis=1)
+    return ids.astype(np.int32), np.take_along_axis(top_sims, order, axis=1).astype(np.float32)
+
+
+def compute_item_neighbors(
+    qi: np.ndarray,
+    k: int = DEFAULT_K,
+    block_size: int = 512,
+    workers: int = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Top-k vecinos por similitud coseno de cada fila de qi
+
+    Args:
+        qi: Factores de las películas (películas x factores)
+        k: Vecinos por película (se recorta a películas - 1)
+        block_size: Filas por producto de matrices
+        workers: Hilos (por defecto, los núcleos disponibles)
+
+    Returns:
+        (ids int32, similitudes float32), ambos de forma (películas x k)
+    """
+    qi = np.ascontiguousarray(qi, dtype=np.float64)
+    n_items = len(qi)
+    k = max(0, min(k, n_items - 1))
+    ids = np.empty((n_items, k), dtype=np.int32)
+    scores = np.empty((n_items, k), dtype=np.float32)
+    if k == 0:
+        return ids, scores
+
+    norms = np.linalg.norm(qi, axis=1)
+
+    def run(start: int):
+        stop = min(start + block_size, n_items)
+        ids[start:stop], scores[start:stop] = _block_neighbors(qi, norms, start, stop, k)
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        list(pool.map(run, range(0, n_items, block_size)))
+    return ids, scores
+
+
+def neighbor_arrays(model, k: int = DEFAULT_K) -> Dict[str, np.ndarray]:
+    """Tabla de vecinos de un SVD de Surprise, lista para ModelRegistry.publish(arrays=...)"""
+    start = time.perf_counter()
+    ids, scores = compute_item_neighbors(model.qi, k)
+    print(f"✓ Tabla de vecinos: {ids.shape[0]} películas x {ids.shape[1]} vecinos "
+          f"({(ids.nbytes + scores.nbytes) / 2**20:.1f} MB) en {time.perf_counter() - start:.2f}s")
+    return {'ids': ids, 'scores': scores}
+
+
+def load_neighbors(registry, version: str) -> Optional[Dict[str, np.ndarray]]:
+    """Tabla de vecinos de una versión del registro (None si se publicó sin ella)"""
+    return registry.read_arrays(version, NEIGHBORS_FILE)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from model_registry import ModelRegistry, load_model_data
+
+    parser = argparse.ArgumentParser(description='Calcula la tabla de vecinos de una versión del modelo')
+    parser.add_argument('--model', default='models/svd_model_1m.pkl', help='Ruta del modelo (su registro)')
+    parser.add_argument('--version', help='Versión del registro (por defecto, la actual)')
+    parser.add_argument('--k', type=int, default=DEFAULT_K, help='Vecinos por película')
+    parser.add_argument('--force', action='store_true', help='Recalcular aunque la versión ya tenga tabla')
+    args = parser.parse_args()
+
+    registry = ModelRegistry.for_model_path(args.model)
+    version = args.version or registry.current_version()
+    if version is None:
+        print("✗ El registro no tiene ninguna versión")
+        raise SystemExit(1)
+    if not args.force and load_neighbors(registry, version) is not None:
+        print(f"ℹ️ La versión {version} ya tiene tabla de vecinos (usa --force para recalcularla)")
+        raise SystemExit(0)
+
+    model_data = load_model_data(registry.artifact_path(version))
+    registry.attach_arrays(version, NEIGHBORS_FILE, neighbor_arrays(model_data['model'], args.k))
+    print(f"✓ Tabla guardada en la versión {version}")
@@ -0,0 +1,385 @@
+"""
+Prueba de Carga HTTP de la API
+Sistema de Recomendación de Películas - Grupo 8
+
+Genera tráfico contra la API con un httpx.AsyncClient siguiendo una mezcla
+configurable de endpoints a un ritmo objetivo (llegadas de Poisson, bucle
+abierto). Por defecto la aplicación de main.py se ejecuta en el mismo proceso
+(ASGITransport) con un modelo sintético y una base de datos SQLite temporal
+sembrada con usuarios sintéticos; con --url se ataca un servidor ya arrancado.
+
+Informa del throughput, latencias p50/p95/p99 por endpoint, tasa de errores y
+retraso del event loop (solo en modo en proceso, donde la API comparte loop).
+
+Uso:
+    python load_test.py --rate 100 --duration 30 --max-in-flight 200
+    python load_test.py --mix from-db=50,popular=50 --rate 20
+    python load_test.py --url http://localhost:8000 --rate 50
+"""
+
+import asyncio
+import json
+import os
+import random
+import shutil
+import tempfile
+from collections import defaultdict
+from typing import Dict, List
+
+import httpx
+import numpy as np
+
+from benchmark_inference import build_fixture
+from database import RatingCRUD, UserCRUD
+
+DEFAULT_MIX = "from-db=40,ratings-add=15,similar=20,popular=10,history=15"
+
+
+# ============================================================================
+# WORKLOAD
+# ============================================================================
+
+class Workload:
+    """Genera peticiones aleatorias para cada tipo de endpoint"""
+
+    def __init__(self, user_ids: List[str], movie_ids: List[str], seed: int = 0):
+        self.user_ids = user_ids
+        self.movie_ids = movie_ids
+        self.rng = random.Random(seed)
+
+    def request(self, kind: str):
+        """Devuelve (método, ruta, cuerpo JSON) para un tipo de petición"""
+        user = self.rng.choice(self.user_ids)
+        movie = self.rng.choice(self.movie_ids)
+        if kind == "from-db":
+            return "POST", "/recommendations/from-db", {"user_id": user, "n": 10}
+        if kind == "ratings-add":
+            return "POST", "/ratings/add", {"user_id": user, "movie_id": movie, "rating": float(self.rng.randint(1, 5))}
+        if kind == "similar":
+            return "POST", "/similar-movies", {"movie_id": movie, "user_id": user, "n": 10}
+        if kind == "popular":
+            return "POST", "/movies/popular", {"n": 10, "min_ratings": 20}
+        if kind == "history":
+            return "GET", f"/ratings/user/{user}", None
+        if kind == "predict":
+            return "POST", "/predict", {"user_id": user, "movie_id": movie}
+        if kind == "health":
+            return "GET", "/health", None
+        raise ValueError(f"Tipo de petición desconocido: {kind}")
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    """'from-db=40,popular=10' -> {'from-db': 0.8, 'popular': 0.2}"""
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        weights[name.strip()] = float(weight or 1)
+    total = sum(weights.values())
+    return {name: w / total for name, w in weights.items() if w > 0}
+
+
+def seed_users(session_factory, n_users: int, n_model_users: int, n_items: int, seed: int = 0) -> List[str]:
+    """
+    Crea usuarios sintéticos en la BD del fixture: la mitad del trainset con
+    algunos ratings en la app, un 30% nuevos con ratings y un 20% sin ratings
+    """
+    rng = np.random.default_rng(seed)
+    db = session_factory()
+    user_ids = []
+    try:
+        n_trainset = min(n_users // 2, n_model_users - 1)
+        n_new = int(n_users * 0.3)
+        # El usuario "1" ya existe en el fixture del benchmark
+        trainset_ids = rng.choice(np.arange(2, n_model_users + 1), size=n_trainset, replace=False)
+        for k in range(n_users):
+            if k < n_trainset:
+                user_id, n_ratings = str(trainset_ids[k]), 3
+            elif k < n_trainset + n_new:
+                user_id, n_ratings = f"load_new_{k}", int(rng.integers(3, 12))
+            else:
+                user_id, n_ratings = f"load_cold_{k}", 0
+            UserCRUD.create_user(db, user_id, f"{user_id}_{k}@load.local", f"{user_id}_{k}", "load")
+            for movie in rng.choice(np.arange(1, n_items + 1), size=n_ratings, replace=False):
+                RatingCRUD.create_rating(db, user_id, str(movie), float(rng.choice([3.0, 4.0, 4.5, 5.0])))
+            user_ids.append(user_id)
+    finally:
+        db.close()
+    return user_ids
+
+
+# ============================================================================
+# EJECUCIÓN
+# ============================================================================
+
+class LoopLagMonitor:
+    """Mide cuánto se retrasa el event loop respecto a un sleep periódico"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples: List[float] = []
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - start - self.interval) * 1000)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+async def run_load(
+    client: httpx.AsyncClient,
+    workload: Workload,
+    mix: Dict[str, float],
+    rate: float,
+    duration: float,
+    max_in_flight: int,
+    timeout: float,
+    seed: int = 0
+) -> Dict:
+    """
+    Lanza peticiones con llegadas de Poisson a `rate` por segundo durante
+    `duration` segundos. La latencia se mide desde el instante programado
+    (incluye la espera por --max-in-flight), evitando la omisión coordinada.
+    """
+    rng = random.Random(seed)
+    kinds, weights = list(mix.keys()), list(mix.values())
+    semaphore = asyncio.Semaphore(max_in_flight)
+    results = defaultdict(lambda: {"latencies": [], "statuses": defaultdict(int), "errors": 0})
+    loop = asyncio.get_running_loop()
+    in_flight_peak = 0
+    in_flight = 0
+
+    async def one_request(kind: str, scheduled: float):
+        nonlocal in_flight, in_flight_peak
+        method, path, body = workload.request(kind)
+        async with semaphore:
+            in_flight += 1
+            in_flight_peak = max(in_flight_peak, in_flight)
+            try:
+                response = await client.request(method, path, json=body, timeout=timeout)
+                results[kind]["statuses"][response.status_code] += 1
+                if response.status_code >= 400:
+                    results[kind]["errors"] += 1
+            except Exception as e:
+                results[kind]["statuses"][type(e).__name__] += 1
+                results[kind]["errors"] += 1
+            finally:
+                in_flight -= 1
+                results[kind]["latencies"].append((loop.time() - scheduled) * 1000)
+
+    tasks = []
+    start = loop.time()
+    next_at = start
+    while True:
+        next_at += rng.expovariate(rate)
+        if next_at - start > duration:
+            break
+        delay = next_at - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        kind = rng.choices(kinds, weights)[0]
+        tasks.append(asyncio.create_task(one_request(kind, next_at)))
+    await asyncio.gather(*tasks)
+    elapsed = loop.time() - start
+
+    return {"per_endpoint": results, "elapsed": elapsed, "in_flight_peak": in_flight_peak}
+
+
+def _latency_summary(latencies: List[float]) -> Dict:
+    if not latencies:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None, "max_ms": None}
+    values = np.asarray(latencies)
+    return {
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2),
+        "p99_ms": round(float(np.percentile(values, 99)), 2),
+        "max_ms": round(float(values.max()), 2)
+    }
+
+
+def summarize(raw: Dict, lag_samples: List[float], target_rate: float) -> Dict:
+    """Agrega las muestras en el informe final"""
+    endpoints = {}
+    all_latencies = []
+    total_requests = total_errors = 0
+    for kind, data in sorted(raw["per_endpoint"].items()):
+        count = len(data["latencies"])
+        total_requests += count
+        total_errors += data["errors"]
+        all_latencies.extend(data["latencies"])
+        endpoints[kind] = {
+            "requests": count,
+            "throughput_rps": round(count / raw["elapsed"], 2),
+            "error_rate": round(data["errors"] / count, 4) if count else 0.0,
+            "statuses": {str(k): v for k, v in data["statuses"].items()},
+            **_latency_summary(data["latencies"])
+        }
+
+    report = {
+        "target_rate_rps": target_rate,
+        "elapsed_seconds": round(raw["elapsed"], 2),
+        "requests": total_requests,
+        "throughput_rps": round(total_requests / raw["elapsed"], 2),
+        "error_rate": round(total_errors / total_requests, 4) if total_requests else 0.0,
+        "in_flight_peak": raw["in_flight_peak"],
+        **_latency_summary(all_latencies),
+        "endpoints": endpoints
+    }
+    if lag_samples:
+        lag = np.asarray(lag_samples)
+        report["event_loop_lag"] = {
+            "p50_ms": round(float(np.percentile(lag, 50)), 2),
+            "p99_ms": round(float(np.percentile(lag, 99)), 2),
+            "max_ms": round(float(lag.max()), 2)
+        }
+    return report
+
+
+def format_report(report: Dict) -> List[str]:
+    lines = [
+        f"Peticiones: {report['requests']} en {report['elapsed_seconds']}s | "
+        f"throughput {report['throughput_rps']} req/s (objetivo {report['target_rate_rps']}) | "
+        f"errores {report['error_rate']:.2%} | pico en vuelo {report['in_flight_peak']}",
+        f"Latencia global: p50 {report['p50_ms']} ms | p95 {report['p95_ms']} ms | p99 {report['p99_ms']} ms",
+    ]
+    if "event_loop_lag" in report:
+        lag = report["event_loop_lag"]
+        lines.append(f"Retraso del event loop: p50 {lag['p50_ms']} ms | p99 {lag['p99_ms']} ms | máx {lag['max_ms']} ms")
+    lines.append("-"*70)
+    lines.append(f"{'Endpoint':<14}{'Peticiones':>11}{'req/s':>9}{'Errores':>9}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for kind, e in report["endpoints"].items():
+        lines.append(
+            f"{kind:<14}{e['requests']:>11}{e['throughput_rps']:>9.1f}{e['error_rate']:>9.1%}"
+            f"{e['p50_ms'] or 0:>9.1f}{e['p95_ms'] or 0:>9.1f}{e['p99_ms'] or 0:>9.1f}"
+        )
+    return lines
+
+
+async def run_in_process(args, mix: Dict[str, float]) -> Dict:
+    """Arranca main.app en este proceso contra un fixture temporal y lo carga"""
+    import main
+    from database import get_db
+    from model_inference_with_db import MovieRecommenderDB
+
+    workdir = tempfile.mkdtemp(prefix="load_test_")
+    try:
+        print(f"Construyendo fixture sintético en {workdir}...")
+        fixture = build_fixture(workdir, n_users=args.model_users, n_items=args.items)
+        user_ids = seed_users(fixture['session_factory'], args.seed_users, args.model_users, args.items)
+        print(f"✓ {len(user_ids)} usuarios sintéticos sembrados")
+
+        def get_fixture_db():
+            db = fixture['session_factory']()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        main.app.dependency_overrides[get_db] = get_fixture_db
+        # Las tareas de inferencia con BD abren sus propias sesiones (no usan get_db)
+        main.inference.set_session_factory(fixture['session_factory'])
+        profiler = None
+        if args.profile_queries:
+            from query_profiler import QueryProfiler, QueryProfilerMiddleware
+            profiler = QueryProfiler.from_env()
+            profiler.instrument(fixture['engine'])
+            app = QueryProfilerMiddleware(main.app, profiler)
+        else:
+            app = main.app
+        main.recommender = MovieRecommenderDB(fixture['model_path'], movies_path=fixture['movies_path'])
+        main.recommender.warm_up()
+        # Sin evento de startup: se arranca aquí el pool de inferencia. En modo
+        # process los procesos no verían la BD del fixture, así que se queda en el loop
+        if main.inference.mode == "thread":
+            main.inference.start()
+
+        workload = Workload(user_ids, [str(i) for i in range(1, args.items + 1)])
+        transport = httpx.ASGITransport(app=app)
+        monitor = LoopLagMonitor()
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest") as client:
+            monitor.start()
+            raw = await run_load(client, workload, mix, args.rate, args.duration, args.max_in_flight, args.timeout)
+            await monitor.stop()
+        main.inference.shutdown()
+        main.app.dependency_overrides.pop(get_db, None)
+        main.inference.set_session_factory(None)
+        fixture['engine'].dispose()
+        report = summarize(raw, monitor.samples, args.rate)
+        if profiler is not None:
+            report["db_profile"] = profiler.summary(top=10)
+        return report
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+async def run_remote(args, mix: Dict[str, float]) -> Dict:
+    """Carga un servidor ya arrancado (usuarios del trainset 1..--model-users)"""
+    user_ids = [str(u) for u in range(1, args.model_users + 1)]
+    workload = Workload(user_ids, [str(i) for i in range(1, args.items + 1)])
+    limits = httpx.Limits(max_connections=args.max_in_flight, max_keepalive_connections=args.max_in_flight)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits) as client:
+        raw = await run_load(client, workload, mix, args.rate, args.duration, args.max_in_flight, args.timeout)
+    return summarize(raw, [], args.rate)
+
+
+# ============================================================================
+# MAIN
+# ============================================================================
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Prueba de carga HTTP de la API de recomendación')
+    parser.add_argument('--url', help='URL de un servidor arrancado (por defecto, la app en proceso)')
+    parser.add_argument('--rate', type=float, default=50, help='Peticiones por segundo objetivo')
+    parser.add_argument('--duration', type=float, default=20, help='Duración en segundos')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'Mezcla de endpoints (por defecto: {DEFAULT_MIX})')
+    parser.add_argument('--max-in-flight', type=int, default=200, help='Máximo de peticiones concurrentes')
+    parser.add_argument('--timeout', type=float, default=30, help='Timeout por petición en segundos')
+    parser.add_argument('--seed-users', type=int, default=200, help='Usuarios sintéticos en la BD temporal')
+    parser.add_argument('--model-users', type=int, default=1000, help='Usuarios del modelo sintético')
+    parser.add_argument('--items', type=int, default=1500, help='Películas del modelo sintético')
+    parser.add_argument('--profile-queries', action='store_true',
+                        help='Perfilar las consultas SQL y mostrar las sentencias más costosas')
+    parser.add_argument('--output', help='Guardar el informe en este JSON')
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    print("="*70)
+    print("PRUEBA DE CARGA - API DE RECOMENDACIÓN")
+    print("="*70)
+    print(f"Objetivo: {args.rate} req/s durante {args.duration}s | máx. en vuelo {args.max_in_flight}")
+    print("Mezcla: " + ", ".join(f"{k} {v:.0%}" for k, v in mix.items()))
+    print()
+
+    if args.url:
+        report = asyncio.run(run_remote(args, mix))
+    else:
+        report = asyncio.run(run_in_process(args, mix))
+
+    print("\n" + "="*70)
+    for line in format_report(report):
+        print(line)
+    if "db_profile" in report:
+        from query_profiler import format_summary
+        print("-"*70)
+        for line in format_summary(report["db_profile"]):
+            print(line)
+    print("="*70)
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"✓ Informe guardado en {args.output}")
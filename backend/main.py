@@ -3,16 +3,31 @@ API Backend con FastAPI y Base de Datos
 Sistema de Recomendación de Películas - Grupo 8
 """
 
-from fastapi import FastAPI, HTTPException, Depends
+import asyncio
+import functools
+import os
+import time
+
+from fastapi import FastAPI, HTTPException, Depends, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Dict, List, Literal, Optional, Set
 from datetime import datetime
 from sqlalchemy.orm import Session
 
 # Importar módulos propios
-from database import get_db, create_database, Rating, RatingCRUD, User, UserCRUD
-from model_inference_with_db import MovieRecommenderDB
+from database import get_db, create_database, engine, Rating, RatingCRUD, User, UserCRUD
+from metrics import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE, MODEL_RELOADS, REGISTRY as METRICS_REGISTRY,
+    RETRAIN_DURATION, PrometheusMiddleware, gauge_lines, instrument_engine, record_cache
+)
+from inference_executor import InferenceExecutor, InferenceRejected
+from recommendation_export import DEFAULT_CHUNK_SIZE, DEFAULT_N, checkpoint_record, ndjson_lines
+from request_coalescer import RequestCoalescer
+from response_cache import ResponseCache, etag_matches
+from tracing import Tracer, TracingMiddleware, span
+from user_recommendations import UserRecommendationStore
 
 # Inicializar FastAPI
 app = FastAPI(
@@ -30,22 +45,199 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Crear la base de datos al iniciar
-create_database()
+# Métricas Prometheus: latencia por ruta y consultas SQL (ver /metrics)
+app.add_middleware(PrometheusMiddleware)
+instrument_engine(engine)
+
+# Profiler de consultas por petición (opcional, ver query_profiler.py)
+query_profiler = None
+if os.getenv("QUERY_PROFILER") == "1":
+    from query_profiler import QueryProfiler, QueryProfilerMiddleware
+    query_profiler = QueryProfiler.from_env()
+    query_profiler.instrument(engine)
+    app.add_middleware(QueryProfilerMiddleware, profiler=query_profiler)
 
-# Cargar el modelo al iniciar
+# Trazas por petición (TRACING_SAMPLE_RATE > 0, ver tracing.py). Se añade la
+# última para que el span raíz envuelva al resto de middlewares
+tracer = Tracer.from_env()
+if tracer.enabled:
+    app.add_middleware(TracingMiddleware, tracer=tracer)
+
+# El modelo (y con él pandas/Surprise) y la base de datos se inicializan en el
+# evento de startup, no al importar el módulo
 recommender = None
 
+# Pool acotado donde se ejecutan las llamadas síncronas al recomendador, fuera
+# del event loop (INFERENCE_EXECUTOR, ver inference_executor.py)
+inference = InferenceExecutor.from_env()
+
+# Micro-batching opcional de /predict y /recommendations/from-db: cada lote es
+# una sola tarea del ejecutor (MICROBATCH_WINDOW_MS, ver request_coalescer.py)
+predict_batcher = RequestCoalescer.from_env(
+    "predict", lambda pairs: inference.run(recommender, "predict_ratings", pairs)
+)
+recommendations_batcher = RequestCoalescer.from_env(
+    "recommendations", lambda requests: inference.run(recommender, "recommend_batch", requests)
+)
+
+# Respuestas de /movies/popular y /similar-movies por versión del modelo, con
+# ETag (ver response_cache.py). Se vacía al recargar el modelo
+response_cache = ResponseCache.from_env()
+
+# Top-N por usuario recalculado en segundo plano tras /ratings/add en modo
+# "deferred" (ver user_recommendations.py). Se vacía al recargar el modelo
+user_recommendations = UserRecommendationStore.from_env()
+
+# Segundos de cada paso del arranque de este proceso (ver /metrics)
+STARTUP_TIMINGS = {}
+
+MODEL_PATH = 'models/svd_model_1m.pkl'
+# Segundos entre comprobaciones de nueva versión del modelo (0 = desactivado)
+MODEL_RELOAD_INTERVAL = float(os.getenv("MODEL_RELOAD_INTERVAL", "10"))
+# Almacén compartido del modelo (modo multi-worker, ver shared_model_store.py):
+# si está definido, los workers mapean su generación actual en vez del pickle
+SHARED_MODEL_STORE = os.getenv("SHARED_MODEL_STORE")
+
+_reload_lock = asyncio.Lock()
+_retrain_lock = asyncio.Lock()
+_watcher_task = None
+
+def _timed_step(step: str, fn):
+    start = time.perf_counter()
+    try:
+        return fn()
+    finally:
+        STARTUP_TIMINGS[step] = time.perf_counter() - start
+
+
+def _create_recommender():
+    from model_inference_with_db import MovieRecommenderDB
+    return MovieRecommenderDB(MODEL_PATH, movies_path="data/movies.dat", shared_store=SHARED_MODEL_STORE)
+
+
+def _current_model_version() -> Optional[str]:
+    """Versión que debería estar cargada: generación del almacén compartido o versión del registro"""
+    if SHARED_MODEL_STORE:
+        from shared_model_store import SharedModelStore
+        return SharedModelStore(SHARED_MODEL_STORE).current_generation()
+    from model_registry import ModelRegistry
+    return ModelRegistry.for_model_path(MODEL_PATH).current_version()
+
+
+async def publish_shared_model():
+    """
+    En modo multi-worker, publica en el almacén compartido la versión actual
+    del registro (tras un reentrenamiento o rollback) para que el resto de
+    workers la mapeen en su siguiente comprobación
+    """
+    if not SHARED_MODEL_STORE:
+        return
+    from shared_model_store import SharedModelStore
+    
+    store = SharedModelStore(SHARED_MODEL_STORE)
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, store.publish_registry_version, MODEL_PATH, "data/movies.dat")
+
+
 @app.on_event("startup")
 async def load_model():
-    """Carga el modelo SVD al iniciar el servidor"""
-    global recommender
+    """
+    Crea las tablas y carga el modelo al iniciar el servidor. Ambos pasos se
+    ejecutan a la vez en hilos (y, dentro del recomendador, los títulos se
+    leen en paralelo con la deserialización del modelo).
+    """
+    global recommender, _watcher_task
+    start = time.perf_counter()
+    loop = asyncio.get_running_loop()
     try:
-        recommender = MovieRecommenderDB('models/svd_model_1m.pkl', movies_path="data/movies.dat")
+        _, recommender = await asyncio.gather(
+            loop.run_in_executor(None, _timed_step, 'create_database', create_database),
+            loop.run_in_executor(None, _timed_step, 'create_recommender', _create_recommender)
+        )
         print("✓ Modelo y base de datos cargados correctamente")
     except Exception as e:
         print(f"✗ Error cargando modelo: {e}")
         raise
+    
+    inference.start(MODEL_PATH, "data/movies.dat", SHARED_MODEL_STORE)
+    STARTUP_TIMINGS.update(recommender.load_timings)
+    STARTUP_TIMINGS['startup_total'] = time.perf_counter() - start
+    print("  " + " | ".join(f"{step} {seconds * 1000:.0f} ms" for step, seconds in STARTUP_TIMINGS.items()))
+    
+    if MODEL_RELOAD_INTERVAL > 0:
+        _watcher_task = asyncio.create_task(watch_model_versions())
+
+
+@app.on_event("shutdown")
+async def stop_model_watcher():
+    """Detiene la vigilancia de nuevas versiones del modelo"""
+    if _watcher_task is not None:
+        _watcher_task.cancel()
+
+
+@app.on_event("shutdown")
+async def stop_inference_executor():
+    """Cancela los recálculos diferidos y cierra el pool de inferencia"""
+    user_recommendations.close()
+    inference.shutdown()
+
+
+def _unavailable(error: InferenceRejected) -> HTTPException:
+    """503 con Retry-After para las peticiones rechazadas por el ejecutor de inferencia"""
+    return HTTPException(status_code=503, detail=str(error), headers={"Retry-After": str(error.retry_after)})
+
+
+def _load_and_warm_model():
+    """Carga un nuevo recomendador y lo calienta (se ejecuta fuera del event loop)"""
+    new_recommender = _create_recommender()
+    new_recommender.warm_up()
+    return new_recommender
+
+
+async def reload_model_if_changed() -> bool:
+    """
+    Si el registro (o el almacén compartido) apunta a una versión distinta de
+    la cargada, carga y calienta la nueva en un hilo y la intercambia. Las
+    peticiones en curso terminan con el recomendador anterior; las nuevas usan
+    ya el nuevo.
+    """
+    global recommender
+    
+    async with _reload_lock:
+        current = _current_model_version()
+        if current is None or (recommender is not None and recommender.model_version == current):
+            return False
+        
+        loop = asyncio.get_running_loop()
+        try:
+            new_recommender = await loop.run_in_executor(None, _load_and_warm_model)
+        except Exception:
+            MODEL_RELOADS.inc('error')
+            raise
+        MODEL_RELOADS.inc('success')
+        previous = recommender.model_version if recommender else None
+        recommender = new_recommender
+        response_cache.clear()
+        user_recommendations.clear()
+        print(f"✓ Modelo recargado en caliente: {previous} → {recommender.model_version}")
+        return True
+
+
+async def watch_model_versions():
+    """
+    Comprueba periódicamente el puntero CURRENT del registro (o del almacén
+    compartido). Cada proceso worker ejecuta su propia tarea, así que todos
+    convergen a la nueva versión.
+    """
+    while True:
+        await asyncio.sleep(MODEL_RELOAD_INTERVAL)
+        try:
+            await reload_model_if_changed()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Se sigue sirviendo con el modelo actual y se reintenta en la siguiente vuelta
+            print(f"✗ Error recargando modelo: {e}")
 
 # ============================================================================
 # MODELOS PYDANTIC (Request/Response)
@@ -55,6 +247,11 @@ class AddRatingRequest(BaseModel):
     user_id: str = Field(..., description="ID del usuario")
     movie_id: str = Field(..., description="ID de la película")
     rating: float = Field(..., ge=1.0, le=5.0, description="Rating (1-5)")
+    recommendations: Literal["sync", "skip", "deferred"] = Field(
+        "sync",
+        description="sync: recalcula y devuelve las recomendaciones; skip: solo guarda el rating; "
+                    "deferred: guarda el rating y las recalcula en segundo plano"
+    )
 
 class AddUserRequest(BaseModel):
     user_id: str = Field(..., description="ID del usuario")
@@ -79,6 +276,7 @@ class AddRatingAndRecommendResponse(BaseModel):
     rating_saved: RatingResponse
     user_stats: dict
     recommendations: List[MovieRecommendation]
+    recommendations_status: str = "fresh"
 
 class AddUserResponse(BaseModel):
     user_id: str
@@ -101,6 +299,8 @@ class UserHistoryResponse(BaseModel):
 class RecommendationsRequest(BaseModel):
     user_id: str = Field(..., description="ID del usuario")
     n: int = Field(10, ge=1, le=50, description="Número de recomendaciones")
+    genres: Optional[List[str]] = Field(None, description="Solo películas con alguno de estos géneros")
+    exclude_genres: Optional[List[str]] = Field(None, description="Excluir películas con alguno de estos géneros")
 
 class PredictionRequest(BaseModel):
     user_id: str = Field(..., description="ID del usuario")
@@ -122,6 +322,8 @@ class DatabaseStatsResponse(BaseModel):
 class PopularMoviesRequest(BaseModel):
     n: int = Field(10, ge=1, le=50, description="Número de películas")
     min_ratings: int = Field(50, ge=1, description="Mínimo de ratings")
+    genres: Optional[List[str]] = Field(None, description="Solo películas con alguno de estos géneros")
+    exclude_genres: Optional[List[str]] = Field(None, description="Excluir películas con alguno de estos géneros")
 
 class PopularMovieItem(BaseModel):
     movie_id: str
@@ -137,6 +339,8 @@ class SimilarMoviesRequest(BaseModel):
     movie_id: str = Field(..., description="ID de la película")
     user_id: Optional[str] = Field(None, description="ID del usuario (para excluir sus ratings)")
     n: int = Field(10, ge=1, le=50, description="Número de similares")
+    genres: Optional[List[str]] = Field(None, description="Solo películas con alguno de estos géneros")
+    exclude_genres: Optional[List[str]] = Field(None, description="Excluir películas con alguno de estos géneros")
 
 class SimilarMovieItem(BaseModel):
     movie_id: str
@@ -155,10 +359,7 @@ class SimilarMoviesResponse(BaseModel):
 # ============================================================================
 
 @app.post("/ratings/add", response_model=AddRatingAndRecommendResponse)
-async def add_rating_with_recommendations(
-    request: AddRatingRequest,
-    db: Session = Depends(get_db)
-):
+async def add_rating_with_recommendations(request: AddRatingRequest):
     """
     Añade un rating a la base de datos y devuelve recomendaciones actualizadas
     
@@ -170,26 +371,50 @@ async def add_rating_with_recommendations(
         "rating": 5.0
     }
     ```
+    
+    Con "recommendations": "skip" o "deferred" solo se guarda el rating y se
+    responde sin recomendaciones (total_ratings = null). En "deferred" se
+    recalculan en segundo plano y /recommendations/from-db las sirve ya hechas.
     """
     if recommender is None:
         raise HTTPException(status_code=503, detail="Modelo no disponible")
     
     try:
-        result = recommender.add_rating_and_get_recommendations(
-            db=db,
+        if request.recommendations != "sync":
+            rating_saved = await inference.run(
+                recommender, "add_rating", request.user_id, request.movie_id, request.rating, with_db=True
+            )
+            if request.recommendations == "deferred" and user_recommendations.enabled:
+                user_recommendations.schedule_refresh(request.user_id, _refresh_user_recommendations)
+                status = "pending"
+            else:
+                status = "skipped"
+            return AddRatingAndRecommendResponse(
+                rating_saved=rating_saved,
+                user_stats={"total_ratings": None, "user_id": request.user_id},
+                recommendations=[],
+                recommendations_status=status
+            )
+        
+        result = await inference.run(
+            recommender, "add_rating_and_get_recommendations",
+            with_db=True,
             user_id=request.user_id,
             movie_id=request.movie_id,
             rating=request.rating,
             n_recommendations=10
         )
         
-        return AddRatingAndRecommendResponse(**result)
+        with span("serialize_response"):
+            return AddRatingAndRecommendResponse(**result)
+    except InferenceRejected as e:
+        raise _unavailable(e)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error: {str(e)}")
 
 
 @app.get("/ratings/user/{user_id}", response_model=UserHistoryResponse)
-async def get_user_history(user_id: str, db: Session = Depends(get_db)):
+async def get_user_history(user_id: str):
     """
     Obtiene el historial completo de ratings de un usuario
     """
@@ -197,7 +422,7 @@ async def get_user_history(user_id: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=503, detail="Modelo no disponible")
     
     try:
-        ratings = recommender.get_user_history(db, user_id)
+        ratings = await inference.run(recommender, "get_user_history", user_id, with_db=True)
         total = len(ratings)
         
         return UserHistoryResponse(
@@ -205,6 +430,8 @@ async def get_user_history(user_id: str, db: Session = Depends(get_db)):
             total_ratings=total,
             ratings=ratings
         )
+    except InferenceRejected as e:
+        raise _unavailable(e)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error: {str(e)}")
 
@@ -229,7 +456,7 @@ async def delete_rating(
 
 
 @app.get("/database/stats", response_model=DatabaseStatsResponse)
-async def get_database_stats(db: Session = Depends(get_db)):
+def get_database_stats(db: Session = Depends(get_db)):
     """
     Obtiene estadísticas generales de la base de datos
     """
@@ -249,7 +476,7 @@ async def get_database_stats(db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail=f"Error: {str(e)}")
     
 @app.post("/users/add", response_model=AddUserResponse)
-async def add_user(
+def add_user(
     request: AddUserRequest,
     db: Session = Depends(get_db)
 ):
@@ -292,10 +519,7 @@ async def add_user(
 # ============================================================================
 
 @app.post("/recommendations/from-db")
-async def get_recommendations_from_database(
-    request: RecommendationsRequest,
-    db: Session = Depends(get_db)
-):
+async def get_recommendations_from_database(request: RecommendationsRequest):
     """
     Obtiene recomendaciones basadas en los ratings almacenados en la BD
     """
@@ -303,103 +527,291 @@ async def get_recommendations_from_database(
         raise HTTPException(status_code=503, detail="Modelo no disponible")
     
     try:
-        recommendations = recommender.get_recommendations_from_db(
-            db=db,
-            user_id=request.user_id,
-            n=request.n,
-            exclude_rated=True
-        )
+        # Top-N recalculado en segundo plano tras /ratings/add (modo deferred)
+        stored = user_recommendations.has(request.user_id) and not request.genres and not request.exclude_genres
+        if recommendations_batcher.enabled or stored:
+            # La lectura de la BD va aparte; solo se agrupa la puntuación
+            user_ratings = await inference.run(
+                recommender, "get_user_ratings_from_db", request.user_id, with_db=True
+            )
+            recommendations = None
+            if stored:
+                recommendations = user_recommendations.get(
+                    request.user_id, recommender.model_version, user_ratings, request.n
+                )
+            if recommendations is None:
+                recommendations = await _recommend_from_ratings(
+                    recommender, request.user_id, user_ratings, request.n, request.genres, request.exclude_genres
+                )
+        else:
+            recommendations = await inference.run(
+                recommender, "get_recommendations_from_db",
+                with_db=True,
+                user_id=request.user_id,
+                n=request.n,
+                exclude_rated=True,
+                genres=request.genres,
+                exclude_genres=request.exclude_genres
+            )
         
-        return {
-            "user_id": request.user_id,
-            "recommendations": [
-                {
-                    "movie_id": mid,
-                    "predicted_rating": round(pred, 3),
-                    "title": title,
-                    "rank": i + 1
-                }
-                for i, (mid, pred, title) in enumerate(recommendations)
-            ],
-            "count": len(recommendations),
-            "timestamp": datetime.now().isoformat()
-        }
+        with span("serialize_response"):
+            return {
+                "user_id": request.user_id,
+                "recommendations": [
+                    {
+                        "movie_id": mid,
+                        "predicted_rating": round(pred, 3),
+                        "title": title,
+                        "rank": i + 1
+                    }
+                    for i, (mid, pred, title) in enumerate(recommendations)
+                ],
+                "count": len(recommendations),
+                "timestamp": datetime.now().isoformat()
+            }
+    except InferenceRejected as e:
+        raise _unavailable(e)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error: {str(e)}")
 
 
+async def _recommend_from_ratings(model, user_id: str, user_ratings: Dict[str, float], n: int,
+                                  genres: Optional[List[str]] = None, exclude_genres: Optional[List[str]] = None):
+    """recommend_from_ratings en el ejecutor (o en el lote en curso si hay micro-batching)"""
+    if recommendations_batcher.enabled:
+        return await recommendations_batcher.submit({
+            "user_id": user_id,
+            "user_ratings_db": user_ratings,
+            "n": n,
+            "exclude_rated": True,
+            "genres": genres,
+            "exclude_genres": exclude_genres
+        })
+    return await inference.run(model, "recommend_from_ratings", user_id, user_ratings, n, True, True,
+                               genres, exclude_genres)
+
+
+async def _refresh_user_recommendations(user_id: str):
+    """Recalcula y guarda el top-N de un usuario (recálculo diferido de /ratings/add)"""
+    model = recommender
+    user_ratings = await inference.run(model, "get_user_ratings_from_db", user_id, with_db=True)
+    recommendations = await _recommend_from_ratings(model, user_id, user_ratings, user_recommendations.n)
+    if model is recommender:
+        user_recommendations.put(user_id, model.model_version, user_ratings, recommendations)
+
+
+@app.get("/recommendations/export")
+async def export_recommendations(
+    n: int = Query(DEFAULT_N, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+    cursor: Optional[str] = None,
+    chunk_size: int = Query(DEFAULT_CHUNK_SIZE, ge=1, le=4096),
+    model_version: Optional[str] = None
+):
+    """
+    Recomendaciones de todos los usuarios en streaming NDJSON (una línea por
+    usuario, ver recommendation_export.py). Tras cada bloque llega una línea
+    {"checkpoint": {...}}: para reanudar, se repite la petición con su
+    offset, cursor y model_version.
+    """
+    if recommender is None:
+        raise HTTPException(status_code=503, detail="Modelo no disponible")
+    # Toda la exportación usa el mismo modelo aunque se recargue mientras tanto
+    model = recommender
+    if model_version is not None and model_version != model.model_version:
+        raise HTTPException(
+            status_code=409,
+            detail=f"El modelo ha cambiado ({model_version} → {model.model_version}); reinicia la exportación"
+        )
+    
+    async def stream():
+        position = (offset, cursor)
+        while True:
+            # Una tarea del ejecutor (con su propia sesión) por bloque: el
+            # resto de peticiones se intercalan entre bloques
+            try:
+                records, *next_position = await inference.run(
+                    model, "export_recommendations_chunk", *position, n, chunk_size, with_db=True
+                )
+            except InferenceRejected as e:
+                yield ndjson_lines([{"error": str(e), **checkpoint_record(model.model_version, *position)}])
+                return
+            if not records:
+                return
+            position = tuple(next_position)
+            yield ndjson_lines(records + [checkpoint_record(model.model_version, *position)])
+    
+    return StreamingResponse(
+        stream(), media_type="application/x-ndjson", headers={"X-Model-Version": str(model.model_version)}
+    )
+
+
+def _cache_params(request: BaseModel) -> Dict:
+    """Parámetros de la petición para la clave de caché (géneros sin mayúsculas ni orden)"""
+    params = request.model_dump(exclude={"user_id"})
+    for field in ("genres", "exclude_genres"):
+        if params.get(field):
+            params[field] = sorted({genre.strip().lower() for genre in params[field]})
+    return params
+
+
+async def _cached_json(http_request: Request, endpoint: str, params: Dict, build) -> Response:
+    """
+    Respuesta de un endpoint que solo depende del modelo y de sus parámetros
+    (ver response_cache.py): 304 si el cliente ya tiene el ETag, el JSON
+    guardado si está en caché y, si no, build(modelo) serializado y guardado.
+    ETag, 304 y Cache-Control solo en GET: un POST no es cacheable por HTTP,
+    así que usa la caché del servidor pero responde siempre un 200 normal.
+    """
+    model = recommender  # la misma versión para la clave y para el cálculo
+    key, etag = response_cache.key(model.model_version, endpoint, params)
+    headers = {}
+    if http_request.method == "GET":
+        headers = response_cache.headers(etag)
+        if etag_matches(http_request.headers.get("if-none-match"), etag):
+            record_cache(f"response_{endpoint}", True)
+            return Response(status_code=304, headers=headers)
+    
+    body = response_cache.get(endpoint, key)
+    if body is None:
+        result = await build(model)
+        with span("serialize_response"):
+            body = result.model_dump_json().encode("utf-8")
+        response_cache.put(key, body)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+async def _popular_movies_response(model, request: PopularMoviesRequest) -> PopularMoviesResponse:
+    popular = await inference.run(
+        model, "get_popular_movies",
+        n=request.n,
+        min_ratings=request.min_ratings,
+        genres=request.genres,
+        exclude_genres=request.exclude_genres
+    )
+    
+    return PopularMoviesResponse(
+        movies=[
+            PopularMovieItem(
+                movie_id=movie_id,
+                title=model.get_movie_title(movie_id),
+                average_rating=round(avg_rating, 3),
+                rank=i + 1
+            )
+            for i, (movie_id, avg_rating) in enumerate(popular)
+        ],
+        count=len(popular)
+    )
+
+
 @app.post("/movies/popular", response_model=PopularMoviesResponse)
-async def get_popular_movies(request: PopularMoviesRequest):
+async def get_popular_movies(request: PopularMoviesRequest, http_request: Request):
     """
-    Obtiene las películas más populares basadas en ratings promedio
+    Obtiene las películas más populares basadas en ratings promedio.
+    La respuesta se cachea por versión del modelo y lleva ETag.
     """
     if recommender is None:
         raise HTTPException(status_code=503, detail="Modelo no disponible")
     
     try:
-        popular = recommender.get_popular_movies(n=request.n, min_ratings=request.min_ratings)
-        
-        return PopularMoviesResponse(
-            movies=[
-                PopularMovieItem(
-                    movie_id=movie_id,
-                    title=recommender.get_movie_title(movie_id),
-                    average_rating=round(avg_rating, 3),
-                    rank=i + 1
-                )
-                for i, (movie_id, avg_rating) in enumerate(popular)
-            ],
-            count=len(popular)
+        return await _cached_json(
+            http_request, "popular", _cache_params(request),
+            lambda model: _popular_movies_response(model, request)
         )
+    except InferenceRejected as e:
+        raise _unavailable(e)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error: {str(e)}")
 
 
-@app.post("/similar-movies", response_model=SimilarMoviesResponse)
-async def get_similar_movies(
-    request: SimilarMoviesRequest,
-    db: Session = Depends(get_db)
+@app.get("/movies/popular", response_model=PopularMoviesResponse)
+async def get_popular_movies_cacheable(
+    http_request: Request,
+    n: int = Query(10, ge=1, le=50, description="Número de películas"),
+    min_ratings: int = Query(50, ge=1, description="Mínimo de ratings"),
+    genres: Optional[List[str]] = Query(None, description="Solo películas con alguno de estos géneros"),
+    exclude_genres: Optional[List[str]] = Query(None, description="Excluir películas con alguno de estos géneros")
 ):
+    """
+    Igual que POST /movies/popular, pero el navegador puede cachearla y
+    revalidarla con If-None-Match (?genres=Comedy&genres=Drama)
+    """
+    request = PopularMoviesRequest(n=n, min_ratings=min_ratings, genres=genres, exclude_genres=exclude_genres)
+    return await get_popular_movies(request, http_request)
+
+
+async def _similar_movies_response(
+    model, request: SimilarMoviesRequest, exclude_movie_ids: Set[str] = frozenset()
+) -> SimilarMoviesResponse:
+    # Obtener películas similares excluyendo las ya valoradas
+    similar = await inference.run(
+        model, "get_similar_movies",
+        request.movie_id,
+        n=request.n,
+        exclude_movie_ids=exclude_movie_ids,
+        genres=request.genres,
+        exclude_genres=request.exclude_genres
+    )
+    
+    reference_title = model.get_movie_title(request.movie_id)
+    
+    return SimilarMoviesResponse(
+        reference_movie_id=request.movie_id,
+        reference_movie_title=reference_title,
+        similar_movies=[
+            SimilarMovieItem(
+                movie_id=movie_id,
+                title=model.get_movie_title(movie_id),
+                similarity_score=round(score, 3)
+            )
+            for movie_id, score in similar
+        ],
+        count=len(similar)
+    )
+
+
+@app.post("/similar-movies", response_model=SimilarMoviesResponse)
+async def get_similar_movies(request: SimilarMoviesRequest, http_request: Request):
     """
     Obtiene películas similares a una película dada basándose en factores latentes.
     Si se proporciona user_id, excluye las películas que el usuario ya ha valorado.
+    Sin user_id, la respuesta se cachea por versión del modelo y lleva ETag.
     """
     if recommender is None:
         raise HTTPException(status_code=503, detail="Modelo no disponible")
     
     try:
-        # NUEVO: Obtener películas ya valoradas por el usuario
-        exclude_movie_ids = set()
-        if request.user_id:
-            user_ratings = recommender.get_user_ratings_from_db(db, request.user_id)
-            exclude_movie_ids = set(user_ratings.keys())
-        
-        # Obtener películas similares excluyendo las ya valoradas
-        similar = recommender.get_similar_movies(
-            request.movie_id, 
-            n=request.n,
-            exclude_movie_ids=exclude_movie_ids
-        )
-        
-        reference_title = recommender.get_movie_title(request.movie_id)
+        if not request.user_id:
+            return await _cached_json(
+                http_request, "similar", _cache_params(request),
+                lambda model: _similar_movies_response(model, request)
+            )
         
-        return SimilarMoviesResponse(
-            reference_movie_id=request.movie_id,
-            reference_movie_title=reference_title,
-            similar_movies=[
-                SimilarMovieItem(
-                    movie_id=movie_id,
-                    title=recommender.get_movie_title(movie_id),
-                    similarity_score=round(score, 3)
-                )
-                for movie_id, score in similar
-            ],
-            count=len(similar)
-        )
+        # NUEVO: Obtener películas ya valoradas por el usuario
+        user_ratings = await inference.run(recommender, "get_user_ratings_from_db", request.user_id, with_db=True)
+        return await _similar_movies_response(recommender, request, set(user_ratings.keys()))
+    except InferenceRejected as e:
+        raise _unavailable(e)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error: {str(e)}")
 
 
+@app.get("/similar-movies", response_model=SimilarMoviesResponse)
+async def get_similar_movies_cacheable(
+    http_request: Request,
+    movie_id: str = Query(..., description="ID de la película"),
+    n: int = Query(10, ge=1, le=50, description="Número de similares"),
+    genres: Optional[List[str]] = Query(None, description="Solo películas con alguno de estos géneros"),
+    exclude_genres: Optional[List[str]] = Query(None, description="Excluir películas con alguno de estos géneros")
+):
+    """
+    Igual que POST /similar-movies sin user_id, pero el navegador puede
+    cachearla y revalidarla con If-None-Match
+    """
+    request = SimilarMoviesRequest(movie_id=movie_id, n=n, genres=genres, exclude_genres=exclude_genres)
+    return await get_similar_movies(request, http_request)
+
+
 @app.post("/predict", response_model=PredictionResponse)
 async def predict_rating(request: PredictionRequest):
     """
@@ -409,10 +821,14 @@ async def predict_rating(request: PredictionRequest):
         raise HTTPException(status_code=503, detail="Modelo no disponible")
     
     try:
-        predicted_rating = recommender.predict_rating(
-            request.user_id, 
-            request.movie_id
-        )
+        if predict_batcher.enabled:
+            predicted_rating = await predict_batcher.submit((request.user_id, request.movie_id))
+        else:
+            predicted_rating = await inference.run(
+                recommender, "predict_rating",
+                request.user_id,
+                request.movie_id
+            )
         
         return PredictionResponse(
             user_id=request.user_id,
@@ -421,6 +837,8 @@ async def predict_rating(request: PredictionRequest):
             predicted_rating=round(predicted_rating, 3),
             timestamp=datetime.now().isoformat()
         )
+    except InferenceRejected as e:
+        raise _unavailable(e)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error: {str(e)}")
 
@@ -447,7 +865,7 @@ async def root():
 
 
 @app.get("/health")
-async def health_check(db: Session = Depends(get_db)):
+def health_check(db: Session = Depends(get_db)):
     """Verifica el estado de la API, modelo y base de datos"""
     if recommender is None:
         raise HTTPException(status_code=503, detail="Modelo no cargado")
@@ -459,6 +877,7 @@ async def health_check(db: Session = Depends(get_db)):
         return {
             "status": "healthy",
             "model_loaded": True,
+            "model_version": recommender.model_version,
             "database_connected": True,
             "total_ratings_in_db": total_ratings,
             "n_users": recommender.n_users,
@@ -470,6 +889,62 @@ async def health_check(db: Session = Depends(get_db)):
         raise HTTPException(status_code=503, detail=f"Error: {str(e)}")
 
 
+def _model_metrics():
+    """Versión cargada y antigüedad del modelo, calculadas en cada scrape"""
+    if recommender is None:
+        return gauge_lines("model_loaded", "1 si hay un modelo cargado", [({}, 0)])
+    now = datetime.now()
+    lines = gauge_lines("model_loaded", "1 si hay un modelo cargado", [({}, 1)])
+    lines += gauge_lines("model_info", "Versión del modelo cargado",
+                         [({"version": recommender.model_version}, 1)])
+    if recommender.loaded_at:
+        lines += gauge_lines("model_loaded_seconds", "Segundos desde que se cargó el modelo en este proceso",
+                             [({}, round((now - recommender.loaded_at).total_seconds(), 3))])
+    if recommender.model_created_at:
+        try:
+            age = (now - datetime.fromisoformat(recommender.model_created_at)).total_seconds()
+            lines += gauge_lines("model_age_seconds", "Segundos desde que se entrenó el modelo cargado",
+                                 [({}, round(age, 3))])
+        except ValueError:
+            pass
+    return lines
+
+
+def _startup_metrics():
+    """Duración de cada paso del arranque de este proceso"""
+    return gauge_lines(
+        "startup_step_seconds", "Duración de cada paso del arranque del proceso",
+        [({"step": step}, round(seconds, 6)) for step, seconds in STARTUP_TIMINGS.items()]
+    )
+
+
+def _memory_metrics():
+    """Memoria residente del proceso y la medida al cargar el modelo"""
+    from training_report import current_rss_bytes
+    
+    lines = []
+    rss = current_rss_bytes()
+    if rss is not None:
+        lines += gauge_lines("process_resident_memory_bytes", "Memoria residente del proceso", [({}, rss)])
+    if recommender is not None and recommender.memory_report:
+        lines += gauge_lines(
+            "model_load_memory_bytes", "Memoria al cargar el modelo (completo, de servicio y sus arrays)",
+            [({"stage": stage}, value) for stage, value in recommender.memory_report.items()]
+        )
+    return lines
+
+
+METRICS_REGISTRY.register_collector(_model_metrics)
+METRICS_REGISTRY.register_collector(_startup_metrics)
+METRICS_REGISTRY.register_collector(_memory_metrics)
+
+
+@app.get("/metrics")
+async def metrics():
+    """Métricas en formato de texto de Prometheus"""
+    return Response(content=METRICS_REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
+
+
 # ============================================================================
 # ENDPOINTS - REENTRENAMIENTO
 # ============================================================================
@@ -480,11 +955,16 @@ class RetrainRequest(BaseModel):
     min_new_ratings: int = Field(100, ge=10)
 
 class RetrainResponse(BaseModel):
+    # model_version es un campo propio, no del espacio de nombres de pydantic
+    model_config = ConfigDict(protected_namespaces=())
+    
     success: bool
     message: str
     training_time: Optional[float] = None
     metrics: Optional[dict] = None
     db_ratings_count: Optional[int] = None
+    model_version: Optional[str] = None
+    run_report: Optional[dict] = None
     timestamp: str
 
 @app.post("/admin/retrain", response_model=RetrainResponse)
@@ -509,9 +989,13 @@ async def retrain_model_endpoint(
     """
     from retrain_model import retrain_model, check_retrain_needed
     
+    if _retrain_lock.locked():
+        raise HTTPException(status_code=409, detail="Ya hay un reentrenamiento en curso")
+    
+    loop = asyncio.get_running_loop()
     try:
         # Verificar si es necesario reentrenar
-        needs_retrain = check_retrain_needed(request.min_new_ratings)
+        needs_retrain = await loop.run_in_executor(None, check_retrain_needed, request.min_new_ratings)
         
         if not needs_retrain:
             total_ratings = db.query(Rating).count()
@@ -521,17 +1005,24 @@ async def retrain_model_endpoint(
                 timestamp=datetime.now().isoformat()
             )
         
-        # Reentrenar
-        result = retrain_model(
-            n_factors=request.n_factors,
-            n_epochs=request.n_epochs,
-            backup=True
+        # Reentrenar en un hilo aparte: el event loop sigue atendiendo
+        # peticiones durante los minutos que dura el entrenamiento
+        async with _retrain_lock:
+            start = time.perf_counter()
+            result = await loop.run_in_executor(None, functools.partial(
+                retrain_model,
+                n_factors=request.n_factors,
+                n_epochs=request.n_epochs,
+                backup=True
+            ))
+        RETRAIN_DURATION.observe(
+            time.perf_counter() - start, 'api', 'success' if result['success'] else 'error'
         )
         
         if result['success']:
-            # Recargar el modelo en memoria
-            global recommender
-            recommender = MovieRecommenderDB('models/svd_model_1m.pkl', movies_path="data/movies.dat")
+            # Recargar el modelo en memoria (y publicarlo para el resto de workers)
+            await publish_shared_model()
+            await reload_model_if_changed()
             
             return RetrainResponse(
                 success=True,
@@ -539,6 +1030,8 @@ async def retrain_model_endpoint(
                 training_time=result.get('training_time'),
                 metrics=result.get('metrics'),
                 db_ratings_count=result.get('db_ratings_count'),
+                model_version=result.get('model_version'),
+                run_report=result.get('run_report'),
                 timestamp=result.get('timestamp')
             )
         else:
@@ -567,25 +1060,14 @@ async def check_retrain_status(
     - Si se recomienda reentrenar
     """
     from retrain_model import check_retrain_needed
-    import pickle
-    import os
+    from model_registry import read_model_info
     
     try:
         total_ratings = db.query(Rating).count()
         unique_users = len(set([r.user_id for r in db.query(Rating).all()]))
         
-        # Info del modelo actual
-        model_info = {}
-        model_path = 'models/svd_model_1m.pkl'
-        if os.path.exists(model_path):
-            with open(model_path, 'rb') as f:
-                model_data = pickle.load(f)
-                model_info = {
-                    'last_retrain': model_data.get('retrained_at', 'Never (original model)'),
-                    'n_users': model_data.get('n_users'),
-                    'n_items': model_data.get('n_items'),
-                    'version': model_data.get('version', '1.0')
-                }
+        # Info del modelo actual (leída del manifiesto, sin cargar el pickle)
+        model_info = read_model_info(MODEL_PATH)
         
         needs_retrain = check_retrain_needed(min_new_ratings)
         
@@ -605,6 +1087,67 @@ async def check_retrain_status(
         raise HTTPException(status_code=500, detail=f"Error verificando estado: {str(e)}")
 
 
+@app.get("/admin/db-profile")
+async def db_profile_summary(top: int = 20):
+    """Sentencias SQL más costosas desde el arranque (requiere QUERY_PROFILER=1)"""
+    if query_profiler is None:
+        raise HTTPException(status_code=404, detail="Profiler de consultas desactivado (QUERY_PROFILER=1)")
+    return query_profiler.summary(top)
+
+
+@app.get("/admin/model/versions")
+async def list_model_versions():
+    """
+    Lista las versiones del registro de modelos con su manifiesto
+    """
+    from model_registry import ModelRegistry
+    
+    registry = ModelRegistry.for_model_path(MODEL_PATH)
+    current = registry.current_version()
+    return {
+        "current_version": current,
+        "loaded_version": recommender.model_version if recommender else None,
+        "versions": [
+            {**registry.get_manifest(v), "is_current": v == current}
+            for v in registry.list_versions()
+        ],
+        "timestamp": datetime.now().isoformat()
+    }
+
+
+@app.post("/admin/model/rollback")
+async def rollback_model(version: Optional[str] = None):
+    """
+    Vuelve a una versión anterior del modelo (por defecto la previa a la actual)
+    y la recarga en memoria
+    """
+    from model_registry import ModelRegistry
+    
+    registry = ModelRegistry.for_model_path(MODEL_PATH)
+    previous = registry.current_version()
+    
+    try:
+        active = registry.rollback(version)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    
+    try:
+        await publish_shared_model()
+        await reload_model_if_changed()
+    except Exception as e:
+        # Restaurar el puntero para no dejar el registro apuntando a un modelo inválido
+        if previous:
+            registry.set_current(previous)
+            await publish_shared_model()
+        raise HTTPException(status_code=500, detail=f"Error recargando modelo: {str(e)}")
+    
+    return {
+        "previous_version": previous,
+        "current_version": active,
+        "timestamp": datetime.now().isoformat()
+    }
+
+
 # ============================================================================
 # EJECUTAR SERVIDOR
 # ============================================================================
@@ -0,0 +1,338 @@
+"""
+Métricas de Operación en Formato Prometheus
+Sistema de Recomendación de Películas - Grupo 8
+
+Contadores, gauges e histogramas propios (sin dependencia de prometheus_client)
+pensados para dejarlos activos bajo carga: cada hilo escribe en su propio
+fragmento (threading.local), así que registrar una muestra no toma ningún
+lock; solo la lectura de /metrics suma los fragmentos de todos los hilos.
+
+Incluye el middleware ASGI que mide cada petición por ruta y estado, la
+instrumentación de consultas SQLAlchemy y el decorador para operaciones del
+modelo.
+"""
+
+import bisect
+import functools
+import threading
+import time
+from typing import Callable, Dict, List, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+JOB_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+WAIT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence, extra: Tuple = ()) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + [f'{n}="{v}"' for n, v in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Shards:
+    """Un dict por hilo; las escrituras no compiten entre hilos"""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards: List[Dict] = []
+        self._lock = threading.Lock()
+
+    def mine(self) -> Dict:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = {}
+            # Solo la primera escritura de cada hilo registra su fragmento
+            with self._lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+        return shard
+
+    def all(self) -> List[Dict]:
+        with self._lock:
+            return list(self._shards)
+
+
+class _Metric:
+    TYPE = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._shards = _Shards()
+        REGISTRY.register(self)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.TYPE}"]
+
+
+class Counter(_Metric):
+    """Contador monótono con etiquetas"""
+
+    TYPE = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        shard = self._shards.mine()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def values(self) -> Dict[Tuple, float]:
+        totals: Dict[Tuple, float] = {}
+        for shard in self._shards.all():
+            for labels, value in list(shard.items()):
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def collect(self) -> List[str]:
+        lines = self._header()
+        for labels, value in sorted(self.values().items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    """Gauge de suma (inc/dec), p. ej. peticiones en curso"""
+
+    TYPE = "gauge"
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    """Histograma acumulativo con buckets fijos"""
+
+    TYPE = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels):
+        shard = self._shards.mine()
+        state = shard.get(labels)
+        if state is None:
+            # [cuentas por bucket..., +Inf, suma]
+            state = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    def time(self, *labels):
+        """Context manager que observa la duración del bloque"""
+        return _Timer(self, labels)
+
+    def snapshot(self) -> Dict[Tuple, List]:
+        merged: Dict[Tuple, List] = {}
+        for shard in self._shards.all():
+            for labels, state in list(shard.items()):
+                target = merged.setdefault(labels, [0] * (len(self.buckets) + 1) + [0.0])
+                for i, v in enumerate(state):
+                    target[i] += v
+        return merged
+
+    def collect(self) -> List[str]:
+        lines = self._header()
+        for labels, state in sorted(self.snapshot().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state[:-1]):
+                cumulative += count
+                le = (("le", _format_value(bound) if bound != float("inf") else "+Inf"),)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_str} {_format_value(state[-1])}")
+            lines.append(f"{self.name}_count{label_str} {cumulative}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: Tuple):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class MetricsRegistry:
+    """Métricas registradas y colectores calculados en el momento del scrape"""
+
+    def __init__(self):
+        self.metrics: List[_Metric] = []
+        self.collectors: List[Callable[[], List[str]]] = []
+
+    def register(self, metric: _Metric):
+        self.metrics.append(metric)
+
+    def register_collector(self, collector: Callable[[], List[str]]):
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.collect())
+        for collector in self.collectors:
+            try:
+                lines.extend(collector())
+            except Exception as e:
+                lines.append(f"# collector error: {_escape(e)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+def gauge_lines(name: str, documentation: str, samples: List[Tuple[Dict, float]]) -> List[str]:
+    """Líneas de un gauge calculado en el scrape: samples = [(labels, valor)]"""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} gauge"]
+    for labels, value in samples:
+        lines.append(f"{name}{_format_labels(list(labels), list(labels.values()))} {_format_value(value)}")
+    return lines
+
+
+# ============================================================================
+# MÉTRICAS DEL SISTEMA
+# ============================================================================
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Duración de las peticiones HTTP por ruta y estado",
+    ("method", "route", "status")
+)
+HTTP_REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight", "Peticiones HTTP en curso", ("method",))
+MODEL_OPERATION_DURATION = Histogram(
+    "model_operation_duration_seconds", "Duración de las operaciones del modelo", ("operation",)
+)
+RECOMMENDATION_CASES = Counter(
+    "recommendation_requests_total", "Recomendaciones servidas por tipo de usuario", ("case",)
+)
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds", "Duración de las consultas SQL por tipo de sentencia", ("statement",)
+)
+CACHE_REQUESTS = Counter("cache_requests_total", "Consultas a cachés por resultado (hit/miss)", ("cache", "result"))
+MODEL_RELOADS = Counter("model_reloads_total", "Recargas del modelo por resultado", ("result",))
+RETRAIN_DURATION = Histogram(
+    "retrain_duration_seconds", "Duración de los reentrenamientos", ("trigger", "result"), buckets=JOB_BUCKETS
+)
+INFERENCE_QUEUE_WAIT = Histogram(
+    "inference_queue_wait_seconds", "Espera en la cola del ejecutor de inferencia", ("operation",)
+)
+INFERENCE_PENDING = Gauge("inference_pending", "Tareas de inferencia en cola o en ejecución")
+INFERENCE_REJECTED = Counter(
+    "inference_rejected_total", "Peticiones de inferencia rechazadas con 503", ("operation", "reason")
+)
+BATCH_SIZE = Histogram(
+    "microbatch_size", "Peticiones agrupadas en cada lote", ("operation",), buckets=BATCH_SIZE_BUCKETS
+)
+BATCH_WAIT = Histogram(
+    "microbatch_wait_seconds", "Espera añadida por la ventana de agrupación", ("operation",), buckets=WAIT_BUCKETS
+)
+USER_RECS_REFRESHES = Counter(
+    "user_recommendations_refresh_total", "Recálculos diferidos de recomendaciones por resultado", ("result",)
+)
+
+
+def record_cache(cache: str, hit: bool):
+    """Registra un acierto o fallo de la caché `cache` (el ratio se calcula en Prometheus)"""
+    CACHE_REQUESTS.inc(cache, "hit" if hit else "miss")
+
+
+def model_timed(operation: str):
+    """
+    Decorador que mide un método del recomendador en model_operation_duration_seconds
+    y, si la petición se está trazando, abre un span model.<operation>
+    """
+    from tracing import span
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                with span(f"model.{operation}"):
+                    return method(*args, **kwargs)
+            finally:
+                MODEL_OPERATION_DURATION.observe(time.perf_counter() - start, operation)
+        return wrapper
+    return decorator
+
+
+def instrument_engine(engine):
+    """Mide cada sentencia SQL ejecutada por el engine de SQLAlchemy"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("_metrics_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("_metrics_query_start")
+        if starts:
+            kind = statement.lstrip().split(None, 1)[0].lower() if statement.strip() else "other"
+            DB_QUERY_DURATION.observe(time.perf_counter() - starts.pop(), kind)
+
+
+_route_paths: Dict = {}
+
+
+def route_template(scope) -> str:
+    """Plantilla de la ruta atendida (/ratings/user/{user_id}) o 'unmatched'"""
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return "unmatched"
+    path = _route_paths.get(endpoint)
+    if path is None:
+        for route in getattr(scope.get("router"), "routes", []):
+            if getattr(route, "endpoint", None) is not None and hasattr(route, "path"):
+                _route_paths[route.endpoint] = route.path
+        path = _route_paths.get(endpoint, "unmatched")
+    return path
+
+
+class PrometheusMiddleware:
+    """
+    Middleware ASGI puro (más barato que BaseHTTPMiddleware): mide cada
+    petición HTTP y la etiqueta con la plantilla de la ruta, no con la URL,
+    para que /ratings/user/{user_id} sea una única serie.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status_code = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_code[0] = message["status"]
+            await send(message)
+
+        HTTP_REQUESTS_IN_FLIGHT.inc(method)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUESTS_IN_FLIGHT.dec(method)
+            HTTP_REQUEST_DURATION.observe(
+                time.perf_counter() - start, method, route_template(scope), str(status_code[0])
+            )
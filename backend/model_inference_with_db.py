@@ -3,36 +3,174 @@ Sistema de Inferencia con Base de Datos
 Sistema de Recomendación de Películas - Grupo 8
 """
 
-import pickle
-import pandas as pd
+import json
+import os
+import time
 import numpy as np
-from typing import List, Dict, Tuple
+from typing import List, Dict, Optional, Set, Tuple
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from sqlalchemy.orm import Session
 from database import Rating, RatingCRUD
+from item_neighbors import load_neighbors
+from metrics import RECOMMENDATION_CASES, model_timed
+from model_registry import ModelRegistry, load_model_data
+from serving_model import ServingModel, release_memory
+from training_report import current_rss_bytes
+from tracing import span
+
+ENCODINGS = ["utf-8", "latin-1", "ISO-8859-1", "cp1252"]
+
+
+def _title_cache_path(path: str) -> str:
+    return f"{path}.titles.json"
+
+
+def _read_title_cache(path: str) -> Optional[Tuple[Dict[str, str], Dict[str, str]]]:
+    """
+    Tablas movie_id -> título y movie_id -> géneros precalculadas, o None si
+    no existen o están desfasadas
+    """
+    try:
+        with open(_title_cache_path(path), "r", encoding="utf-8") as f:
+            cache = json.load(f)
+        stat = os.stat(path)
+    except (OSError, ValueError):
+        return None
+    if cache.get("source_mtime_ns") != stat.st_mtime_ns or cache.get("source_size") != stat.st_size:
+        return None
+    if "titles" not in cache or "genres" not in cache:
+        return None
+    return cache["titles"], cache["genres"]
+
+
+def _write_title_cache(path: str, titles: Dict[str, str], genres: Dict[str, str]):
+    stat = os.stat(path)
+    tmp_path = _title_cache_path(path) + ".tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "source_mtime_ns": stat.st_mtime_ns,
+                "source_size": stat.st_size,
+                "titles": titles,
+                "genres": genres
+            }, f, ensure_ascii=False)
+        os.replace(tmp_path, _title_cache_path(path))
+    except OSError as e:
+        print(f"⚠️ No se pudo guardar la tabla de títulos: {e}")
+
+
+def _read_movies_frame(path: str):
+    """Lee un fichero de películas (.csv, .tsv o .dat de MovieLens) con pandas"""
+    import pandas as pd
+    for enc in ENCODINGS:
+        try:
+            if path.endswith(".tsv"):
+                df = pd.read_csv(path, sep="\t", dtype={"movieId": str}, encoding=enc)
+            elif path.endswith(".dat"):
+                df = pd.read_csv(
+                    path, sep="::", engine="python",
+                    names=["movieId", "title", "genres"],
+                    dtype={"movieId": str}, header=None, encoding=enc
+                )
+            else:
+                df = pd.read_csv(path, dtype={"movieId": str}, encoding=enc)
+        except Exception:
+            continue
+        print(f"✓ Metadata leída desde {path} con encoding {enc}")
+        if "MovieID" in df.columns:
+            df = df.rename(columns={"MovieID": "movieId"})
+        return df
+    return None
+
+
+def _read_titles(path: str) -> Optional[Tuple[Dict[str, str], Dict[str, str]]]:
+    """
+    Tablas movie_id -> título y movie_id -> géneros ("Action|Comedy") de un
+    fichero de películas. Los .dat se leen línea a línea sin pandas; el resto
+    con _read_movies_frame.
+    """
+    if path.endswith(".dat"):
+        with open(path, "rb") as f:
+            raw = f.read()
+        for enc in ENCODINGS:
+            try:
+                text = raw.decode(enc)
+            except UnicodeDecodeError:
+                continue
+            titles, genres = {}, {}
+            for line in text.splitlines():
+                parts = line.split("::")
+                if len(parts) >= 3:
+                    titles[parts[0]] = "::".join(parts[1:-1])
+                    genres[parts[0]] = parts[-1]
+            print(f"✓ Metadata leída desde {path} con encoding {enc}")
+            return titles, genres
+        return None
+    
+    df = _read_movies_frame(path)
+    if df is None or "movieId" not in df.columns or "title" not in df.columns:
+        return None
+    movie_ids = df["movieId"].astype(str)
+    genres = {}
+    if "genres" in df.columns:
+        genres = dict(zip(movie_ids, df["genres"].fillna("").astype(str)))
+    return dict(zip(movie_ids, df["title"])), genres
+
 
 class MovieRecommenderDB:
-    def __init__(self, model_path='models/svd_model_1m.pkl', movies_path: str = None):
+    def __init__(self, model_path='models/svd_model_1m.pkl', movies_path: str = None, shared_store: str = None):
         """
-        Inicializa el sistema de recomendación con soporte para base de datos
+        Inicializa el sistema de recomendación con soporte para base de datos.
+        Con shared_store, mapea la generación actual de ese almacén (ver
+        shared_model_store.py) en lugar de deserializar el modelo.
         """
         self.model_path = model_path
-        self.model = None
-        self.trainset = None
+        self.serving: Optional[ServingModel] = None
         self.n_users = 0
         self.n_items = 0
         self.global_mean = 0
-        self.movies_df = None
+        self.model_version = None
+        self.model_created_at = None
+        self.loaded_at = None
+        self._movies_df = None
+        self._movies_source = None
         self.movie_id_to_title = {}
+        self.movie_id_to_genres = {}
         self.movies_path = movies_path
+        self.shared_store = shared_store
+        self.load_timings = {}
+        self.memory_report = {}
         
-        self._load_model()
-        self._load_movies_metadata()
+        start = time.perf_counter()
+        if shared_store:
+            self._timed('load_model', self._attach_shared_model)
+        else:
+            # Los títulos se leen en otro hilo mientras se deserializa el modelo
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                metadata = executor.submit(self._timed, 'load_metadata', self._load_movies_metadata)
+                self._timed('load_model', self._load_model)
+                metadata.result()
+            # Títulos y géneros quedan alineados con los ids internos del modelo de servicio
+            self.serving.attach_metadata(self.movie_id_to_title, self.movie_id_to_genres)
+            self.movie_id_to_title = {}
+            self.movie_id_to_genres = {}
+        self.load_timings['total'] = time.perf_counter() - start
+    
+    def _timed(self, step: str, fn):
+        start = time.perf_counter()
+        try:
+            return fn()
+        finally:
+            self.load_timings[step] = time.perf_counter() - start
   
     def _load_movies_metadata(self):
-        """Carga metadata de películas"""
-        import os
-        encodings_to_try = ["utf-8", "latin-1", "ISO-8859-1", "cp1252"]
+        """
+        Carga los títulos y géneros de las películas. Usa la tabla precalculada
+        <fichero>.titles.json si está al día con el fichero de origen; si no,
+        lo lee (los .dat sin pandas) y la regenera para el siguiente arranque.
+        """
         if self.movies_path is None:
             candidates = [
                 "data/movies.csv", "data/movies.tsv", "data/movies.dat",
@@ -45,77 +183,136 @@ class MovieRecommenderDB:
         for p in candidates:
             if not os.path.exists(p):
                 continue
-            df = None
-            for enc in encodings_to_try:
-                try:
-                    if p.endswith(".tsv"):
-                        df = pd.read_csv(p, sep="\t", dtype={"movieId": str}, encoding=enc)
-                    elif p.endswith(".dat"):
-                        df = pd.read_csv(
-                            p, sep="::", engine="python",
-                            names=["movieId", "title", "genres"],
-                            dtype={"movieId": str}, header=None, encoding=enc
-                        )
-                    else:
-                        df = pd.read_csv(p, dtype={"movieId": str}, encoding=enc)
-                    print(f"✓ Metadata leída desde {p} con encoding {enc}")
-                    break
-                except Exception:
+            metadata = _read_title_cache(p)
+            if metadata is not None:
+                print(f"✓ Títulos leídos de la tabla precalculada de {p}")
+            else:
+                metadata = _read_titles(p)
+                if metadata is None:
                     continue
-
-            if df is not None:
-                if "MovieID" in df.columns:
-                    df = df.rename(columns={"MovieID": "movieId"})
-                if "movieId" in df.columns and "title" in df.columns:
-                    self.movies_df = df
-                    self.movie_id_to_title = {
-                        str(row["movieId"]): row["title"] for _, row in df.iterrows()
-                    }
-                    print(f"✓ {len(self.movie_id_to_title)} títulos de películas cargados")
-                    return
+                _write_title_cache(p, *metadata)
+            
+            self._movies_source = p
+            self.movie_id_to_title, self.movie_id_to_genres = metadata
+            print(f"✓ {len(self.movie_id_to_title)} títulos de películas cargados")
+            return
         
         print("⚠️ No se encontró metadata de películas")
         self.movie_id_to_title = {}
     
+    @property
+    def movies_df(self):
+        """DataFrame completo de películas; se lee bajo demanda (importa pandas)"""
+        if self._movies_df is None and self._movies_source is not None:
+            self._movies_df = _read_movies_frame(self._movies_source)
+        return self._movies_df
+    
     def get_movie_title(self, movie_id: str) -> str:
         """Devuelve el título de una película"""
         movie_id = str(movie_id)
-        return self.movie_id_to_title.get(movie_id, f"Movie {movie_id}")
+        return self.serving.title(movie_id) or f"Movie {movie_id}"
     
     def _load_model(self):
-        """Carga el modelo desde archivo pickle"""
+        """
+        Carga el modelo actual del registro (o el pickle clásico si no hay
+        registro) y se queda solo con el modelo de servicio: el SVD de Surprise
+        y su Trainset se liberan en cuanto se ha extraído lo necesario.
+        """
         try:
-            with open(self.model_path, 'rb') as f:
-                model_data = pickle.load(f)
+            registry = ModelRegistry.for_model_path(self.model_path)
+            version = registry.current_version()
+            artifact_path = registry.artifact_path(version) if version else self.model_path
+            rss_before = current_rss_bytes()
+            model_data = load_model_data(artifact_path)
+            rss_loaded = current_rss_bytes()
             
-            self.model = model_data['model']
-            self.trainset = model_data['trainset']
-            self.n_users = model_data['n_users']
-            self.n_items = model_data['n_items']
+            self.serving = ServingModel.from_surprise(model_data['model'], model_data['trainset'])
+            self.n_users = self.serving.n_users
+            self.n_items = self.serving.n_items
             self.global_mean = model_data['global_mean']
+            neighbors = load_neighbors(registry, version) if version else None
+            if neighbors is not None and self.serving.attach_neighbors(neighbors['ids'], neighbors['scores']):
+                print(f"✓ Tabla de vecinos cargada ({self.serving.neighbor_depth} por película)")
             
-            print(f"✓ Modelo cargado: {self.n_users} usuarios, {self.n_items} películas")
+            self.model_version = version or model_data.get('version', '1.0')
+            manifest = registry.get_manifest(version) if version else None
+            self.model_created_at = (manifest or {}).get('created_at') or model_data.get('retrained_at')
+            self.loaded_at = datetime.now()
+            
+            del model_data
+            release_memory()
+            rss_serving = current_rss_bytes()
+            if None not in (rss_before, rss_loaded, rss_serving):
+                self.memory_report = {
+                    'rss_before_load': rss_before,
+                    'rss_full_model': rss_loaded,
+                    'rss_serving_model': rss_serving,
+                    'serving_model_arrays': self.serving.nbytes()
+                }
+                print(f"✓ Memoria: {rss_loaded / 2**20:.0f} MB con el modelo completo → "
+                      f"{rss_serving / 2**20:.0f} MB con el modelo de servicio")
+            
+            print(f"✓ Modelo cargado ({self.model_version}): {self.n_users} usuarios, {self.n_items} películas")
         except Exception as e:
             print(f"Error cargando modelo: {e}")
             raise
     
+    def _attach_shared_model(self):
+        """Mapea en solo lectura la generación actual del almacén compartido (títulos incluidos)"""
+        from shared_model_store import SharedModelStore
+        
+        rss_before = current_rss_bytes()
+        self.serving, info = SharedModelStore(self.shared_store).load()
+        self.n_users = self.serving.n_users
+        self.n_items = self.serving.n_items
+        self.global_mean = info['global_mean']
+        self.model_version = info['version']
+        self.model_created_at = info.get('created_at')
+        self._movies_source = info.get('movies_source')
+        self.loaded_at = datetime.now()
+        
+        rss_serving = current_rss_bytes()
+        if None not in (rss_before, rss_serving):
+            self.memory_report = {
+                'rss_before_load': rss_before,
+                'rss_serving_model': rss_serving,
+                'serving_model_arrays': self.serving.nbytes()
+            }
+        print(f"✓ Modelo mapeado desde el almacén compartido ({self.model_version}): "
+              f"{self.n_users} usuarios, {self.n_items} películas")
+    
+    def warm_up(self):
+        """
+        Ejecuta una predicción y el cálculo de populares para dejar el modelo
+        en memoria antes de empezar a servir peticiones con él
+        """
+        if self.n_users == 0 or self.n_items == 0:
+            return
+        self.predict_rating(self.serving.users.raw[0], self.serving.items.raw[0])
+        self.get_popular_movies(n=10)
+    
     def predict_rating(self, user_id: str, movie_id: str) -> float:
         """Predice el rating para un usuario y película"""
-        prediction = self.model.predict(str(user_id), str(movie_id))
-        return prediction.est
+        return self.serving.predict(str(user_id), str(movie_id))
     
     def get_user_ratings_from_db(self, db: Session, user_id: str) -> Dict[str, float]:
         """Obtiene los ratings de un usuario desde la base de datos"""
-        ratings = RatingCRUD.get_user_ratings(db, user_id)
+        with span("db.load_user_ratings") as current:
+            ratings = RatingCRUD.get_user_ratings(db, user_id)
+            if current is not None:
+                current.set_attribute("ratings", len(ratings))
         return {r.movie_id: r.rating for r in ratings}
     
+    @model_timed('recommendations')
     def get_recommendations_from_db(
         self, 
         db: Session,
         user_id: str, 
         n: int = 10,
         exclude_rated: bool = True,
-        use_hybrid: bool = True
+        use_hybrid: bool = True,
+        genres: List[str] = None,
+        exclude_genres: List[str] = None
     ) -> List[Tuple[str, float, str]]:
         """
         Obtiene recomendaciones inteligentes basadas en el tipo de usuario:
@@ -129,46 +326,56 @@ class MovieRecommenderDB:
             n: Número de recomendaciones
             exclude_rated: Excluir películas ya valoradas
             use_hybrid: Usar lógica híbrida para usuarios nuevos
+            genres: Solo películas con alguno de estos géneros
+            exclude_genres: Sin películas con alguno de estos géneros
         
         Returns:
             Lista de tuplas (movie_id, predicted_rating, title)
         """
         # Obtener ratings del usuario desde la BD
         user_ratings_db = self.get_user_ratings_from_db(db, user_id)
+        return self.recommend_from_ratings(
+            user_id, user_ratings_db, n, exclude_rated, use_hybrid, genres, exclude_genres
+        )
+    
+    def recommend_from_ratings(
+        self,
+        user_id: str,
+        user_ratings_db: Dict[str, float],
+        n: int = 10,
+        exclude_rated: bool = True,
+        use_hybrid: bool = True,
+        genres: List[str] = None,
+        exclude_genres: List[str] = None
+    ) -> List[Tuple[str, float, str]]:
+        """
+        Recomendaciones de get_recommendations_from_db a partir de los ratings
+        del usuario ya leídos de la BD (no accede a la base de datos)
+        """
         rated_movie_ids = set(user_ratings_db.keys())
         
+        # Filtro de géneros sobre todo el catálogo (None si no se pide)
+        genre_mask = self.serving.genre_mask(genres, exclude_genres)
+        
         # Detectar si el usuario está en el trainset original
-        try:
-            self.trainset.to_inner_uid(str(user_id))
-            user_in_trainset = True
-        except ValueError:
-            user_in_trainset = False
+        inner_uid = self.serving.users.inner(user_id)
         
         # CASO 1: Usuario en trainset → SVD directo
-        if user_in_trainset:
-            all_movie_ids = [self.trainset.to_raw_iid(i) for i in range(self.n_items)]
-            
-            if exclude_rated:
-                candidate_movies = [mid for mid in all_movie_ids if mid not in rated_movie_ids]
-            else:
-                candidate_movies = all_movie_ids
-            
-            predictions = []
-            for movie_id in candidate_movies:
-                pred_rating = self.predict_rating(user_id, movie_id)
-                title = self.get_movie_title(movie_id)
-                predictions.append((movie_id, pred_rating, title))
-            
-            predictions.sort(key=lambda x: x[1], reverse=True)
-            return predictions[:n]
+        if inner_uid is not None:
+            RECOMMENDATION_CASES.inc('trainset_user')
+            candidates = self._candidate_mask(rated_movie_ids, genre_mask, exclude_rated)
+            with span("score_catalog", candidates=int(candidates.sum())):
+                scores = self.serving.score_user(inner_uid)
+            return self._top_scored(scores, candidates, n)
         
         # CASO 2: Usuario nuevo con ratings → Similitud
         elif len(user_ratings_db) > 0 and use_hybrid:
+            RECOMMENDATION_CASES.inc('new_user_with_ratings')
             recommendations = defaultdict(list)
             
             for movie_id, rating in user_ratings_db.items():
                 if rating >= 4.0:  # Solo películas que le gustaron
-                    similar_movies = self.get_similar_movies(movie_id, n=20)
+                    similar_movies = self._similar_movies(movie_id, n=20, item_mask=genre_mask)
                     
                     for sim_movie_id, similarity in similar_movies:
                         if sim_movie_id not in rated_movie_ids:
@@ -177,28 +384,175 @@ class MovieRecommenderDB:
             
             # Si no se encontraron recomendaciones, usar populares
             if not recommendations:
-                popular = self.get_popular_movies(n=n)
-                return [
-                    (movie_id, avg_rating, self.get_movie_title(movie_id))
-                    for movie_id, avg_rating in popular
-                ]
+                popular = self._popular_movies(n=n, item_mask=genre_mask)
+                with span("title_lookup"):
+                    return [
+                        (movie_id, avg_rating, self.get_movie_title(movie_id))
+                        for movie_id, avg_rating in popular
+                    ]
             
-            final_recommendations = [
-                (movie_id, np.mean(scores), self.get_movie_title(movie_id))
-                for movie_id, scores in recommendations.items()
-            ]
+            with span("title_lookup"):
+                final_recommendations = [
+                    (movie_id, np.mean(scores), self.get_movie_title(movie_id))
+                    for movie_id, scores in recommendations.items()
+                ]
             
             final_recommendations.sort(key=lambda x: x[1], reverse=True)
             return final_recommendations[:n]
         
         # CASO 3: Usuario nuevo sin ratings → Películas populares
         else:
-            popular = self.get_popular_movies(n=n)
+            RECOMMENDATION_CASES.inc('new_user_without_ratings')
+            popular = self._popular_movies(n=n, item_mask=genre_mask)
+            with span("title_lookup"):
+                return [
+                    (movie_id, avg_rating, self.get_movie_title(movie_id))
+                    for movie_id, avg_rating in popular
+                ]
+    
+    def _candidate_mask(
+        self, rated_movie_ids: Set[str], genre_mask: Optional[np.ndarray], exclude_rated: bool
+    ) -> np.ndarray:
+        """Películas candidatas (orden interno): filtro de géneros menos las ya valoradas"""
+        candidates = np.ones(self.n_items, dtype=bool) if genre_mask is None else genre_mask.copy()
+        if exclude_rated and rated_movie_ids:
+            rated_inner = self.serving.items.inner_many(rated_movie_ids)
+            candidates[rated_inner[rated_inner >= 0]] = False
+        return candidates
+    
+    def _top_scored(self, scores: np.ndarray, candidates: np.ndarray, n: int) -> List[Tuple[str, float, str]]:
+        """Las n candidatas con mayor estimación, con sus títulos"""
+        # Los títulos solo se buscan para las n primeras (el orden no depende de ellos)
+        candidate_iids = np.flatnonzero(candidates)
+        candidate_scores = scores[candidate_iids]
+        keep = np.arange(len(candidate_iids))
+        if 0 < n < len(candidate_iids):
+            # Solo se ordenan las que llegan al n-ésimo mejor valor (empates
+            # incluidos): mismo resultado que ordenar todas con argsort estable
+            threshold = np.partition(candidate_scores, len(candidate_scores) - n)[len(candidate_scores) - n]
+            keep = np.flatnonzero(candidate_scores >= threshold)
+        top = candidate_iids[keep[np.argsort(-candidate_scores[keep], kind='stable')][:n]]
+        with span("title_lookup"):
             return [
-                (movie_id, avg_rating, self.get_movie_title(movie_id))
-                for movie_id, avg_rating in popular
+                (movie_id, float(pred_rating), title or f"Movie {movie_id}")
+                for movie_id, pred_rating, title in zip(
+                    self.serving.items.raw[top].tolist(), scores[top].tolist(), self.serving.item_titles(top)
+                )
             ]
     
+    @model_timed('recommendations_batch')
+    def recommend_batch(self, requests: List[Dict]) -> List:
+        """
+        Resuelve juntas varias peticiones de recommend_from_ratings (ver
+        request_coalescer.py). Los usuarios del trainset se puntúan con un único
+        producto de matrices; el resto sigue el camino individual.
+        
+        Args:
+            requests: dicts con los argumentos de recommend_from_ratings
+        
+        Returns:
+            Resultado de cada petición, o la excepción que produjo
+        """
+        results: List = [None] * len(requests)
+        batched = []  # (posición, inner_uid, candidatas, n)
+        for index, request in enumerate(requests):
+            try:
+                inner_uid = self.serving.users.inner(request['user_id'])
+                if inner_uid is None:
+                    results[index] = self.recommend_from_ratings(**request)
+                    continue
+                genre_mask = self.serving.genre_mask(request.get('genres'), request.get('exclude_genres'))
+                candidates = self._candidate_mask(
+                    set(request['user_ratings_db']), genre_mask, request.get('exclude_rated', True)
+                )
+                batched.append((index, inner_uid, candidates, request.get('n', 10)))
+            except Exception as e:
+                results[index] = e
+        
+        if batched:
+            with span("score_catalog_batch", users=len(batched)):
+                scores = self.serving.score_users(np.array([inner_uid for _, inner_uid, _, _ in batched]))
+            for row, (index, _, candidates, n) in enumerate(batched):
+                RECOMMENDATION_CASES.inc('trainset_user')
+                results[index] = self._top_scored(scores[row], candidates, n)
+        return results
+    
+    def predict_ratings(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        """predict_rating para varios pares (usuario, película) en una sola operación vectorizada"""
+        if not pairs:
+            return []
+        user_ids, movie_ids = zip(*pairs)
+        return self.serving.predict_many(user_ids, movie_ids).tolist()
+
+    @model_timed('export_chunk')
+    def export_recommendations_chunk(
+        self,
+        db: Session,
+        offset: int = 0,
+        cursor: Optional[str] = None,
+        n: int = 50,
+        chunk_size: int = 512
+    ) -> Tuple[List[Dict], int, Optional[str]]:
+        """
+        Recomendaciones de un bloque de usuarios para la exportación (ver
+        recommendation_export.py). Los usuarios van en un orden fijo: primero
+        los del modelo por id interno y después los que solo están en la BD,
+        por user_id (cursor = último exportado).
+
+        Returns:
+            (registros, offset siguiente, cursor siguiente); sin registros, la
+            exportación ha terminado
+        """
+        if offset < self.n_users:
+            user_ids = self.serving.users.raw[offset:offset + chunk_size].tolist()
+        else:
+            user_ids = []
+            while len(user_ids) < chunk_size:
+                page = RatingCRUD.get_user_ids_after(db, cursor, chunk_size - len(user_ids))
+                if not page:
+                    break
+                cursor = page[-1]
+                in_model = self.serving.users.inner_many(page) >= 0
+                user_ids.extend(user_id for user_id, known in zip(page, in_model) if not known)
+        if not user_ids:
+            return [], offset, cursor
+
+        user_ratings = defaultdict(dict)
+        with span("db.load_chunk_ratings", users=len(user_ids)):
+            for user_id, movie_id, rating in RatingCRUD.get_ratings_for_users(db, user_ids):
+                user_ratings[user_id][movie_id] = rating
+
+        results = self.recommend_batch([
+            {'user_id': user_id, 'user_ratings_db': user_ratings.get(user_id, {}), 'n': n, 'exclude_rated': True}
+            for user_id in user_ids
+        ])
+        records = []
+        for user_id, result in zip(user_ids, results):
+            if isinstance(result, Exception):
+                records.append({'user_id': user_id, 'error': str(result)})
+                continue
+            records.append({
+                'user_id': user_id,
+                'recommendations': [
+                    {'movie_id': mid, 'predicted_rating': round(float(pred), 3), 'title': title, 'rank': i + 1}
+                    for i, (mid, pred, title) in enumerate(result)
+                ]
+            })
+        return records, offset + len(user_ids), cursor
+
+    def add_rating(self, db: Session, user_id: str, movie_id: str, rating: float) -> Dict:
+        """Guarda (o actualiza) un rating en la BD, sin recalcular recomendaciones"""
+        with span("db.write_rating"):
+            saved_rating = RatingCRUD.create_rating(db, user_id, movie_id, rating)
+        return {
+            "user_id": user_id,
+            "movie_id": movie_id,
+            "rating": rating,
+            "movie_title": self.get_movie_title(movie_id),
+            "timestamp": saved_rating.timestamp.isoformat()
+        }
+    
+    @model_timed('add_rating_and_recommend')
     def add_rating_and_get_recommendations(
         self,
         db: Session,
@@ -213,8 +567,7 @@ class MovieRecommenderDB:
         Returns:
             Dict con información del rating guardado y recomendaciones
         """
-        # Guardar rating en la base de datos
-        saved_rating = RatingCRUD.create_rating(db, user_id, movie_id, rating)
+        rating_saved = self.add_rating(db, user_id, movie_id, rating)
         
         # Obtener recomendaciones actualizadas
         recommendations = self.get_recommendations_from_db(
@@ -222,16 +575,11 @@ class MovieRecommenderDB:
         )
         
         # Contar total de ratings del usuario
-        total_ratings = RatingCRUD.count_user_ratings(db, user_id)
+        with span("db.count_user_ratings"):
+            total_ratings = RatingCRUD.count_user_ratings(db, user_id)
         
         return {
-            "rating_saved": {
-                "user_id": user_id,
-                "movie_id": movie_id,
-                "rating": rating,
-                "movie_title": self.get_movie_title(movie_id),
-                "timestamp": saved_rating.timestamp.isoformat()
-            },
+            "rating_saved": rating_saved,
             "user_stats": {
                 "total_ratings": total_ratings,
                 "user_id": user_id
@@ -260,11 +608,14 @@ class MovieRecommenderDB:
             for r in ratings
         ]
     
+    @model_timed('similar_movies')
     def get_similar_movies(
         self, 
         movie_id: str, 
         n: int = 10,
-        exclude_movie_ids: set = None
+        exclude_movie_ids: set = None,
+        genres: List[str] = None,
+        exclude_genres: List[str] = None
     ) -> List[Tuple[str, float]]:
         """
         Encuentra películas similares basándose en factores latentes
@@ -273,58 +624,85 @@ class MovieRecommenderDB:
             movie_id: ID de la película de referencia
             n: Número de películas similares a devolver
             exclude_movie_ids: Set de IDs de películas a excluir
+            genres: Solo películas con alguno de estos géneros
+            exclude_genres: Sin películas con alguno de estos géneros
         
         Returns:
             Lista de tuplas (movie_id, similarity_score)
         """
-        if exclude_movie_ids is None:
-            exclude_movie_ids = set()
-        
-        try:
-            movie_inner_id = self.trainset.to_inner_iid(str(movie_id))
-            movie_factors = self.model.qi[movie_inner_id]
-            
-            similarities = []
-            for iid in range(self.n_items):
-                if iid == movie_inner_id:
-                    continue
-                
-                # Obtener el ID raw de la película
-                other_movie_id = self.trainset.to_raw_iid(iid)
-                
-                # NUEVO: Excluir películas en la lista de exclusión
-                if other_movie_id in exclude_movie_ids:
-                    continue
-                
-                other_factors = self.model.qi[iid]
-                similarity = np.dot(movie_factors, other_factors) / (
-                    np.linalg.norm(movie_factors) * np.linalg.norm(other_factors)
-                )
-                
-                similarities.append((other_movie_id, similarity))
-            
-            similarities.sort(key=lambda x: x[1], reverse=True)
-            return similarities[:n]
-        except ValueError:
-            return []
+        return self._similar_movies(
+            movie_id, n, exclude_movie_ids, self.serving.genre_mask(genres, exclude_genres)
+        )
     
-    def get_popular_movies(self, n: int = 10, min_ratings: int = 50) -> List[Tuple[str, float]]:
-        """Obtiene películas populares (sin cambios)"""
-        movie_ratings = defaultdict(list)
+    def _similar_movies(
+        self,
+        movie_id: str,
+        n: int,
+        exclude_movie_ids: set = None,
+        item_mask: Optional[np.ndarray] = None
+    ) -> List[Tuple[str, float]]:
+        """
+        Similares restringidos a item_mask (máscara booleana en orden interno).
+        Con tabla de vecinos es un slice de su fila; solo se puntúa el catálogo
+        si los filtros dejan menos de n vecinos entre los K guardados.
+        """
+        movie_inner_id = self.serving.items.inner(movie_id)
+        if movie_inner_id is None:
+            return []
         
-        for uid in range(self.n_users):
-            for (iid, rating) in self.trainset.ur[uid]:
-                movie_id = self.trainset.to_raw_iid(iid)
-                movie_ratings[movie_id].append(rating)
+        depth = self.serving.neighbor_depth
+        if depth > 0:
+            ids = self.serving.neighbor_ids[movie_inner_id]
+            keep = np.ones(depth, dtype=bool) if item_mask is None else item_mask[ids]
+            if exclude_movie_ids:
+                excluded = self.serving.items.inner_many(exclude_movie_ids)
+                keep &= ~np.isin(ids, excluded[excluded >= 0])
+            selected = np.flatnonzero(keep)[:n]
+            # La fila tiene todo el catálogo o basta con ella para llenar los n huecos
+            if len(selected) == n or depth >= self.n_items - 1:
+                return list(zip(
+                    self.serving.items.raw[ids[selected]].tolist(),
+                    self.serving.neighbor_scores[movie_inner_id][selected].astype(np.float64)
+                ))
         
-        popular_movies = []
-        for movie_id, ratings in movie_ratings.items():
-            if len(ratings) >= min_ratings:
-                avg_rating = np.mean(ratings)
-                popular_movies.append((movie_id, avg_rating))
+        candidates = np.ones(self.n_items, dtype=bool) if item_mask is None else item_mask.copy()
+        candidates[movie_inner_id] = False
+        if exclude_movie_ids:
+            excluded = self.serving.items.inner_many(exclude_movie_ids)
+            candidates[excluded[excluded >= 0]] = False
         
-        popular_movies.sort(key=lambda x: x[1], reverse=True)
-        return popular_movies[:n]
+        candidate_iids = np.flatnonzero(candidates)
+        similarities = self.serving.cosine_similarities(movie_inner_id)[candidate_iids]
+        order = np.argsort(-similarities, kind='stable')[:n]
+        return list(zip(self.serving.items.raw[candidate_iids[order]].tolist(), similarities[order]))
+    
+    @model_timed('popular_movies')
+    def get_popular_movies(
+        self,
+        n: int = 10,
+        min_ratings: int = 50,
+        genres: List[str] = None,
+        exclude_genres: List[str] = None
+    ) -> List[Tuple[str, float]]:
+        """
+        Películas con al menos min_ratings valoraciones en el trainset, por
+        rating medio (a igualdad, en el orden en que aparecen en el trainset),
+        opcionalmente filtradas por género
+        """
+        return self._popular_movies(n, min_ratings, self.serving.genre_mask(genres, exclude_genres))
+    
+    def _popular_movies(
+        self, n: int, min_ratings: int = 50, item_mask: Optional[np.ndarray] = None
+    ) -> List[Tuple[str, float]]:
+        """Populares restringidas a item_mask (máscara booleana en orden interno)"""
+        serving = self.serving
+        eligible = (serving.item_count >= min_ratings) & (serving.item_count > 0)
+        if item_mask is not None:
+            eligible &= item_mask
+        eligible = np.flatnonzero(eligible)
+        order = np.lexsort((serving.item_first_seen[eligible], -serving.item_mean[eligible]))[:n]
+        top = eligible[order]
+        return list(zip(serving.items.raw[top].tolist(), serving.item_mean[top]))
 
 
 # ============================================================================
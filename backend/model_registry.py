@@ -0,0 +1,449 @@
+"""
+Registro Versionado de Modelos
+Sistema de Recomendación de Películas - Grupo 8
+
+Cada versión del modelo se guarda en su propio directorio junto a un
+manifiesto JSON ligero (métricas, tamaños, marca de agua de datos y hash).
+El fichero CURRENT apunta a la versión en producción y se cambia de forma
+atómica, así que consultar la metadata del modelo no requiere deserializar
+el pickle completo.
+
+Estructura:
+    models/registry/
+    ├── CURRENT                       # id de la versión activa
+    └── versions/
+        ├── 20251202_180024/
+        │   ├── model.pkl             # artefacto (model + trainset)
+        │   ├── neighbors.npz         # tabla de vecinos (ver item_neighbors.py)
+        │   └── manifest.json
+        └── 20251125_020000/
+            ├── model.pkl.gz          # backup comprimido
+            └── manifest.json
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import pickle
+import shutil
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+ARTIFACT_NAME = "model.pkl"
+COMPRESSED_ARTIFACT_NAME = "model.pkl.gz"
+MANIFEST_NAME = "manifest.json"
+CURRENT_POINTER = "CURRENT"
+
+
+def _file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Calcula el hash SHA-256 de un fichero por bloques"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _rating_std(trainset) -> Optional[float]:
+    """Desviación típica de los ratings de entrenamiento (referencia de la deriva en schedule_retrain.py)"""
+    if trainset is None or not getattr(trainset, 'n_ratings', 0):
+        return None
+    import numpy as np
+    ratings = np.fromiter(
+        (r for user_ratings in trainset.ur.values() for _, r in user_ratings),
+        dtype=np.float64, count=trainset.n_ratings
+    )
+    return round(float(ratings.std()), 6)
+
+
+def _fsync_dir(path: str):
+    """Persiste la entrada de directorio tras un rename (no aplica en Windows)"""
+    if os.name == 'nt':
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _atomic_write(path: str, write: Callable, mode: str = 'wb', encoding: str = None):
+    """
+    Escribe en un temporal del mismo directorio, hace fsync y lo renombra sobre
+    el destino. Un lector concurrente ve el fichero anterior o el nuevo completo,
+    nunca uno a medio escribir.
+    """
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    try:
+        with open(tmp_path, mode, encoding=encoding) as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    _fsync_dir(os.path.dirname(path) or ".")
+
+
+def _write_json_atomic(path: str, data: Dict):
+    """Escribe un JSON de forma atómica"""
+    _atomic_write(
+        path,
+        lambda f: json.dump(data, f, indent=2, ensure_ascii=False),
+        mode='w',
+        encoding='utf-8'
+    )
+
+
+class ModelRegistry:
+    """Registro de versiones del modelo con puntero CURRENT y retención"""
+
+    def __init__(self, root: str = 'models/registry', max_versions: int = 5, keep_uncompressed: int = 2):
+        """
+        Args:
+            root: Directorio raíz del registro
+            max_versions: Número máximo de versiones conservadas (incluida la actual)
+            keep_uncompressed: Versiones más recientes que se mantienen sin comprimir
+                               para que el rollback sea un simple cambio de puntero
+        """
+        self.root = root
+        self.versions_dir = os.path.join(root, "versions")
+        self.max_versions = max(1, max_versions)
+        self.keep_uncompressed = max(1, keep_uncompressed)
+
+    @classmethod
+    def for_model_path(cls, model_path: str, **kwargs) -> "ModelRegistry":
+        """Registro asociado a una ruta de modelo clásica (models/svd_model_1m.pkl)"""
+        return cls(os.path.join(os.path.dirname(model_path) or ".", "registry"), **kwargs)
+
+    # ------------------------------------------------------------------
+    # Consultas
+    # ------------------------------------------------------------------
+
+    def _version_dir(self, version: str) -> str:
+        return os.path.join(self.versions_dir, version)
+
+    def list_versions(self) -> List[str]:
+        """Devuelve los ids de versión ordenados del más reciente al más antiguo"""
+        if not os.path.isdir(self.versions_dir):
+            return []
+        versions = [
+            v for v in os.listdir(self.versions_dir)
+            if os.path.exists(os.path.join(self._version_dir(v), MANIFEST_NAME))
+        ]
+        return sorted(versions, reverse=True)
+
+    def current_version(self) -> Optional[str]:
+        """Id de la versión activa (None si el registro está vacío)"""
+        pointer = os.path.join(self.root, CURRENT_POINTER)
+        try:
+            with open(pointer, 'r', encoding='utf-8') as f:
+                version = f.read().strip()
+        except FileNotFoundError:
+            return None
+        return version or None
+
+    def get_manifest(self, version: str = None) -> Optional[Dict]:
+        """Lee el manifiesto de una versión (por defecto la actual)"""
+        version = version or self.current_version()
+        if version is None:
+            return None
+        path = os.path.join(self._version_dir(version), MANIFEST_NAME)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def artifact_path(self, version: str = None) -> Optional[str]:
+        """Ruta del artefacto de una versión, comprimido o no"""
+        version = version or self.current_version()
+        if version is None:
+            return None
+        for name in (ARTIFACT_NAME, COMPRESSED_ARTIFACT_NAME):
+            path = os.path.join(self._version_dir(version), name)
+            if os.path.exists(path):
+                return path
+        return None
+
+    # ------------------------------------------------------------------
+    # Publicación y puntero CURRENT
+    # ------------------------------------------------------------------
+
+    def _create_version_dir(self) -> str:
+        """Reserva un id de versión creando su directorio (seguro entre procesos)"""
+        os.makedirs(self.versions_dir, exist_ok=True)
+        base = datetime.now().strftime("%Y%m%d_%H%M%S")
+        version, suffix = base, 1
+        while True:
+            try:
+                os.mkdir(self._version_dir(version))
+                return version
+            except FileExistsError:
+                version = f"{base}_{suffix}"
+                suffix += 1
+
+    def publish(self, model_data: Dict, manifest: Dict = None, retention: bool = True,
+                arrays: Dict[str, Dict] = None) -> str:
+        """
+        Guarda una nueva versión, la marca como actual y aplica la retención
+
+        Args:
+            model_data: Diccionario que se serializa con pickle (model, trainset, ...)
+            manifest: Campos adicionales del manifiesto (metrics, params, data_watermark...)
+            retention: Aplicar la política de retención tras publicar
+            arrays: Ficheros .npz que se guardan junto al artefacto antes de
+                marcar la versión como actual ({nombre: {clave: array}})
+
+        Returns:
+            Id de la versión publicada
+        """
+        version = self._create_version_dir()
+        version_dir = self._version_dir(version)
+
+        artifact = os.path.join(version_dir, ARTIFACT_NAME)
+        _atomic_write(artifact, lambda f: pickle.dump(model_data, f))
+        for name, named_arrays in (arrays or {}).items():
+            self.attach_arrays(version, name, named_arrays)
+
+        full_manifest = {
+            "version": version,
+            "created_at": model_data.get('retrained_at', datetime.now().isoformat()),
+            "model_format": model_data.get('version', '1.0'),
+            "n_users": model_data.get('n_users'),
+            "n_items": model_data.get('n_items'),
+            "global_mean": model_data.get('global_mean'),
+            "rating_std": _rating_std(model_data.get('trainset')),
+        }
+        full_manifest.update(manifest or {})
+        full_manifest["artifact"] = {
+            "file": ARTIFACT_NAME,
+            "sha256": _file_sha256(artifact),
+            "size_bytes": os.path.getsize(artifact),
+            "stored_bytes": os.path.getsize(artifact),
+            "compressed": False
+        }
+        _write_json_atomic(os.path.join(version_dir, MANIFEST_NAME), full_manifest)
+
+        self.set_current(version)
+        if retention:
+            self.apply_retention()
+        return version
+
+    def set_current(self, version: str):
+        """Cambia el puntero CURRENT de forma atómica"""
+        if not os.path.exists(os.path.join(self._version_dir(version), MANIFEST_NAME)):
+            raise ValueError(f"Versión inexistente: {version}")
+        self.ensure_uncompressed(version)
+        _atomic_write(
+            os.path.join(self.root, CURRENT_POINTER),
+            lambda f: f.write(version),
+            mode='w',
+            encoding='utf-8'
+        )
+
+    def attach_json(self, version: str, name: str, data: Dict) -> str:
+        """Guarda un JSON adicional (p. ej. run_report.json) junto al artefacto de una versión"""
+        path = os.path.join(self._version_dir(version), name)
+        _write_json_atomic(path, data)
+        return path
+
+    def read_json(self, version: str, name: str) -> Optional[Dict]:
+        """Lee un JSON adjunto a una versión (None si no existe)"""
+        path = os.path.join(self._version_dir(version), name)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def attach_arrays(self, version: str, name: str, arrays: Dict) -> str:
+        """Guarda arrays de numpy (p. ej. la tabla de vecinos) como un .npz junto al artefacto"""
+        import numpy as np
+
+        path = os.path.join(self._version_dir(version), name)
+        _atomic_write(path, lambda f: np.savez(f, **arrays))
+        return path
+
+    def read_arrays(self, version: str, name: str) -> Optional[Dict]:
+        """Lee un .npz adjunto a una versión (None si no existe)"""
+        import numpy as np
+
+        path = os.path.join(self._version_dir(version), name)
+        if not os.path.exists(path):
+            return None
+        with np.load(path, allow_pickle=False) as data:
+            return {key: data[key] for key in data.files}
+
+    def rollback(self, version: str = None) -> str:
+        """
+        Vuelve a una versión anterior (por defecto la inmediatamente previa a la actual)
+
+        Returns:
+            Id de la versión que queda activa
+        """
+        if version is None:
+            versions = self.list_versions()
+            current = self.current_version()
+            older = [v for v in versions if current is None or v < current]
+            if not older:
+                raise ValueError("No hay versiones anteriores para hacer rollback")
+            version = older[0]
+        self.set_current(version)
+        return version
+
+    # ------------------------------------------------------------------
+    # Compresión y retención
+    # ------------------------------------------------------------------
+
+    def compress(self, version: str):
+        """Comprime el artefacto de una versión con gzip"""
+        version_dir = self._version_dir(version)
+        src = os.path.join(version_dir, ARTIFACT_NAME)
+        if not os.path.exists(src):
+            return
+        dst = os.path.join(version_dir, COMPRESSED_ARTIFACT_NAME)
+
+        def write_compressed(f_out):
+            with open(src, 'rb') as f_in, gzip.GzipFile(fileobj=f_out, mode='wb') as gz:
+                shutil.copyfileobj(f_in, gz)
+
+        _atomic_write(dst, write_compressed)
+        os.remove(src)
+        self._update_artifact_info(version, COMPRESSED_ARTIFACT_NAME, compressed=True)
+
+    def ensure_uncompressed(self, version: str):
+        """Descomprime el artefacto de una versión si hace falta"""
+        version_dir = self._version_dir(version)
+        src = os.path.join(version_dir, COMPRESSED_ARTIFACT_NAME)
+        if os.path.exists(os.path.join(version_dir, ARTIFACT_NAME)) or not os.path.exists(src):
+            return
+        dst = os.path.join(version_dir, ARTIFACT_NAME)
+
+        def write_uncompressed(f_out):
+            with gzip.open(src, 'rb') as f_in:
+                shutil.copyfileobj(f_in, f_out)
+
+        _atomic_write(dst, write_uncompressed)
+        os.remove(src)
+        self._update_artifact_info(version, ARTIFACT_NAME, compressed=False)
+
+    def _update_artifact_info(self, version: str, file_name: str, compressed: bool):
+        manifest = self.get_manifest(version)
+        artifact = manifest.setdefault("artifact", {})
+        artifact["file"] = file_name
+        artifact["compressed"] = compressed
+        artifact["stored_bytes"] = os.path.getsize(os.path.join(self._version_dir(version), file_name))
+        _write_json_atomic(os.path.join(self._version_dir(version), MANIFEST_NAME), manifest)
+
+    def apply_retention(self) -> List[str]:
+        """
+        Comprime las versiones antiguas y elimina las que exceden max_versions.
+        La versión actual nunca se comprime ni se elimina.
+
+        Returns:
+            Lista de versiones eliminadas
+        """
+        current = self.current_version()
+        versions = self.list_versions()
+        kept = [current] if current in versions else []
+        kept += [v for v in versions if v != current][:self.max_versions - len(kept)]
+
+        removed = []
+        for version in versions:
+            if version not in kept:
+                shutil.rmtree(self._version_dir(version), ignore_errors=True)
+                removed.append(version)
+
+        for position, version in enumerate(v for v in versions if v in kept):
+            if version != current and position >= self.keep_uncompressed:
+                self.compress(version)
+        return removed
+
+    def import_legacy(self, model_path: str, manifest: Dict = None) -> str:
+        """Registra un pickle clásico (p. ej. models/svd_model_1m.pkl) como nueva versión"""
+        model_data = load_model_data(model_path)
+        return self.publish(model_data, manifest)
+
+
+# ============================================================================
+# FUNCIONES AUXILIARES
+# ============================================================================
+
+def load_model_data(path: str) -> Dict:
+    """Deserializa un artefacto de modelo (admite .pkl y .pkl.gz)"""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def resolve_model_path(model_path: str) -> str:
+    """
+    Devuelve el artefacto a cargar: la versión actual del registro si existe,
+    o la ruta clásica del modelo en caso contrario
+    """
+    registry = ModelRegistry.for_model_path(model_path)
+    artifact = registry.artifact_path()
+    return artifact if artifact else model_path
+
+
+def read_model_info(model_path: str = 'models/svd_model_1m.pkl') -> Dict:
+    """
+    Metadata del modelo actual sin deserializar el artefacto cuando hay registro.
+    Para modelos antiguos sin manifiesto se recurre a leer el pickle.
+    """
+    manifest = ModelRegistry.for_model_path(model_path).get_manifest()
+    if manifest is not None:
+        return {
+            'last_retrain': manifest.get('created_at'),
+            'n_users': manifest.get('n_users'),
+            'n_items': manifest.get('n_items'),
+            'version': manifest.get('version'),
+            'metrics': manifest.get('metrics'),
+            'data_watermark': manifest.get('data_watermark')
+        }
+
+    if not os.path.exists(model_path):
+        return {}
+    model_data = load_model_data(model_path)
+    return {
+        'last_retrain': model_data.get('retrained_at', 'Never (original model)'),
+        'n_users': model_data.get('n_users'),
+        'n_items': model_data.get('n_items'),
+        'version': model_data.get('version', '1.0')
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Gestión del registro de versiones del modelo')
+    parser.add_argument('command', choices=['list', 'show', 'rollback', 'import-legacy', 'prune'])
+    parser.add_argument('version', nargs='?', help='Versión objetivo (show/rollback)')
+    parser.add_argument('--model-path', default='models/svd_model_1m.pkl', help='Ruta clásica del modelo')
+    parser.add_argument('--max-versions', type=int, default=5, help='Versiones a conservar')
+
+    args = parser.parse_args()
+    registry = ModelRegistry.for_model_path(args.model_path, max_versions=args.max_versions)
+
+    if args.command == 'list':
+        current = registry.current_version()
+        for v in registry.list_versions():
+            manifest = registry.get_manifest(v)
+            rmse = (manifest.get('metrics') or {}).get('rmse')
+            marker = '*' if v == current else ' '
+            rmse_str = f"RMSE={rmse:.5f}" if rmse is not None else "RMSE=N/A"
+            compressed = " (comprimido)" if manifest['artifact'].get('compressed') else ""
+            print(f" {marker} {v}  {rmse_str}  {manifest['artifact']['size_bytes'] / (1024 * 1024):.2f} MB{compressed}")
+    elif args.command == 'show':
+        print(json.dumps(registry.get_manifest(args.version), indent=2, ensure_ascii=False))
+    elif args.command == 'rollback':
+        version = registry.rollback(args.version)
+        print(f"✓ Versión activa: {version}")
+    elif args.command == 'import-legacy':
+        version = registry.import_legacy(args.model_path)
+        print(f"✓ Modelo {args.model_path} registrado como versión {version}")
+    elif args.command == 'prune':
+        removed = registry.apply_retention()
+        print(f"✓ Versiones eliminadas: {len(removed)}")
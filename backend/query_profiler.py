@@ -0,0 +1,294 @@
+"""
+Profiler de Consultas SQL por Petición
+Sistema de Recomendación de Películas - Grupo 8
+
+Profiler opcional (QUERY_PROFILER=1) construido sobre los eventos del engine
+de SQLAlchemy. Para cada petición HTTP registra el número de consultas, el
+tiempo total en la BD y la huella normalizada de cada sentencia; añade esos
+datos como cabeceras de respuesta, avisa en el log de las peticiones y
+consultas lentas y de los patrones N+1 (la misma sentencia repetida muchas
+veces en una petición), y acumula un resumen de las sentencias más costosas.
+
+Variables de entorno:
+    QUERY_PROFILER=1                  Activar el profiler en main.py
+    QUERY_PROFILER_SLOW_REQUEST_MS    Umbral de petición lenta (por defecto 100)
+    QUERY_PROFILER_SLOW_QUERY_MS      Umbral de consulta lenta (por defecto 20)
+    QUERY_PROFILER_REPEAT_THRESHOLD   Repeticiones que se marcan como N+1 (por defecto 5)
+    QUERY_PROFILER_LOG                JSONL donde guardar cada petición perfilada
+
+Uso del resumen:
+    python query_profiler.py summarize logs/query_profile.jsonl --top 15
+"""
+
+import contextvars
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter as CounterDict
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from metrics import route_template
+
+logger = logging.getLogger("query_profiler")
+
+_current_profile: contextvars.ContextVar = contextvars.ContextVar("query_profile", default=None)
+
+_WHITESPACE = re.compile(r"\s+")
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\bIN\s*\((?:\s*\?\s*,?)+\)", re.IGNORECASE)
+_LIMIT_OFFSET = re.compile(r"\b(LIMIT|OFFSET)\s+\?", re.IGNORECASE)
+
+
+def fingerprint(statement: str) -> str:
+    """
+    Normaliza una sentencia para agrupar las equivalentes: literales y números
+    pasan a '?', las listas IN (?, ?, ...) se colapsan y se unifican espacios
+    """
+    normalized = _STRING_LITERAL.sub("?", statement)
+    normalized = _NUMBER.sub("?", normalized)
+    normalized = _IN_LIST.sub("IN (...)", normalized)
+    normalized = _LIMIT_OFFSET.sub(r"\1 ?", normalized)
+    return _WHITESPACE.sub(" ", normalized).strip()
+
+
+class RequestProfile:
+    """Consultas ejecutadas durante una petición"""
+
+    def __init__(self, label: str):
+        self.label = label
+        self.queries: List[tuple] = []  # (huella, ms)
+        self.started = time.perf_counter()
+        self.elapsed_ms: Optional[float] = None
+
+    def add(self, statement_fingerprint: str, duration_ms: float):
+        self.queries.append((statement_fingerprint, duration_ms))
+
+    @property
+    def count(self) -> int:
+        return len(self.queries)
+
+    @property
+    def db_ms(self) -> float:
+        return sum(ms for _, ms in self.queries)
+
+    def repeated(self, threshold: int) -> Dict[str, int]:
+        """Huellas ejecutadas al menos `threshold` veces (sospechosas de N+1)"""
+        counts = CounterDict(fp for fp, _ in self.queries)
+        return {fp: n for fp, n in counts.items() if n >= threshold}
+
+    def to_dict(self) -> Dict:
+        by_fingerprint: Dict[str, Dict] = {}
+        for fp, ms in self.queries:
+            entry = by_fingerprint.setdefault(fp, {"count": 0, "total_ms": 0.0})
+            entry["count"] += 1
+            entry["total_ms"] += ms
+        return {
+            "request": self.label,
+            "elapsed_ms": round(self.elapsed_ms or 0.0, 3),
+            "query_count": self.count,
+            "db_ms": round(self.db_ms, 3),
+            "statements": [
+                {"fingerprint": fp, "count": e["count"], "total_ms": round(e["total_ms"], 3)}
+                for fp, e in sorted(by_fingerprint.items(), key=lambda kv: -kv[1]["total_ms"])
+            ]
+        }
+
+
+class QueryProfiler:
+    """Agrega los perfiles de todas las peticiones y avisa de las anómalas"""
+
+    def __init__(
+        self,
+        slow_request_ms: float = 100.0,
+        slow_query_ms: float = 20.0,
+        repeat_threshold: int = 5,
+        log_path: Optional[str] = None
+    ):
+        self.slow_request_ms = slow_request_ms
+        self.slow_query_ms = slow_query_ms
+        self.repeat_threshold = repeat_threshold
+        self.log_path = log_path
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict] = {}
+        self.requests = 0
+        self.flagged_requests = 0
+
+    @classmethod
+    def from_env(cls) -> "QueryProfiler":
+        return cls(
+            slow_request_ms=float(os.getenv("QUERY_PROFILER_SLOW_REQUEST_MS", "100")),
+            slow_query_ms=float(os.getenv("QUERY_PROFILER_SLOW_QUERY_MS", "20")),
+            repeat_threshold=int(os.getenv("QUERY_PROFILER_REPEAT_THRESHOLD", "5")),
+            log_path=os.getenv("QUERY_PROFILER_LOG")
+        )
+
+    def instrument(self, engine):
+        """Registra los eventos de SQLAlchemy en el engine"""
+        from sqlalchemy import event
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def _before(conn, cursor, statement, parameters, context, executemany):
+            if _current_profile.get() is not None:
+                conn.info.setdefault("_profiler_query_start", []).append(time.perf_counter())
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def _after(conn, cursor, statement, parameters, context, executemany):
+            profile = _current_profile.get()
+            starts = conn.info.get("_profiler_query_start")
+            if profile is None or not starts:
+                return
+            duration_ms = (time.perf_counter() - starts.pop()) * 1000
+            fp = fingerprint(statement)
+            profile.add(fp, duration_ms)
+            if duration_ms >= self.slow_query_ms:
+                logger.warning(f"Consulta lenta ({duration_ms:.1f} ms) en {profile.label}: {fp[:200]}")
+
+    @contextmanager
+    def profile(self, label: str):
+        """Perfila las consultas ejecutadas dentro del bloque"""
+        profile = RequestProfile(label)
+        token = _current_profile.set(profile)
+        try:
+            yield profile
+        finally:
+            _current_profile.reset(token)
+            profile.elapsed_ms = (time.perf_counter() - profile.started) * 1000
+            self.record(profile)
+
+    def record(self, profile: RequestProfile):
+        """Acumula un perfil en el resumen y avisa si supera los umbrales"""
+        repeated = profile.repeated(self.repeat_threshold)
+        slow = profile.elapsed_ms is not None and profile.elapsed_ms >= self.slow_request_ms
+        with self._lock:
+            self.requests += 1
+            if slow or repeated:
+                self.flagged_requests += 1
+            for fp, ms in profile.queries:
+                entry = self._stats.setdefault(fp, {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "requests": set()})
+                entry["count"] += 1
+                entry["total_ms"] += ms
+                entry["max_ms"] = max(entry["max_ms"], ms)
+                entry["requests"].add(profile.label)
+
+        if slow:
+            logger.warning(
+                f"Petición lenta {profile.label}: {profile.elapsed_ms:.1f} ms, "
+                f"{profile.count} consultas, {profile.db_ms:.1f} ms en BD"
+            )
+        for fp, n in repeated.items():
+            logger.warning(f"Posible N+1 en {profile.label}: {n}× {fp[:200]}")
+
+        if self.log_path:
+            record = profile.to_dict()
+            record["slow"] = slow
+            record["repeated"] = repeated
+            with self._lock, open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+
+    def summary(self, top: int = 20) -> Dict:
+        """Huellas más costosas por tiempo total acumulado"""
+        with self._lock:
+            statements = [
+                {
+                    "fingerprint": fp,
+                    "count": e["count"],
+                    "total_ms": round(e["total_ms"], 3),
+                    "mean_ms": round(e["total_ms"] / e["count"], 3),
+                    "max_ms": round(e["max_ms"], 3),
+                    "requests": sorted(e["requests"])
+                }
+                for fp, e in self._stats.items()
+            ]
+            requests, flagged = self.requests, self.flagged_requests
+        statements.sort(key=lambda s: -s["total_ms"])
+        return {"requests": requests, "flagged_requests": flagged, "statements": statements[:top]}
+
+
+def format_summary(summary: Dict) -> List[str]:
+    lines = [
+        f"Peticiones perfiladas: {summary['requests']} | marcadas (lentas o N+1): {summary['flagged_requests']}",
+        f"{'Total (ms)':>11}{'Media (ms)':>12}{'Máx (ms)':>10}{'Veces':>8}  Sentencia"
+    ]
+    for s in summary["statements"]:
+        lines.append(
+            f"{s['total_ms']:>11.1f}{s['mean_ms']:>12.3f}{s['max_ms']:>10.2f}{s['count']:>8}  {s['fingerprint'][:90]}"
+        )
+        lines.append(f"{'':>43}↳ {', '.join(s['requests'])[:90]}")
+    return lines
+
+
+def summarize_log(path: str, top: int = 20) -> Dict:
+    """Resumen a partir del JSONL escrito con QUERY_PROFILER_LOG"""
+    profiler = QueryProfiler(slow_request_ms=float("inf"), repeat_threshold=10**9)
+    flagged = 0
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            profile = RequestProfile(record["request"])
+            profile.elapsed_ms = record["elapsed_ms"]
+            for s in record["statements"]:
+                # Se reparte el total entre las ejecuciones para conservar suma y número
+                profile.queries.extend([(s["fingerprint"], s["total_ms"] / s["count"])] * s["count"])
+            profiler.record(profile)
+            flagged += bool(record.get("slow") or record.get("repeated"))
+    summary = profiler.summary(top)
+    summary["flagged_requests"] = flagged
+    return summary
+
+
+class QueryProfilerMiddleware:
+    """
+    Middleware ASGI que perfila cada petición y devuelve los datos en las
+    cabeceras X-DB-Query-Count y X-DB-Time-Ms
+    """
+
+    def __init__(self, app, profiler: QueryProfiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile_holder = []
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and profile_holder:
+                profile = profile_holder[0]
+                headers = list(message.get("headers", []))
+                headers.append((b"x-db-query-count", str(profile.count).encode()))
+                headers.append((b"x-db-time-ms", f"{profile.db_ms:.3f}".encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        with self.profiler.profile(scope["method"] + " " + scope["path"]) as profile:
+            profile_holder.append(profile)
+            await self.app(scope, receive, send_wrapper)
+            # La etiqueta definitiva usa la plantilla de la ruta, no la URL concreta
+            template = route_template(scope)
+            if template != "unmatched":
+                profile.label = f"{scope['method']} {template}"
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Resumen del profiler de consultas SQL')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    summarize_parser = subparsers.add_parser('summarize', help='Sentencias más costosas de un JSONL')
+    summarize_parser.add_argument('path', help='Fichero escrito con QUERY_PROFILER_LOG')
+    summarize_parser.add_argument('--top', type=int, default=20, help='Número de sentencias a mostrar')
+    args = parser.parse_args()
+
+    print("="*70)
+    print("PROFILER DE CONSULTAS SQL - RESUMEN")
+    print("="*70)
+    for line in format_summary(summarize_log(args.path, args.top)):
+        print(line)
+    print("="*70)
@@ -0,0 +1,275 @@
+"""
+Exportación de Recomendaciones para Todos los Usuarios
+Sistema de Recomendación de Películas - Grupo 8
+
+El pipeline de email y CRM necesita el top-50 de cada usuario. En lugar de
+miles de llamadas a /recommendations/from-db, la exportación recorre los
+usuarios por bloques (MovieRecommenderDB.export_recommendations_chunk). Cada
+bloque lee los ratings de sus usuarios con una sola consulta y los puntúa con
+un único producto de matrices (recommend_batch). La memoria depende del
+tamaño del bloque (bloque x películas estimaciones), no del número de
+usuarios.
+
+Orden y posición: primero los usuarios del modelo por id interno y después
+los que solo están en la BD por user_id. La posición es (offset, cursor):
+usuarios exportados y último user_id exportado de la BD.
+
+Salidas:
+- ndjson: un fichero con una línea por usuario
+  {"user_id": ..., "recommendations": [{"movie_id", "predicted_rating", "title", "rank"}]}
+- csv: un directorio con un fragmento part-NNNNNN.csv por bloque y una fila
+  por recomendación (user_id, rank, movie_id, predicted_rating, title)
+
+Reanudación: tras escribir cada bloque se guarda un checkpoint JSON con la
+posición, la versión del modelo y lo escrito hasta entonces. Al relanzar el
+mismo comando, se continúa desde el último bloque completo (en NDJSON, el
+fichero se recorta a lo que cubría el checkpoint). Si el modelo ha cambiado,
+hay que empezar de cero con --restart.
+
+La API ofrece lo mismo en streaming con GET /recommendations/export (main.py):
+tras cada bloque envía una línea {"checkpoint": {...}} con la posición desde
+la que reanudar.
+
+Uso:
+    python recommendation_export.py --output exports/recommendations.ndjson
+    python recommendation_export.py --format csv --output exports/recommendations/
+    python recommendation_export.py --output exports/recommendations.ndjson --restart
+"""
+
+import csv
+import glob
+import io
+import json
+import os
+import time
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from model_registry import _atomic_write, _write_json_atomic
+
+DEFAULT_N = 50
+DEFAULT_CHUNK_SIZE = 512
+FORMATS = ("ndjson", "csv")
+CSV_COLUMNS = ("user_id", "rank", "movie_id", "predicted_rating", "title")
+
+
+def ndjson_lines(records: List[Dict]) -> bytes:
+    """Registros de un bloque como NDJSON (una línea por usuario)"""
+    return "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records).encode("utf-8")
+
+
+def checkpoint_record(model_version: str, offset: int, cursor: Optional[str]) -> Dict:
+    """Línea de control del streaming: posición desde la que reanudar"""
+    return {"checkpoint": {"model_version": model_version, "offset": offset, "cursor": cursor}}
+
+
+def iter_chunks(
+    recommender,
+    session_factory: Callable,
+    n: int = DEFAULT_N,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    offset: int = 0,
+    cursor: Optional[str] = None
+) -> Iterator[Tuple[List[Dict], int, Optional[str]]]:
+    """
+    Bloques (registros, offset, cursor) desde la posición dada hasta el final.
+    Cada bloque abre y cierra su propia sesión de BD.
+    """
+    while True:
+        db = session_factory()
+        try:
+            records, offset, cursor = recommender.export_recommendations_chunk(db, offset, cursor, n, chunk_size)
+        finally:
+            db.close()
+        if not records:
+            return
+        yield records, offset, cursor
+
+
+class ExportCheckpoint:
+    """Posición y progreso de una exportación, guardados de forma atómica tras cada bloque"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self) -> Optional[Dict]:
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def save(self, state: Dict):
+        state["updated_at"] = datetime.now().isoformat()
+        _write_json_atomic(self.path, state)
+
+
+class NdjsonSink:
+    """Un único fichero NDJSON; se reanuda recortándolo a los bytes del checkpoint"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.checkpoint_path = f"{path}.checkpoint.json"
+        self._file = None
+
+    def open(self, state: Dict):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, "ab")
+        # Lo escrito después del último checkpoint es un bloque incompleto
+        self._file.truncate(state.get("bytes", 0))
+        self._file.seek(state.get("bytes", 0))
+
+    def write(self, records: List[Dict], state: Dict):
+        self._file.write(ndjson_lines(records))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        state["bytes"] = self._file.tell()
+
+    def reset(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class CsvShardSink:
+    """Un fragmento CSV por bloque (escrito de forma atómica) en un directorio"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.checkpoint_path = os.path.join(directory, "_checkpoint.json")
+
+    def open(self, state: Dict):
+        os.makedirs(self.directory, exist_ok=True)
+
+    def write(self, records: List[Dict], state: Dict):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(CSV_COLUMNS)
+        for record in records:
+            for rec in record.get("recommendations", []):
+                writer.writerow([record["user_id"], rec["rank"], rec["movie_id"], rec["predicted_rating"], rec["title"]])
+        shard = state.get("shards", 0)
+        path = os.path.join(self.directory, f"part-{shard:06d}.csv")
+        _atomic_write(path, lambda f: f.write(buffer.getvalue()), mode="w", encoding="utf-8")
+        state["shards"] = shard + 1
+
+    def reset(self):
+        for path in glob.glob(os.path.join(self.directory, "part-*.csv")):
+            os.remove(path)
+
+    def close(self):
+        pass
+
+
+def run_export(
+    recommender,
+    session_factory: Callable,
+    output: str,
+    fmt: str = "ndjson",
+    n: int = DEFAULT_N,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    restart: bool = False,
+    max_chunks: int = None
+) -> Dict:
+    """
+    Exporta (o reanuda) las recomendaciones de todos los usuarios
+
+    Args:
+        recommender: MovieRecommenderDB cargado
+        session_factory: Crea sesiones de BD (p. ej. database.SessionLocal)
+        output: Fichero NDJSON o directorio de fragmentos CSV
+        fmt: 'ndjson' o 'csv'
+        n: Recomendaciones por usuario
+        chunk_size: Usuarios por bloque
+        restart: Descartar el checkpoint y lo ya exportado
+        max_chunks: Parar tras este número de bloques (la exportación queda a medias)
+
+    Returns:
+        Estado final del checkpoint
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Formato desconocido: {fmt}. Disponibles: {', '.join(FORMATS)}")
+    sink = NdjsonSink(output) if fmt == "ndjson" else CsvShardSink(output)
+    checkpoint = ExportCheckpoint(sink.checkpoint_path)
+
+    state = None if restart else checkpoint.load()
+    if state is None:
+        sink.reset()
+        state = {
+            "model_version": recommender.model_version, "format": fmt, "n": n,
+            "offset": 0, "cursor": None, "users": 0, "errors": 0, "done": False,
+            "started_at": datetime.now().isoformat()
+        }
+    elif (state["model_version"], state["format"], state["n"]) != (recommender.model_version, fmt, n):
+        raise ValueError(
+            f"El checkpoint {checkpoint.path} es de otra exportación (modelo {state['model_version']}, "
+            f"formato {state['format']}, n={state['n']}); usa --restart para empezar de cero"
+        )
+    elif state["done"]:
+        print(f"ℹ️ La exportación ya estaba completa: {state['users']} usuarios en {output}")
+        return state
+    else:
+        print(f"ℹ️ Reanudando desde el usuario {state['offset']} ({state['users']} ya exportados)")
+
+    start = last_report = time.perf_counter()
+    exported = 0
+    sink.open(state)
+    try:
+        chunks = iter_chunks(recommender, session_factory, n, chunk_size, state["offset"], state["cursor"])
+        for index, (records, offset, cursor) in enumerate(chunks):
+            sink.write(records, state)
+            errors = sum(1 for record in records if "error" in record)
+            state.update(offset=offset, cursor=cursor, users=state["users"] + len(records),
+                         errors=state["errors"] + errors)
+            checkpoint.save(state)
+            exported += len(records)
+            now = time.perf_counter()
+            if now - last_report >= 5:
+                print(f"  • {state['users']} usuarios ({exported / (now - start):.0f} usuarios/s)")
+                last_report = now
+            if max_chunks is not None and index + 1 >= max_chunks:
+                return state
+        state["done"] = True
+        checkpoint.save(state)
+    finally:
+        sink.close()
+
+    print(f"✓ {state['users']} usuarios exportados en {output} "
+          f"({exported} en esta ejecución, {time.perf_counter() - start:.1f}s)")
+    if state["errors"]:
+        print(f"⚠️ {state['errors']} usuarios con error")
+    return state
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Exporta las recomendaciones de todos los usuarios')
+    parser.add_argument('--output', required=True, help='Fichero .ndjson o directorio de fragmentos CSV')
+    parser.add_argument('--format', choices=FORMATS, default='ndjson', help='Formato de salida')
+    parser.add_argument('--n', type=int, default=DEFAULT_N, help='Recomendaciones por usuario')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Usuarios por bloque')
+    parser.add_argument('--model', default='models/svd_model_1m.pkl', help='Ruta del modelo')
+    parser.add_argument('--movies', default=None, help='Fichero de películas (títulos)')
+    parser.add_argument('--restart', action='store_true', help='Ignorar el checkpoint y empezar de cero')
+    parser.add_argument('--max-chunks', type=int, default=None, help='Parar tras N bloques (pruebas)')
+    args = parser.parse_args()
+
+    from database import SessionLocal
+    from model_inference_with_db import MovieRecommenderDB
+
+    print("=" * 70)
+    print("EXPORTACIÓN DE RECOMENDACIONES")
+    print("=" * 70)
+    recommender = MovieRecommenderDB(args.model, movies_path=args.movies)
+    try:
+        run_export(recommender, SessionLocal, args.output, args.format, args.n, args.chunk_size,
+                   restart=args.restart, max_chunks=args.max_chunks)
+    except ValueError as e:
+        print(f"✗ {e}")
+        raise SystemExit(1)
@@ -0,0 +1,109 @@
+"""
+Micro-batching de Peticiones Concurrentes
+Sistema de Recomendación de Películas - Grupo 8
+
+En hora punta llegan muchas llamadas casi simultáneas a /predict y
+/recommendations/from-db, y cada una hace su propio producto vector-matriz.
+RequestCoalescer las agrupa en el event loop:
+- Espera como mucho MICROBATCH_WINDOW_MS milisegundos desde la primera
+  petición del lote, o hasta reunir MICROBATCH_MAX_SIZE peticiones.
+- Ejecuta el lote con una sola llamada (un único producto de matrices, como
+  una sola tarea del ejecutor de inferencia).
+- Devuelve a cada petición su propio resultado o su propia excepción.
+
+Con la ventana a 0 (por defecto) el micro-batching está desactivado y los
+handlers llaman al recomendador directamente.
+
+Métricas: microbatch_size (peticiones por lote) y microbatch_wait_seconds
+(latencia que añade la espera de la ventana), por operación.
+"""
+
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+from metrics import BATCH_SIZE, BATCH_WAIT
+
+
+class RequestCoalescer:
+    """Agrupa las peticiones concurrentes de una operación y las ejecuta por lotes"""
+
+    def __init__(
+        self,
+        operation: str,
+        run_batch: Callable[[List[Any]], Awaitable[List[Any]]],
+        window_ms: float = 0.0,
+        max_size: int = 32
+    ):
+        """
+        Args:
+            operation: Nombre de la operación (etiqueta de las métricas)
+            run_batch: Corrutina que recibe la lista de peticiones y devuelve un
+                resultado por petición (o la excepción de esa petición)
+            window_ms: Milisegundos máximos de espera para formar un lote (0 = desactivado)
+            max_size: Peticiones máximas por lote
+        """
+        self.operation = operation
+        self.run_batch = run_batch
+        self.window = max(0.0, window_ms) / 1000
+        self.max_size = max(1, max_size)
+        self._pending: List[Tuple[Any, asyncio.Future, float]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    @classmethod
+    def from_env(cls, operation: str, run_batch: Callable[[List[Any]], Awaitable[List[Any]]]) -> "RequestCoalescer":
+        """MICROBATCH_WINDOW_MS y MICROBATCH_MAX_SIZE"""
+        return cls(
+            operation, run_batch,
+            window_ms=float(os.getenv("MICROBATCH_WINDOW_MS", "0")),
+            max_size=int(os.getenv("MICROBATCH_MAX_SIZE", "32"))
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    async def submit(self, item: Any) -> Any:
+        """Añade una petición al lote en curso y espera su resultado"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future, time.perf_counter()))
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            # La tarea hereda el contexto de quien cierra el lote: los spans del
+            # lote quedan en la traza de esa petición
+            asyncio.get_running_loop().create_task(self._run(batch))
+
+    async def _run(self, batch: List[Tuple[Any, asyncio.Future, float]]):
+        now = time.perf_counter()
+        BATCH_SIZE.observe(len(batch), self.operation)
+        for _, _, queued in batch:
+            BATCH_WAIT.observe(now - queued, self.operation)
+
+        try:
+            results = await self.run_batch([item for item, _, _ in batch])
+        except Exception as e:
+            # Fallo del lote entero (p. ej. 503 del ejecutor): lo reciben todas las peticiones
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future, _), result in zip(batch, results):
+            if future.done():
+                continue  # el cliente se fue mientras se ejecutaba el lote
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
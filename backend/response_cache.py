@@ -0,0 +1,91 @@
+"""
+Caché HTTP de Respuestas por Versión del Modelo
+Sistema de Recomendación de Películas - Grupo 8
+
+/movies/popular y /similar-movies (sin user_id) solo dependen del modelo
+cargado y de sus parámetros. El frontend las pide en cada vista y el servidor
+las recalculaba cada vez. ResponseCache guarda el JSON ya serializado de cada
+respuesta (LRU, RESPONSE_CACHE_SIZE entradas) con la clave
+(versión del modelo, endpoint, parámetros).
+
+Cabeceras HTTP (solo en las variantes GET; los POST usan la caché del
+servidor y responden siempre 200):
+- ETag: hash de la misma clave. Es determinista, así que todos los workers
+  dan el mismo ETag a la misma respuesta, y con If-None-Match se puede
+  contestar 304 sin calcular nada aunque la entrada ya no esté en la caché.
+- Cache-Control: public, max-age=RESPONSE_CACHE_MAX_AGE. Pasado ese tiempo,
+  el navegador revalida con If-None-Match.
+
+Al recargar el modelo, main.py vacía la caché. Las claves nuevas llevan la
+nueva versión, así que tampoco se serviría nada del modelo anterior.
+"""
+
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from metrics import record_cache
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Si la cabecera If-None-Match incluye el ETag (comparación débil, admite *)"""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or any(
+        (tag[2:] if tag.startswith("W/") else tag) == etag for tag in candidates
+    )
+
+
+class ResponseCache:
+    """Cuerpos JSON serializados por (versión del modelo, endpoint, parámetros), con ETag"""
+
+    def __init__(self, max_entries: int = 1024, max_age: int = 60):
+        """
+        Args:
+            max_entries: Entradas máximas (se descartan las menos usadas; 0 = sin caché en servidor)
+            max_age: Segundos de Cache-Control (0 = el cliente revalida siempre)
+        """
+        self.max_entries = max(0, max_entries)
+        self.max_age = max(0, max_age)
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+
+    @classmethod
+    def from_env(cls) -> "ResponseCache":
+        """RESPONSE_CACHE_SIZE y RESPONSE_CACHE_MAX_AGE"""
+        return cls(
+            max_entries=int(os.getenv("RESPONSE_CACHE_SIZE", "1024")),
+            max_age=int(os.getenv("RESPONSE_CACHE_MAX_AGE", "60"))
+        )
+
+    @staticmethod
+    def key(model_version: str, endpoint: str, params: Dict) -> Tuple[str, str]:
+        """Clave de la caché y ETag (entre comillas, como va en la cabecera)"""
+        key = f"{model_version}|{endpoint}|{json.dumps(params, sort_keys=True)}"
+        return key, '"' + hashlib.sha1(key.encode("utf-8")).hexdigest()[:32] + '"'
+
+    def headers(self, etag: str) -> Dict[str, str]:
+        return {"ETag": etag, "Cache-Control": f"public, max-age={self.max_age}"}
+
+    def get(self, endpoint: str, key: str) -> Optional[bytes]:
+        body = self._entries.get(key)
+        record_cache(f"response_{endpoint}", body is not None)
+        if body is not None:
+            self._entries.move_to_end(key)
+        return body
+
+    def put(self, key: str, body: bytes):
+        if self.max_entries == 0:
+            return
+        self._entries[key] = body
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
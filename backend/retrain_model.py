@@ -7,19 +7,90 @@ Este script:
 2. Lee los ratings de la base de datos SQLite
 3. Combina ambos datasets
 4. Reentrena el modelo SVD
-5. Exporta el modelo actualizado
+5. Publica el modelo actualizado en el registro de versiones (models/registry)
 """
 
-import pickle
 import time
 import os
+import multiprocessing as mp
 from datetime import datetime
 from surprise import SVD, Dataset, Reader
 from surprise.model_selection import train_test_split
-from surprise import accuracy
 import pandas as pd
 
-from database import SessionLocal, Rating, RatingCRUD
+from database import SessionLocal, Rating, RatingCRUD, RetrainSignalCRUD
+from evaluation import evaluate_ranking, evaluate_ratings, format_ranking, format_segments
+from item_neighbors import DEFAULT_K, NEIGHBORS_FILE, neighbor_arrays
+from model_registry import ModelRegistry, load_model_data
+from training_report import RUN_REPORT_NAME, TrainingRunReport, capture_epoch_timings, timed_stage
+
+
+def _fit_and_evaluate(model, trainset, testset) -> dict:
+    """Ajusta el modelo de evaluación con el train y calcula RMSE/MAE con el test"""
+    start = time.perf_counter()
+    model.fit(trainset)
+    fit_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    result = evaluate_ratings(model, trainset, testset)
+    return {
+        'rmse': result['rmse'],
+        'mae': result['mae'],
+        'segments': result['segments'],
+        'ranking': evaluate_ranking(model, trainset, testset),
+        'train_rows': trainset.n_ratings,
+        'test_rows': len(testset),
+        'fit_seconds': round(fit_seconds, 4),
+        'test_seconds': round(time.perf_counter() - start, 4)
+    }
+
+
+def _evaluation_child(conn, model, trainset, testset):
+    """Punto de entrada del proceso hijo: devuelve las métricas por el pipe"""
+    try:
+        conn.send(('ok', _fit_and_evaluate(model, trainset, testset)))
+    except BaseException as e:
+        conn.send(('error', f"{type(e).__name__}: {e}"))
+    finally:
+        conn.close()
+
+
+class EvaluationProcess:
+    """
+    Ejecuta _fit_and_evaluate en un proceso hijo y solo devuelve las métricas.
+    El hijo se crea con forkserver (o spawn donde no existe), nunca con fork:
+    el reentrenamiento también se lanza desde /admin/retrain, y hacer fork de
+    la API (con hilos, pool de conexiones y event loop) puede dejar locks
+    tomados en el hijo. El trainset se serializa una vez al arrancarlo.
+    """
+
+    def __init__(self, model, trainset, testset):
+        self._args = (model, trainset, testset)
+        self._process = None
+        self._conn = None
+        self.start_method = 'forkserver' if 'forkserver' in mp.get_all_start_methods() else 'spawn'
+
+    def start(self):
+        ctx = mp.get_context(self.start_method)
+        self._conn, child_conn = ctx.Pipe(duplex=False)
+        self._process = ctx.Process(target=_evaluation_child, args=(child_conn, *self._args), daemon=True)
+        self._process.start()
+        child_conn.close()
+        return self
+
+    def result(self) -> dict:
+        """Espera al proceso hijo y devuelve sus métricas"""
+        if self._process is None:
+            return {**_fit_and_evaluate(*self._args), 'parallel': False}
+        try:
+            status, payload = self._conn.recv()
+        except EOFError:
+            status, payload = 'error', f"el proceso terminó sin resultado (exit code {self._process.exitcode})"
+        finally:
+            self._conn.close()
+            self._process.join()
+        if status != 'ok':
+            raise RuntimeError(f"Falló el ajuste de evaluación: {payload}")
+        return {**payload, 'parallel': True}
 
 
 class ModelRetrainer:
@@ -29,15 +100,31 @@ class ModelRetrainer:
         self.trainset = None
         self.testset = None
         self.original_data = None
-        
-    def load_original_movielens_data(self):
-        """Carga el dataset MovieLens 1M original"""
+        self.db_watermark = {}
+        self.signals_snapshot = None
+        self.model_version = None
+        self.metrics = None
+        self.params = {}
+        self.report = TrainingRunReport('retrain')
+        self._evaluation = None
+        
+    @timed_stage('load_original_movielens_data', rows=lambda self, data: len(data.raw_ratings))
+    def load_original_movielens_data(self, corpus_path=None):
+        """
+        Carga el dataset MovieLens 1M original, o un corpus columnar generado
+        con generate_synthetic_data.py si se indica corpus_path
+        """
         print("="*70)
-        print("PASO 1: Cargando dataset MovieLens 1M original")
+        print("PASO 1: Cargando dataset MovieLens 1M original" if corpus_path is None
+              else f"PASO 1: Cargando corpus {corpus_path}")
         print("="*70)
         
-        # Cargar desde Surprise
-        data = Dataset.load_builtin('ml-1m')
+        if corpus_path is not None:
+            from generate_synthetic_data import corpus_dataset
+            data = corpus_dataset(corpus_path)
+        else:
+            # Cargar desde Surprise
+            data = Dataset.load_builtin('ml-1m')
         self.original_data = data
         
         # Obtener estadísticas
@@ -46,6 +133,7 @@ class ModelRetrainer:
         
         return data
     
+    @timed_stage('load_database_ratings', rows=lambda self, ratings: len(ratings))
     def load_database_ratings(self):
         """Carga ratings de la base de datos SQLite"""
         print("\n" + "="*70)
@@ -54,6 +142,10 @@ class ModelRetrainer:
         
         db = SessionLocal()
         try:
+            # Contadores de eventos antes de leer: todo lo contado queda incluido
+            # (lo que llegue durante la lectura se vuelve a contar, nunca se pierde)
+            self.signals_snapshot = RetrainSignalCRUD.get_signals(db)
+            
             # Obtener todos los ratings
             db_ratings = RatingCRUD.get_all_ratings(db)
             
@@ -71,6 +163,13 @@ class ModelRetrainer:
             unique_users = len(set([r[0] for r in ratings_list]))
             unique_movies = len(set([r[1] for r in ratings_list]))
             
+            # Marca de agua: hasta qué rating de la BD incluye este entrenamiento
+            self.db_watermark = {
+                'db_ratings_count': len(db_ratings),
+                'db_max_rating_id': max(r.id for r in db_ratings),
+                'db_max_timestamp': max(r.timestamp for r in db_ratings).isoformat()
+            }
+            
             print(f"✓ Ratings de BD cargados: {len(ratings_list)}")
             print(f"  • Usuarios únicos: {unique_users}")
             print(f"  • Películas únicas: {unique_movies}")
@@ -80,6 +179,23 @@ class ModelRetrainer:
         finally:
             db.close()
     
+    def consume_retrain_signals(self):
+        """
+        Descuenta de retrain_signals los eventos incluidos en este entrenamiento,
+        sea cual sea el origen (CLI, /admin/retrain, cron o el modo event)
+        """
+        if not self.signals_snapshot or not self.signals_snapshot["new_ratings"]:
+            return
+        db = SessionLocal()
+        try:
+            RetrainSignalCRUD.consume(db, self.signals_snapshot)
+            print(f"✓ Contadores de reentrenamiento descontados ({self.signals_snapshot['new_ratings']} ratings)")
+        except Exception as e:
+            print(f"⚠️ No se pudieron descontar los contadores de reentrenamiento: {e}")
+        finally:
+            db.close()
+    
+    @timed_stage('combine_datasets', rows=lambda self, data: len(data.raw_ratings))
     def combine_datasets(self, original_data, db_ratings):
         """Combina el dataset original con los ratings de la BD"""
         print("\n" + "="*70)
@@ -109,74 +225,154 @@ class ModelRetrainer:
         
         return combined_data
     
-    def train_model(self, data, n_factors=100, n_epochs=20, lr_all=0.005, reg_all=0.02):
-        """Entrena el modelo SVD con el dataset combinado"""
+    def _build_model(self, n_factors, n_epochs, lr_all, reg_all, verbose=True):
+        """Crea un SVD con los parámetros del entrenamiento"""
+        return SVD(
+            n_factors=n_factors,
+            n_epochs=n_epochs,
+            lr_all=lr_all,
+            reg_all=reg_all,
+            random_state=42,
+            verbose=verbose
+        )
+    
+    def train_model(
+        self,
+        data,
+        n_factors=100,
+        n_epochs=20,
+        lr_all=0.005,
+        reg_all=0.02,
+        full_fit=True,
+        epoch_timings=False
+    ):
+        """
+        Entrena el modelo SVD con el dataset combinado
+
+        Con full_fit=True el modelo de producción se ajusta con el 100% de los
+        ratings, mientras un proceso hijo ajusta en paralelo un modelo sobre el
+        80% y lo evalúa con el 20% restante; esas métricas se adjuntan al modelo
+        completo. Con full_fit=False se exporta el propio modelo del 80%.
+
+        Con epoch_timings=True se mide cada época del SVD de Surprise leyendo su
+        salida por stdout (capture_epoch_timings). Solo desde la línea de
+        comandos: dentro de la API sustituiría sys.stdout de todo el proceso.
+        """
         print("\n" + "="*70)
         print("PASO 4: Entrenando modelo SVD")
         print("="*70)
         
         print(f"Parámetros: n_factors={n_factors}, n_epochs={n_epochs}, "
               f"lr_all={lr_all}, reg_all={reg_all}")
+        self.params = {
+            'n_factors': n_factors,
+            'n_epochs': n_epochs,
+            'lr_all': lr_all,
+            'reg_all': reg_all,
+            'full_fit': full_fit
+        }
+        model_args = (n_factors, n_epochs, lr_all, reg_all)
         
         # Inicializar modelo SVD
-        self.model = SVD(
-            n_factors=n_factors,
-            n_epochs=n_epochs,
-            lr_all=lr_all,
-            reg_all=reg_all,
-            random_state=42,
-            verbose=True
-        )
+        self.model = self._build_model(*model_args)
         
         # Dividir en train y test
         print("\nDividiendo dataset en train (80%) y test (20%)...")
-        self.trainset, self.testset = train_test_split(data, test_size=0.2, random_state=42)
+        with self.report.stage('train_test_split') as stage:
+            self.trainset, self.testset = train_test_split(data, test_size=0.2, random_state=42)
+            stage['rows'] = self.trainset.n_ratings
+        
+        if full_fit:
+            with self.report.stage('build_full_trainset') as stage:
+                full_trainset = data.build_full_trainset()
+                stage['rows'] = full_trainset.n_ratings
+            
+            # El ajuste de evaluación (80/20) corre en otro proceso mientras
+            # este proceso entrena el modelo de producción con todos los datos
+            eval_model = self._build_model(*model_args, verbose=False)
+            self._evaluation = EvaluationProcess(eval_model, self.trainset, self.testset).start()
+            print(f"Evaluación 80/20 en paralelo ({self._evaluation.start_method}); "
+                  f"modelo de producción con el 100% de los ratings")
+            self.trainset = full_trainset
         
         # Entrenar
         print("\nIniciando entrenamiento...")
         start_time = time.time()
         
-        self.model.fit(self.trainset)
+        if epoch_timings:
+            with self.report.stage('fit') as stage, capture_epoch_timings(self.report.epochs):
+                self.model.fit(self.trainset)
+                stage['rows'] = self.trainset.n_ratings
+        else:
+            with self.report.stage('fit') as stage:
+                self.model.fit(self.trainset)
+                stage['rows'] = self.trainset.n_ratings
         
         training_time = time.time() - start_time
         print(f"\n✓ Modelo entrenado en {training_time:.2f} segundos")
         
         return training_time
     
+    @timed_stage('evaluate_model', rows=lambda self, metrics: len(self.testset))
     def evaluate_model(self):
-        """Evalúa el modelo en el conjunto de test"""
+        """
+        Evalúa el modelo en el conjunto de test. Con el ajuste completo, recoge
+        las métricas del modelo de evaluación entrenado en el proceso hijo.
+        """
         print("\n" + "="*70)
         print("PASO 5: Evaluando modelo")
         print("="*70)
         
-        predictions = self.model.test(self.testset)
-        
-        rmse = accuracy.rmse(predictions, verbose=False)
-        mae = accuracy.mae(predictions, verbose=False)
-        
-        print(f"\nMétricas de evaluación:")
-        print(f"  RMSE: {rmse:.5f}")
-        print(f"  MAE:  {mae:.5f}")
-        
-        return {'rmse': rmse, 'mae': mae}
+        if self._evaluation is not None:
+            result = self._evaluation.result()
+            self._evaluation = None
+            self.report.extra['evaluation_fit'] = {
+                'parallel': result['parallel'],
+                'train_rows': result['train_rows'],
+                'test_rows': result['test_rows'],
+                'fit_seconds': result['fit_seconds'],
+                'test_seconds': result['test_seconds']
+            }
+            print(f"Modelo de evaluación (80%) ajustado en {result['fit_seconds']:.2f}s "
+                  f"({'en paralelo' if result['parallel'] else 'secuencial'})")
+        else:
+            result = evaluate_ratings(self.model, self.trainset, self.testset)
+            result['ranking'] = evaluate_ranking(self.model, self.trainset, self.testset)
+        
+        print(f"\nMétricas de evaluación (20% reservado):")
+        print(f"  RMSE: {result['rmse']:.5f}")
+        print(f"  MAE:  {result['mae']:.5f}")
+        for line in format_segments(result):
+            print(line)
+        for line in format_ranking(result['ranking']):
+            print(line)
+        
+        self.metrics = {
+            'rmse': result['rmse'],
+            'mae': result['mae'],
+            'segments': result['segments'],
+            'ranking': result['ranking']
+        }
+        return self.metrics
     
-    def export_model(self, filepath='models/svd_model_1m.pkl', backup_original=True):
-        """Exporta el modelo reentrenado"""
+    @timed_stage('export_model')
+    def export_model(self, filepath='models/svd_model_1m.pkl', backup_original=True, max_versions=5,
+                     neighbors_k=DEFAULT_K):
+        """
+        Publica el modelo reentrenado como nueva versión del registro.
+        Las versiones anteriores se conservan comprimidas hasta max_versions;
+        con backup_original=False solo se conserva la nueva versión.
+        La versión incluye la tabla de los neighbors_k vecinos de cada
+        película (0 = sin tabla).
+        """
         print("\n" + "="*70)
         print("PASO 6: Exportando modelo")
         print("="*70)
         
-        # Crear backup del modelo original
-        if backup_original and os.path.exists(filepath):
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            backup_path = filepath.replace('.pkl', f'_backup_{timestamp}.pkl')
-            
-            import shutil
-            shutil.copy2(filepath, backup_path)
-            print(f"✓ Backup creado: {backup_path}")
-        
-        # Exportar nuevo modelo
-        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        registry = ModelRegistry.for_model_path(
+            filepath,
+            max_versions=max_versions if backup_original else 1
+        )
         
         model_data = {
             'model': self.model,
@@ -188,23 +384,50 @@ class ModelRetrainer:
             'version': '2.0'
         }
         
-        with open(filepath, 'wb') as f:
-            pickle.dump(model_data, f)
-        
-        file_size = os.path.getsize(filepath) / (1024 * 1024)
-        print(f"✓ Modelo exportado: {filepath} ({file_size:.2f} MB)")
+        arrays = {NEIGHBORS_FILE: neighbor_arrays(self.model, neighbors_k)} if neighbors_k > 0 else None
+        version = registry.publish(model_data, {
+            'n_ratings': self.trainset.n_ratings,
+            'metrics': self.metrics,
+            'params': self.params,
+            'data_watermark': self.db_watermark,
+            'neighbors_k': neighbors_k
+        }, arrays=arrays)
+        manifest = registry.get_manifest(version)
+        self.model_version = version
+        
+        file_size = manifest['artifact']['size_bytes'] / (1024 * 1024)
+        print(f"✓ Modelo publicado: versión {version} ({file_size:.2f} MB)")
+        print(f"  • Registro: {registry.root}")
+        print(f"  • Versiones conservadas: {len(registry.list_versions())}")
         print(f"  • Usuarios: {model_data['n_users']}")
         print(f"  • Películas: {model_data['n_items']}")
         print(f"  • Rating promedio: {model_data['global_mean']:.3f}")
         
         return True
+    
+    def save_run_report(self) -> dict:
+        """Guarda el informe de la ejecución junto a la versión publicada"""
+        self.report.extra.update({
+            'model_version': self.model_version,
+            'params': self.params,
+            'metrics': self.metrics
+        })
+        report = self.report.to_dict()
+        if self.model_version:
+            registry = ModelRegistry.for_model_path(self.original_model_path)
+            registry.attach_json(self.model_version, RUN_REPORT_NAME, report)
+        return report
 
 
 def retrain_model(
     model_path='models/svd_model_1m.pkl',
     n_factors=100,
     n_epochs=20,
-    backup=True
+    backup=True,
+    full_fit=True,
+    corpus_path=None,
+    neighbors_k=DEFAULT_K,
+    epoch_timings=False
 ):
     """
     Función principal para reentrenar el modelo
@@ -214,6 +437,12 @@ def retrain_model(
         n_factors: Número de factores latentes
         n_epochs: Épocas de entrenamiento
         backup: Crear backup del modelo anterior
+        full_fit: Exportar un modelo ajustado con el 100% de los ratings
+            (la evaluación 80/20 se hace en paralelo en otro proceso)
+        corpus_path: Corpus columnar a usar en lugar de MovieLens 1M
+            (ver generate_synthetic_data.py)
+        neighbors_k: Vecinos por película de la tabla precalculada (0 = sin tabla)
+        epoch_timings: Medir cada época leyendo stdout (solo línea de comandos)
     
     Returns:
         dict con métricas del reentrenamiento
@@ -229,7 +458,7 @@ def retrain_model(
     
     try:
         # 1. Cargar dataset original
-        original_data = retrainer.load_original_movielens_data()
+        original_data = retrainer.load_original_movielens_data(corpus_path)
         
         # 2. Cargar ratings de BD
         db_ratings = retrainer.load_database_ratings()
@@ -241,14 +470,19 @@ def retrain_model(
         training_time = retrainer.train_model(
             combined_data,
             n_factors=n_factors,
-            n_epochs=n_epochs
+            n_epochs=n_epochs,
+            full_fit=full_fit,
+            epoch_timings=epoch_timings
         )
         
         # 5. Evaluar
         metrics = retrainer.evaluate_model()
         
         # 6. Exportar
-        success = retrainer.export_model(model_path, backup_original=backup)
+        success = retrainer.export_model(model_path, backup_original=backup, neighbors_k=neighbors_k)
+        if success:
+            retrainer.consume_retrain_signals()
+        run_report = retrainer.save_run_report()
         
         # Resumen
         print("\n" + "="*70)
@@ -260,6 +494,9 @@ def retrain_model(
         print(f"Ratings de BD añadidos: {len(db_ratings)}")
         print(f"Modelo exportado: {'✓ Sí' if success else '✗ No'}")
         print(f"Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        print("-"*70)
+        for line in retrainer.report.format_lines():
+            print(line)
         print("="*70)
         
         return {
@@ -267,6 +504,8 @@ def retrain_model(
             'training_time': training_time,
             'metrics': metrics,
             'db_ratings_count': len(db_ratings),
+            'model_version': retrainer.model_version,
+            'run_report': run_report,
             'timestamp': datetime.now().isoformat()
         }
     
@@ -292,34 +531,40 @@ def check_retrain_needed(min_new_ratings=5):
     """
     db = SessionLocal()
     try:
-        total_ratings = db.query(Rating).count()
-        
-        # Leer timestamp del último reentrenamiento
+        # Leer la marca de agua del último reentrenamiento desde el manifiesto
         model_path = 'models/svd_model_1m.pkl'
-        if os.path.exists(model_path):
-            with open(model_path, 'rb') as f:
-                model_data = pickle.load(f)
-                last_retrain = model_data.get('retrained_at', None)
-                
-                if last_retrain:
-                    print(f"Último reentrenamiento: {last_retrain}")
-                    
-                    # Contar ratings desde el último reentrenamiento
-                    last_retrain_dt = datetime.fromisoformat(last_retrain)
-                    new_ratings = db.query(Rating).filter(
-                        Rating.timestamp > last_retrain_dt
-                    ).count()
-                    
-                    print(f"Ratings nuevos desde entonces: {new_ratings}")
-                    
-                    if new_ratings >= min_new_ratings:
-                        print(f"✓ Se necesita reentrenamiento ({new_ratings} >= {min_new_ratings})")
-                        return True
-                    else:
-                        print(f"✗ No se necesita reentrenamiento aún ({new_ratings} < {min_new_ratings})")
-                        return False
+        manifest = ModelRegistry.for_model_path(model_path).get_manifest()
+        if manifest is not None:
+            last_retrain = manifest.get('created_at')
+            # La marca de agua usa el mismo reloj que la BD (UTC); si el modelo
+            # no incluye ratings de la BD, todos los ratings cuentan como nuevos
+            since = (manifest.get('data_watermark') or {}).get('db_max_timestamp')
+        elif os.path.exists(model_path):
+            # Modelo antiguo sin registro: hay que leer el pickle
+            last_retrain = load_model_data(model_path).get('retrained_at', None)
+            since = last_retrain
+        else:
+            last_retrain, since = None, None
+        
+        if since:
+            print(f"Último reentrenamiento: {last_retrain}")
+            
+            # Contar ratings posteriores a los incluidos en el último entrenamiento
+            new_ratings = db.query(Rating).filter(
+                Rating.timestamp > datetime.fromisoformat(since)
+            ).count()
+            
+            print(f"Ratings nuevos desde entonces: {new_ratings}")
+            
+            if new_ratings >= min_new_ratings:
+                print(f"✓ Se necesita reentrenamiento ({new_ratings} >= {min_new_ratings})")
+                return True
+            else:
+                print(f"✗ No se necesita reentrenamiento aún ({new_ratings} < {min_new_ratings})")
+                return False
         
         # Si no hay info de reentrenamiento previo, verificar total
+        total_ratings = db.query(Rating).count()
         if total_ratings >= min_new_ratings:
             print(f"✓ Se recomienda reentrenamiento inicial ({total_ratings} ratings en BD)")
             return True
@@ -339,6 +584,12 @@ if __name__ == "__main__":
     parser.add_argument('--no-backup', action='store_true', help='No crear backup del modelo anterior')
     parser.add_argument('--check-only', action='store_true', help='Solo verificar si se necesita reentrenar')
     parser.add_argument('--min-ratings', type=int, default=100, help='Mínimo de ratings para reentrenar')
+    parser.add_argument('--no-full-fit', action='store_true',
+                        help='Exportar el modelo del 80%% en lugar del ajustado con todos los ratings')
+    parser.add_argument('--corpus', default=None,
+                        help='Corpus columnar (generate_synthetic_data.py) en lugar de MovieLens 1M')
+    parser.add_argument('--neighbors-k', type=int, default=DEFAULT_K,
+                        help='Vecinos por película de la tabla precalculada (0 = sin tabla)')
     
     args = parser.parse_args()
     
@@ -350,7 +601,11 @@ if __name__ == "__main__":
             result = retrain_model(
                 n_factors=args.factors,
                 n_epochs=args.epochs,
-                backup=not args.no_backup
+                backup=not args.no_backup,
+                full_fit=not args.no_full_fit,
+                corpus_path=args.corpus,
+                neighbors_k=args.neighbors_k,
+                epoch_timings=True
             )
             
             if result['success']:
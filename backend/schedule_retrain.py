@@ -8,14 +8,18 @@ Opciones de uso:
    0 2 * * 0 cd /path/to/backend && python schedule_retrain.py
    (Cada domingo a las 2 AM)
 3. Configurar con Task Scheduler (Windows)
+4. Modo por eventos: python schedule_retrain.py --mode event
+   (reentrena en cuanto los contadores publicados por la API superan los umbrales)
 """
 
+import math
 import schedule
 import time
 import logging
 from datetime import datetime
 from retrain_model import retrain_model, check_retrain_needed
-from database import SessionLocal, Rating
+from database import SessionLocal, Rating, RetrainSignalCRUD, create_database
+from model_registry import ModelRegistry
 
 # Configurar logging
 logging.basicConfig(
@@ -30,6 +34,104 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+class RetrainTriggerPolicy:
+    """
+    Política de disparo del reentrenamiento a partir de los contadores
+    publicados en la tabla retrain_signals
+    """
+    
+    def __init__(
+        self,
+        min_new_ratings=100,
+        min_new_users=20,
+        max_mean_drift=0.25,
+        max_std_drift=0.25,
+        min_drift_samples=50,
+        debounce_seconds=300,
+        max_delay_seconds=3600,
+        cooldown_seconds=3600
+    ):
+        """
+        Args:
+            min_new_ratings: Ratings nuevos que justifican reentrenar
+            min_new_users: Usuarios nuevos que justifican reentrenar
+            max_mean_drift: Desviación máxima (en estrellas) de la media de los ratings
+                            nuevos respecto a la media global del modelo
+            max_std_drift: Diferencia máxima (en estrellas) entre la desviación típica
+                           de los ratings nuevos y la de los datos del modelo
+            min_drift_samples: Ratings mínimos para evaluar la deriva
+            debounce_seconds: Segundos sin eventos antes de disparar (espera a que
+                              termine una ráfaga de ratings)
+            max_delay_seconds: Tiempo máximo que el debounce puede retrasar un disparo
+            cooldown_seconds: Tiempo mínimo entre dos reentrenamientos
+        """
+        self.min_new_ratings = min_new_ratings
+        self.min_new_users = min_new_users
+        self.max_mean_drift = max_mean_drift
+        self.max_std_drift = max_std_drift
+        self.min_drift_samples = min_drift_samples
+        self.debounce_seconds = debounce_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.cooldown_seconds = cooldown_seconds
+    
+    @staticmethod
+    def mean_drift(signals, baseline_mean):
+        """Diferencia entre la media de los ratings nuevos y la media del modelo"""
+        if signals["new_ratings"] <= 0 or baseline_mean is None:
+            return 0.0
+        return abs(signals["rating_sum"] / signals["new_ratings"] - baseline_mean)
+    
+    @staticmethod
+    def std_drift(signals, baseline_std):
+        """
+        Diferencia entre la desviación típica de los ratings nuevos (a partir de
+        rating_sum y rating_sq_sum) y la de los datos con los que se entrenó el
+        modelo. Detecta cambios de dispersión que no mueven la media.
+        """
+        n = signals["new_ratings"]
+        if n <= 0 or baseline_std is None:
+            return 0.0
+        mean = signals["rating_sum"] / n
+        variance = max(signals["rating_sq_sum"] / n - mean * mean, 0.0)
+        return abs(math.sqrt(variance) - baseline_std)
+    
+    def threshold_reason(self, signals, baseline_mean, baseline_std=None):
+        """Devuelve el motivo por el que merece la pena reentrenar (o None)"""
+        if signals["new_ratings"] >= self.min_new_ratings:
+            return f"{signals['new_ratings']} ratings nuevos >= {self.min_new_ratings}"
+        if signals["new_users"] >= self.min_new_users:
+            return f"{signals['new_users']} usuarios nuevos >= {self.min_new_users}"
+        if signals["new_ratings"] >= self.min_drift_samples:
+            drift = self.mean_drift(signals, baseline_mean)
+            if drift >= self.max_mean_drift:
+                return f"deriva de la media {drift:.3f} >= {self.max_mean_drift}"
+            drift = self.std_drift(signals, baseline_std)
+            if drift >= self.max_std_drift:
+                return f"deriva de la dispersión {drift:.3f} >= {self.max_std_drift}"
+        return None
+    
+    def evaluate(self, signals, baseline_mean, now, last_retrain_at, pending_since, baseline_std=None):
+        """
+        Decide si hay que reentrenar ahora
+        
+        Returns:
+            (decisión, motivo) donde decisión es 'retrain', 'wait' o 'idle'
+        """
+        reason = self.threshold_reason(signals, baseline_mean, baseline_std)
+        if reason is None:
+            return 'idle', None
+        
+        if last_retrain_at and (now - last_retrain_at).total_seconds() < self.cooldown_seconds:
+            return 'wait', f"{reason} (cooldown)"
+        
+        last_event_at = signals["last_event_at"]
+        quiet = last_event_at is None or (now - last_event_at).total_seconds() >= self.debounce_seconds
+        overdue = pending_since is not None and (now - pending_since).total_seconds() >= self.max_delay_seconds
+        if quiet or overdue:
+            return 'retrain', reason
+        return 'wait', f"{reason} (debounce)"
+
+
 class RetrainingScheduler:
     """Planificador de reentrenamiento automático"""
     
@@ -76,6 +178,7 @@ class RetrainingScheduler:
                     logger.info(f"   MAE: {result['metrics']['mae']:.5f}")
                     logger.info(f"   Tiempo: {result['training_time']:.2f}s")
                     logger.info(f"   Ratings añadidos: {result['db_ratings_count']}")
+                    self._log_run_report(result)
                     
                     # Opcional: Enviar notificación (email, Slack, etc.)
                     self._send_notification(result)
@@ -98,6 +201,93 @@ class RetrainingScheduler:
             import traceback
             logger.error(traceback.format_exc())
     
+    def run_event_driven(self, policy: RetrainTriggerPolicy, poll_seconds=5):
+        """
+        Reentrena en cuanto los contadores publicados por la escritura de ratings
+        cumplen la política. Cada sondeo es una lectura por clave primaria de la
+        tabla retrain_signals, sin COUNT sobre la tabla de ratings.
+        """
+        logger.info("Modo: Disparo por eventos (tabla retrain_signals)")
+        logger.info(
+            f"   Umbrales: {policy.min_new_ratings} ratings, {policy.min_new_users} usuarios, "
+            f"deriva {policy.max_mean_drift} (media) / {policy.max_std_drift} (dispersión) | debounce {policy.debounce_seconds}s, "
+            f"cooldown {policy.cooldown_seconds}s"
+        )
+        create_database()
+        registry = ModelRegistry.for_model_path('models/svd_model_1m.pkl')
+        pending_since = None
+        
+        logger.info("Scheduler iniciado. Presiona Ctrl+C para detener.")
+        try:
+            while True:
+                # UTC: mismo reloj que last_event_at en la BD
+                now = datetime.utcnow()
+                self.last_check = now
+                manifest = registry.get_manifest() or {}
+                
+                db = SessionLocal()
+                try:
+                    signals = RetrainSignalCRUD.get_signals(db)
+                finally:
+                    db.close()
+                
+                decision, reason = policy.evaluate(
+                    signals, manifest.get('global_mean'), now, self.last_retrain, pending_since,
+                    baseline_std=manifest.get('rating_std')
+                )
+                if decision == 'idle':
+                    pending_since = None
+                elif decision == 'wait':
+                    if pending_since is None:
+                        pending_since = now
+                        logger.info(f"⏳ Reentrenamiento pendiente: {reason}")
+                else:
+                    logger.info(f"✓ Disparo de reentrenamiento: {reason}")
+                    self._retrain_from_signals(signals)
+                    # También tras un fallo: el cooldown evita reintentos en bucle
+                    self.last_retrain = datetime.utcnow()
+                    pending_since = None
+                
+                time.sleep(poll_seconds)
+        except KeyboardInterrupt:
+            logger.info("\n⚠️ Scheduler detenido por usuario")
+    
+    def _retrain_from_signals(self, snapshot):
+        """Reentrena (retrain_model descuenta de los contadores los eventos incluidos)"""
+        result = retrain_model(
+            n_factors=self.n_factors,
+            n_epochs=self.n_epochs,
+            backup=True
+        )
+        
+        if not result['success']:
+            logger.error(f"❌ Error en reentrenamiento: {result.get('error')}")
+            return
+        
+        logger.info("✅ Reentrenamiento completado exitosamente")
+        logger.info(f"   RMSE: {result['metrics']['rmse']:.5f}")
+        logger.info(f"   MAE: {result['metrics']['mae']:.5f}")
+        logger.info(f"   Tiempo: {result['training_time']:.2f}s")
+        logger.info(f"   Ratings nuevos incluidos: {snapshot['new_ratings']}")
+        self._log_run_report(result)
+        self._send_notification(result)
+    
+    def _log_run_report(self, result):
+        """Vuelca en el log el desglose por etapas del reentrenamiento"""
+        report = result.get('run_report')
+        if not report:
+            return
+        logger.info(f"   Versión: {report.get('model_version')} | "
+                    f"Total: {report['total_wall_seconds']:.2f}s | Pico RSS: {report['peak_rss_mb']} MB")
+        for stage in report['stages']:
+            logger.info(
+                f"   • {stage['name']}: {stage['wall_seconds']:.2f}s pared, "
+                f"{stage['cpu_seconds']:.2f}s CPU, pico {stage['peak_rss_mb']} MB, filas {stage['rows']}"
+            )
+        if report['epochs']:
+            epoch_times = [e['seconds'] for e in report['epochs']]
+            logger.info(f"   • épocas: {len(epoch_times)} (media {sum(epoch_times) / len(epoch_times):.2f}s)")
+    
     def _send_notification(self, result):
         """Envía notificación sobre el reentrenamiento (placeholder)"""
         # Aquí puedes implementar:
@@ -207,7 +397,7 @@ def main():
     
     parser.add_argument(
         '--mode',
-        choices=['once', 'continuous', 'daily', 'weekly'],
+        choices=['once', 'continuous', 'daily', 'weekly', 'event'],
         default='once',
         help='Modo de ejecución'
     )
@@ -255,6 +445,55 @@ def main():
         help='Día de ejecución (modo weekly)'
     )
     
+    parser.add_argument(
+        '--min-new-users',
+        type=int,
+        default=20,
+        help='Usuarios nuevos que disparan el reentrenamiento (modo event)'
+    )
+    
+    parser.add_argument(
+        '--max-drift',
+        type=float,
+        default=0.25,
+        help='Deriva máxima de la media de ratings en estrellas (modo event)'
+    )
+    
+    parser.add_argument(
+        '--max-std-drift',
+        type=float,
+        default=0.25,
+        help='Deriva máxima de la desviación típica de los ratings en estrellas (modo event)'
+    )
+    
+    parser.add_argument(
+        '--debounce',
+        type=int,
+        default=300,
+        help='Segundos sin ratings nuevos antes de disparar (modo event)'
+    )
+    
+    parser.add_argument(
+        '--max-delay',
+        type=int,
+        default=3600,
+        help='Segundos máximos que el debounce puede retrasar un disparo (modo event)'
+    )
+    
+    parser.add_argument(
+        '--cooldown',
+        type=int,
+        default=3600,
+        help='Segundos mínimos entre reentrenamientos (modo event)'
+    )
+    
+    parser.add_argument(
+        '--poll',
+        type=int,
+        default=5,
+        help='Segundos entre lecturas de los contadores (modo event)'
+    )
+    
     args = parser.parse_args()
     
     # Crear scheduler
@@ -274,6 +513,17 @@ def main():
         scheduler.run_daily_at(args.time)
     elif args.mode == 'weekly':
         scheduler.run_weekly(args.day, args.time)
+    elif args.mode == 'event':
+        policy = RetrainTriggerPolicy(
+            min_new_ratings=args.min_ratings,
+            min_new_users=args.min_new_users,
+            max_mean_drift=args.max_drift,
+            max_std_drift=args.max_std_drift,
+            debounce_seconds=args.debounce,
+            max_delay_seconds=args.max_delay,
+            cooldown_seconds=args.cooldown
+        )
+        scheduler.run_event_driven(policy, poll_seconds=args.poll)
 
 
 if __name__ == "__main__":
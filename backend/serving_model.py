@@ -0,0 +1,392 @@
+"""
+Modelo de Servicio Compacto
+Sistema de Recomendación de Películas - Grupo 8
+
+Representación del SVD con solo lo que necesita la inferencia, en arrays
+tipados: factores y sesgos, mapas de ids (arrays ordenados en lugar de dicts),
+estadísticas por película (número de ratings y media), títulos y géneros
+(máscara de bits por película) alineados con los ids internos, y la tabla
+de vecinos precalculada (ver item_neighbors.py) si la versión la trae.
+El Trainset de Surprise (listas ur/ir y diccionarios de ids) se descarta
+tras construirlo, lo que reduce la memoria residente de cada worker de la
+API.
+
+save()/load() lo guardan como un directorio de .npy que varios procesos
+pueden mapear en memoria de solo lectura (ver shared_model_store.py): las
+páginas del modelo se comparten entre workers a través de la caché del SO.
+
+Las predicciones siguen las mismas reglas que SVD.estimate + predict de
+Surprise (usuario o película desconocidos, sesgos opcionales y recorte a la
+escala de ratings).
+"""
+
+import ctypes
+import gc
+import json
+import os
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+# Bits de la máscara de géneros por película (MovieLens usa 18 géneros)
+MAX_GENRES = 64
+NO_GENRE = "(no genres listed)"
+
+# Arrays que se guardan como <nombre>.npy en save()
+ARRAY_FIELDS = (
+    'users_raw', 'users_order', 'users_sorted', 'items_raw', 'items_order', 'items_sorted',
+    'pu', 'qi', 'bu', 'bi', 'item_count', 'item_mean', 'item_first_seen', 'item_norms',
+    'item_genres', 'titles'
+)
+# Solo se guardan si tienen contenido; las generaciones antiguas no los traen
+OPTIONAL_ARRAY_FIELDS = ('neighbor_ids', 'neighbor_scores')
+META_NAME = "serving.json"
+
+
+def trainset_arrays(trainset):
+    """Devuelve los ratings del trainset como arrays (usuarios, ítems, ratings) internos"""
+    n = trainset.n_ratings
+    users = np.empty(n, dtype=np.int32)
+    items = np.empty(n, dtype=np.int32)
+    ratings = np.empty(n, dtype=np.float64)
+    pos = 0
+    for u, user_ratings in trainset.ur.items():
+        k = len(user_ratings)
+        if k == 0:
+            continue
+        users[pos:pos + k] = u
+        items[pos:pos + k], ratings[pos:pos + k] = zip(*user_ratings)
+        pos += k
+    return users[:pos], items[:pos], ratings[:pos]
+
+
+class IdMap:
+    """Ids raw <-> internos con un array de ids y su versión ordenada (sin dicts)"""
+
+    def __init__(self, raw_ids: Iterable[str]):
+        self.raw = np.asarray(list(raw_ids), dtype=str)
+        self._order = np.argsort(self.raw, kind='stable').astype(np.int32)
+        self._sorted = self.raw[self._order]
+
+    @classmethod
+    def from_arrays(cls, raw: np.ndarray, order: np.ndarray, sorted_raw: np.ndarray) -> "IdMap":
+        """IdMap sobre arrays ya calculados (p. ej. mapeados desde disco)"""
+        id_map = cls.__new__(cls)
+        id_map.raw, id_map._order, id_map._sorted = raw, order, sorted_raw
+        return id_map
+
+    def __len__(self) -> int:
+        return len(self.raw)
+
+    def inner(self, raw_id) -> Optional[int]:
+        """Id interno de un id raw, o None si no existe"""
+        raw_id = str(raw_id)
+        pos = int(np.searchsorted(self._sorted, raw_id))
+        if pos < len(self._sorted) and self._sorted[pos] == raw_id:
+            return int(self._order[pos])
+        return None
+
+    def inner_many(self, raw_ids: Iterable) -> np.ndarray:
+        """Ids internos de varios ids raw; -1 para los que no existen"""
+        keys = np.asarray([str(r) for r in raw_ids], dtype=str)
+        if len(keys) == 0 or len(self._sorted) == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self._sorted, keys), len(self._sorted) - 1)
+        found = self._sorted[pos] == keys
+        return np.where(found, self._order[pos], -1).astype(np.int64)
+
+
+class ServingModel:
+    """Factores, sesgos, mapas de ids, estadísticas por película, títulos y géneros"""
+
+    def __init__(self, users: IdMap, items: IdMap, pu: np.ndarray, qi: np.ndarray, bu: np.ndarray,
+                 bi: np.ndarray, global_mean: float, biased: bool, rating_scale, item_count: np.ndarray,
+                 item_mean: np.ndarray, item_first_seen: np.ndarray, item_norms: np.ndarray = None):
+        self.users = users
+        self.items = items
+        self.pu = pu
+        self.qi = qi
+        self.bu = bu
+        self.bi = bi
+        self.global_mean = float(global_mean)
+        self.biased = biased
+        self.lower, self.upper = rating_scale
+        self.item_count = item_count
+        self.item_mean = item_mean
+        # Posición en que aparece cada película recorriendo los ratings por
+        # usuario (conserva el desempate de la versión basada en el Trainset)
+        self.item_first_seen = item_first_seen
+        self.item_norms = np.linalg.norm(qi, axis=1) if item_norms is None else item_norms
+        self.titles = np.array([], dtype=object)
+        self.extra_titles: Dict[str, str] = {}
+        self.genre_names: List[str] = []
+        self.item_genres = np.zeros(len(items), dtype=np.uint64)
+        # Top-K vecinos por similitud coseno (películas x K); K = 0 sin tabla
+        self.neighbor_ids = np.zeros((len(items), 0), dtype=np.int32)
+        self.neighbor_scores = np.zeros((len(items), 0), dtype=np.float32)
+
+    @classmethod
+    def from_surprise(cls, model, trainset) -> "ServingModel":
+        """Extrae lo necesario de un SVD de Surprise y su Trainset"""
+        n_items = trainset.n_items
+        _, items, ratings = trainset_arrays(trainset)
+        item_count = np.bincount(items, minlength=n_items).astype(np.int32)
+        item_sum = np.bincount(items, weights=ratings, minlength=n_items)
+        item_mean = np.where(item_count > 0, item_sum / np.maximum(item_count, 1), 0.0)
+        # Posición del primer rating de cada película (los ratings van ordenados por usuario)
+        first_seen = np.full(n_items, len(items), dtype=np.int64)
+        seen_items, first_index = np.unique(items, return_index=True)
+        first_seen[seen_items] = first_index
+
+        return cls(
+            users=IdMap(trainset.to_raw_uid(u) for u in range(trainset.n_users)),
+            items=IdMap(trainset.to_raw_iid(i) for i in range(n_items)),
+            pu=np.ascontiguousarray(model.pu, dtype=np.float64),
+            qi=np.ascontiguousarray(model.qi, dtype=np.float64),
+            bu=np.ascontiguousarray(model.bu, dtype=np.float64),
+            bi=np.ascontiguousarray(model.bi, dtype=np.float64),
+            global_mean=trainset.global_mean,
+            biased=model.biased,
+            rating_scale=trainset.rating_scale,
+            item_count=item_count,
+            item_mean=item_mean,
+            item_first_seen=first_seen
+        )
+
+    # ------------------------------------------------------------------
+    # Persistencia (directorio de .npy mapeables)
+    # ------------------------------------------------------------------
+
+    def _arrays(self) -> Dict[str, np.ndarray]:
+        titles = np.asarray([t or "" for t in self.titles.tolist()], dtype=str)
+        return {
+            'users_raw': self.users.raw, 'users_order': self.users._order, 'users_sorted': self.users._sorted,
+            'items_raw': self.items.raw, 'items_order': self.items._order, 'items_sorted': self.items._sorted,
+            'pu': self.pu, 'qi': self.qi, 'bu': self.bu, 'bi': self.bi,
+            'item_count': self.item_count, 'item_mean': self.item_mean,
+            'item_first_seen': self.item_first_seen, 'item_norms': self.item_norms,
+            'item_genres': self.item_genres, 'titles': titles,
+            'neighbor_ids': self.neighbor_ids, 'neighbor_scores': self.neighbor_scores
+        }
+
+    def save(self, directory: str):
+        """Guarda los arrays como .npy (de tipo fijo, sin pickle) y el resto en serving.json"""
+        os.makedirs(directory, exist_ok=True)
+        for name, array in self._arrays().items():
+            if name in OPTIONAL_ARRAY_FIELDS and array.size == 0:
+                continue
+            np.save(os.path.join(directory, f"{name}.npy"), np.ascontiguousarray(array), allow_pickle=False)
+        with open(os.path.join(directory, META_NAME), "w", encoding="utf-8") as f:
+            json.dump({
+                'global_mean': self.global_mean,
+                'biased': bool(self.biased),
+                'rating_scale': [self.lower, self.upper],
+                'genre_names': self.genre_names,
+                'extra_titles': self.extra_titles
+            }, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "ServingModel":
+        """
+        Carga un modelo guardado con save(). Con mmap=True los arrays se
+        mapean en solo lectura: no se copian al heap del proceso y las páginas
+        se comparten con los demás procesos que mapean los mismos ficheros.
+        """
+        with open(os.path.join(directory, META_NAME), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r' if mmap else None,
+                          allow_pickle=False)
+            for name in ARRAY_FIELDS + OPTIONAL_ARRAY_FIELDS
+            if name in ARRAY_FIELDS or os.path.exists(os.path.join(directory, f"{name}.npy"))
+        }
+        model = cls(
+            users=IdMap.from_arrays(arrays['users_raw'], arrays['users_order'], arrays['users_sorted']),
+            items=IdMap.from_arrays(arrays['items_raw'], arrays['items_order'], arrays['items_sorted']),
+            pu=arrays['pu'], qi=arrays['qi'], bu=arrays['bu'], bi=arrays['bi'],
+            global_mean=meta['global_mean'], biased=meta['biased'], rating_scale=tuple(meta['rating_scale']),
+            item_count=arrays['item_count'], item_mean=arrays['item_mean'],
+            item_first_seen=arrays['item_first_seen'], item_norms=arrays['item_norms']
+        )
+        model.titles = arrays['titles']
+        model.extra_titles = meta['extra_titles']
+        model.genre_names = meta['genre_names']
+        model.item_genres = arrays['item_genres']
+        if 'neighbor_ids' in arrays and 'neighbor_scores' in arrays:
+            model.attach_neighbors(arrays['neighbor_ids'], arrays['neighbor_scores'])
+        return model
+
+    @property
+    def n_users(self) -> int:
+        return len(self.users)
+
+    @property
+    def n_items(self) -> int:
+        return len(self.items)
+
+    @property
+    def neighbor_depth(self) -> int:
+        """Vecinos por película de la tabla precalculada (0 si no hay tabla)"""
+        return self.neighbor_ids.shape[1]
+
+    def attach_neighbors(self, ids: np.ndarray, scores: np.ndarray) -> bool:
+        """Usa la tabla de vecinos si corresponde a este catálogo (mismo número de filas)"""
+        if ids.shape != scores.shape or ids.ndim != 2 or len(ids) != self.n_items:
+            print(f"⚠️ Tabla de vecinos ignorada: forma {ids.shape} para {self.n_items} películas")
+            return False
+        self.neighbor_ids = ids
+        self.neighbor_scores = scores
+        return True
+
+    # ------------------------------------------------------------------
+    # Títulos y géneros
+    # ------------------------------------------------------------------
+
+    def attach_metadata(self, movie_id_to_title: Dict[str, str], movie_id_to_genres: Dict[str, str] = None):
+        """
+        Títulos alineados con los ids internos (los de películas fuera del
+        modelo, aparte) y géneros ("Action|Comedy") como máscara de bits
+        """
+        raw_ids = self.items.raw.tolist()
+        self.titles = np.array([movie_id_to_title.get(raw_id) for raw_id in raw_ids], dtype=object)
+        known = set(raw_ids)
+        self.extra_titles = {mid: title for mid, title in movie_id_to_title.items() if mid not in known}
+
+        movie_id_to_genres = movie_id_to_genres or {}
+        item_genres = [
+            [g for g in (movie_id_to_genres.get(raw_id) or "").split("|") if g and g != NO_GENRE]
+            for raw_id in raw_ids
+        ]
+        names = sorted({g for genres in item_genres for g in genres})
+        if len(names) > MAX_GENRES:
+            print(f"⚠️ {len(names)} géneros distintos; solo se indexan los {MAX_GENRES} primeros")
+            names = names[:MAX_GENRES]
+        bits = {name: np.uint64(1) << np.uint64(k) for k, name in enumerate(names)}
+        masks = np.zeros(len(raw_ids), dtype=np.uint64)
+        for inner, genres in enumerate(item_genres):
+            for g in genres:
+                if g in bits:
+                    masks[inner] |= bits[g]
+        self.genre_names = names
+        self.item_genres = masks
+
+    def title(self, movie_id: str) -> Optional[str]:
+        inner = self.items.inner(movie_id)
+        if inner is not None and inner < len(self.titles):
+            title = self.titles[inner]
+            return str(title) if title else None
+        return self.extra_titles.get(movie_id)
+
+    def item_titles(self, inner_ids: np.ndarray) -> List[Optional[str]]:
+        """Títulos de varias películas del modelo por id interno (None si no se conoce)"""
+        if len(self.titles) < self.n_items:
+            return [None] * len(inner_ids)
+        return [str(title) if title else None for title in self.titles[inner_ids].tolist()]
+
+    def genre_bits(self, genres: Iterable[str]) -> np.uint64:
+        """Máscara de bits de una lista de géneros (sin distinguir mayúsculas)"""
+        index = {name.lower(): k for k, name in enumerate(self.genre_names)}
+        bits = np.uint64(0)
+        for genre in genres:
+            k = index.get(genre.strip().lower())
+            if k is None:
+                raise ValueError(f"Género desconocido: {genre}. Disponibles: {', '.join(self.genre_names)}")
+            bits |= np.uint64(1) << np.uint64(k)
+        return bits
+
+    def genre_mask(self, genres: Iterable[str] = None, exclude_genres: Iterable[str] = None) -> Optional[np.ndarray]:
+        """
+        Películas (en orden interno) con alguno de `genres` y ninguno de
+        `exclude_genres`, o None si no hay filtro
+        """
+        if not genres and not exclude_genres:
+            return None
+        mask = np.ones(self.n_items, dtype=bool)
+        if genres:
+            mask &= (self.item_genres & self.genre_bits(genres)) != 0
+        if exclude_genres:
+            mask &= (self.item_genres & self.genre_bits(exclude_genres)) == 0
+        return mask
+
+    # ------------------------------------------------------------------
+    # Inferencia
+    # ------------------------------------------------------------------
+
+    def predict(self, user_id: str, movie_id: str) -> float:
+        """Rating estimado con las reglas de SVD.estimate + predict(clip=True)"""
+        u = self.users.inner(user_id)
+        i = self.items.inner(movie_id)
+        if self.biased:
+            est = self.global_mean
+            if u is not None:
+                est += self.bu[u]
+            if i is not None:
+                est += self.bi[i]
+            if u is not None and i is not None:
+                est += np.dot(self.qi[i], self.pu[u])
+        elif u is not None and i is not None:
+            est = np.dot(self.qi[i], self.pu[u])
+        else:
+            est = self.global_mean
+        return max(self.lower, min(self.upper, est))
+
+    def score_user(self, inner_uid: int) -> np.ndarray:
+        """Estimaciones de un usuario conocido para todo el catálogo, en orden interno"""
+        dots = self.qi @ self.pu[inner_uid]
+        if self.biased:
+            est = self.global_mean + self.bu[inner_uid] + self.bi + dots
+        else:
+            est = dots
+        return np.clip(est, self.lower, self.upper)
+
+    def score_users(self, inner_uids: np.ndarray) -> np.ndarray:
+        """Estimaciones de varios usuarios conocidos (una fila por usuario) en un solo producto de matrices"""
+        dots = self.pu[inner_uids] @ self.qi.T
+        if self.biased:
+            # Mismas sumas que score_user, sin un temporal (bloque x películas) por operación
+            est = self.global_mean + self.bu[inner_uids][:, None] + self.bi
+            est += dots
+        else:
+            est = dots
+        return np.clip(est, self.lower, self.upper, out=est)
+
+    def predict_many(self, user_ids: Iterable, movie_ids: Iterable) -> np.ndarray:
+        """predict() vectorizado para pares (usuario, película)"""
+        u = self.users.inner_many(user_ids)
+        i = self.items.inner_many(movie_ids)
+        known_u, known_i = u >= 0, i >= 0
+        both = known_u & known_i
+        dots = np.einsum('ij,ij->i', self.qi[i[both]], self.pu[u[both]])
+        if self.biased:
+            est = np.full(len(u), self.global_mean, dtype=np.float64)
+            est[known_u] += self.bu[u[known_u]]
+            est[known_i] += self.bi[i[known_i]]
+            est[both] += dots
+        else:
+            est = np.full(len(u), self.global_mean, dtype=np.float64)
+            est[both] = dots
+        return np.clip(est, self.lower, self.upper)
+
+    def cosine_similarities(self, inner_iid: int) -> np.ndarray:
+        """Similitud coseno de los factores de una película con todas las demás"""
+        return (self.qi @ self.qi[inner_iid]) / (self.item_norms * self.item_norms[inner_iid])
+
+    def nbytes(self) -> int:
+        """Memoria aproximada de los arrays del modelo"""
+        arrays = [self.users.raw, self.users._order, self.users._sorted, self.items.raw,
+                  self.items._order, self.items._sorted, self.pu, self.qi, self.bu, self.bi,
+                  self.item_count, self.item_mean, self.item_first_seen, self.item_norms, self.item_genres,
+                  self.neighbor_ids, self.neighbor_scores]
+        titles = self.titles.nbytes
+        if self.titles.dtype == object:
+            titles += sum(len(t) for t in self.titles.tolist() if t)
+        return int(sum(a.nbytes for a in arrays) + titles)
+
+
+def release_memory():
+    """Recolecta basura y devuelve al sistema la memoria libre del heap (glibc)"""
+    gc.collect()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
@@ -0,0 +1,289 @@
+"""
+Almacén Compartido del Modelo de Servicio
+Sistema de Recomendación de Películas - Grupo 8
+
+Modo multi-worker: un supervisor publica una sola vez el modelo de servicio
+(ver serving_model.py) como un directorio de .npy por generación. Los workers
+de uvicorn lo mapean en memoria de solo lectura en lugar de deserializar cada
+uno su copia del pickle. Las páginas del modelo viven en la caché del sistema
+operativo y las comparten todos los workers, así que la memoria no crece con
+el número de workers.
+
+Cada generación corresponde a una versión del registro:
+- Al publicar una nueva, el puntero CURRENT se cambia de forma atómica.
+- Cada worker comprueba el puntero en su bucle de recarga
+  (MODEL_RELOAD_INTERVAL) y pasa a la nueva generación sin deserializar nada.
+- Las generaciones antiguas se borran con retención. Un worker que todavía
+  las tenga mapeadas sigue funcionando, porque en Linux un fichero borrado
+  sigue siendo accesible mientras esté mapeado.
+
+Estructura:
+    models/shared/
+    ├── CURRENT                       # generación activa (= versión del registro)
+    └── generations/
+        └── 20251202_180024/
+            ├── generation.json       # versión, fecha de entrenamiento, fuente de títulos...
+            ├── serving.json
+            └── pu.npy, qi.npy, ...
+
+Uso:
+    python shared_model_store.py serve --workers 4 --port 8000   # supervisor + workers
+    python shared_model_store.py publish                          # publicar la versión actual
+"""
+
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from model_registry import CURRENT_POINTER, ModelRegistry, _atomic_write, _write_json_atomic
+from serving_model import ServingModel
+
+GENERATION_META = "generation.json"
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class SharedModelStore:
+    """Generaciones del modelo de servicio en disco con puntero CURRENT y retención"""
+
+    def __init__(self, root: str = 'models/shared', keep: int = 2):
+        """
+        Args:
+            root: Directorio raíz del almacén
+            keep: Generaciones conservadas además de la actual
+        """
+        self.root = root
+        self.generations_dir = os.path.join(root, "generations")
+        self.keep = max(0, keep)
+
+    @classmethod
+    def for_model_path(cls, model_path: str, **kwargs) -> "SharedModelStore":
+        """Almacén asociado a una ruta de modelo clásica (models/svd_model_1m.pkl)"""
+        return cls(os.path.join(os.path.dirname(model_path) or ".", "shared"), **kwargs)
+
+    # ------------------------------------------------------------------
+    # Consultas
+    # ------------------------------------------------------------------
+
+    def generation_dir(self, generation: str) -> str:
+        return os.path.join(self.generations_dir, generation)
+
+    def list_generations(self) -> List[str]:
+        """Generaciones publicadas, de la más reciente a la más antigua"""
+        if not os.path.isdir(self.generations_dir):
+            return []
+        generations = [
+            g for g in os.listdir(self.generations_dir)
+            if os.path.exists(os.path.join(self.generation_dir(g), GENERATION_META))
+        ]
+        return sorted(generations, reverse=True)
+
+    def current_generation(self) -> Optional[str]:
+        """Generación activa (None si todavía no se ha publicado ninguna)"""
+        try:
+            with open(os.path.join(self.root, CURRENT_POINTER), 'r', encoding='utf-8') as f:
+                generation = f.read().strip()
+        except FileNotFoundError:
+            return None
+        return generation or None
+
+    def load(self, generation: str = None, mmap: bool = True) -> Tuple[ServingModel, Dict]:
+        """Mapea una generación (por defecto, la actual); devuelve el modelo y su generation.json"""
+        generation = generation or self.current_generation()
+        if generation is None:
+            raise FileNotFoundError(f"El almacén {self.root} no tiene ninguna generación publicada")
+        directory = self.generation_dir(generation)
+        with open(os.path.join(directory, GENERATION_META), 'r', encoding='utf-8') as f:
+            info = json.load(f)
+        return ServingModel.load(directory, mmap=mmap), info
+
+    # ------------------------------------------------------------------
+    # Publicación
+    # ------------------------------------------------------------------
+
+    def publish(self, serving: ServingModel, info: Dict) -> str:
+        """
+        Guarda el modelo como generación info['version'] (si no existe ya),
+        la marca como actual y aplica la retención. Se escribe en un directorio
+        temporal que se renombra al final, así que un worker nunca ve una
+        generación a medias; si dos procesos publican la misma versión a la
+        vez, gana el primer rename.
+        """
+        generation = str(info['version'])
+        final_dir = self.generation_dir(generation)
+        if not os.path.exists(os.path.join(final_dir, GENERATION_META)):
+            os.makedirs(self.generations_dir, exist_ok=True)
+            tmp_dir = os.path.join(self.generations_dir, f".tmp-{generation}-{os.getpid()}")
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            serving.save(tmp_dir)
+            _write_json_atomic(os.path.join(tmp_dir, GENERATION_META), {
+                **info,
+                'published_at': datetime.now().isoformat(),
+                'nbytes': serving.nbytes()
+            })
+            try:
+                os.rename(tmp_dir, final_dir)
+            except OSError:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.set_current(generation)
+        self.apply_retention()
+        return generation
+
+    def set_current(self, generation: str):
+        """Cambia el puntero CURRENT de forma atómica"""
+        if not os.path.exists(os.path.join(self.generation_dir(generation), GENERATION_META)):
+            raise ValueError(f"Generación inexistente: {generation}")
+        _atomic_write(
+            os.path.join(self.root, CURRENT_POINTER),
+            lambda f: f.write(generation),
+            mode='w',
+            encoding='utf-8'
+        )
+
+    def apply_retention(self) -> List[str]:
+        """Borra las generaciones más antiguas que las `keep` últimas (nunca la actual)"""
+        current = self.current_generation()
+        others = [g for g in self.list_generations() if g != current]
+        removed = others[self.keep:]
+        for generation in removed:
+            shutil.rmtree(self.generation_dir(generation), ignore_errors=True)
+        return removed
+
+    def publish_registry_version(self, model_path: str, movies_path: str = None) -> Optional[str]:
+        """
+        Publica la versión actual del registro si aún no es la generación
+        activa. Solo deserializa el pickle cuando la generación no existe; si
+        existe (p. ej. tras un rollback), basta con mover el puntero.
+
+        Returns:
+            Generación publicada, o None si no había cambios
+        """
+        version = ModelRegistry.for_model_path(model_path).current_version()
+        current = self.current_generation()
+        if current is not None and (version is None or version == current):
+            return None
+        if version is not None and os.path.exists(os.path.join(self.generation_dir(version), GENERATION_META)):
+            self.set_current(version)
+            return version
+
+        from model_inference_with_db import MovieRecommenderDB
+        recommender = MovieRecommenderDB(model_path, movies_path=movies_path)
+        return self.publish(recommender.serving, {
+            'version': recommender.model_version,
+            'created_at': recommender.model_created_at,
+            'global_mean': recommender.global_mean,
+            'movies_source': recommender._movies_source
+        })
+
+
+# ============================================================================
+# SUPERVISOR
+# ============================================================================
+
+def publish_in_subprocess(store: SharedModelStore, model_path: str, movies_path: str = None) -> bool:
+    """
+    Ejecuta publish_registry_version en un proceso aparte: la deserialización
+    del pickle (y los imports de Surprise y pandas) no quedan en la memoria del
+    supervisor, que vive tanto como los workers
+    """
+    command = [sys.executable, os.path.abspath(__file__), "--store", store.root, "--keep", str(store.keep),
+               "--model", model_path, "publish"]
+    if movies_path:
+        command[-1:-1] = ["--movies", movies_path]
+    return subprocess.run(command).returncode == 0
+
+
+def serve(
+    store: SharedModelStore,
+    model_path: str,
+    movies_path: str = None,
+    workers: int = 2,
+    host: str = "0.0.0.0",
+    port: int = 8000,
+    poll: float = 5.0
+) -> int:
+    """
+    Publica el modelo, arranca uvicorn con `workers` procesos conectados al
+    almacén y, mientras corren, publica cada nueva versión del registro. Los
+    workers siguen el puntero CURRENT cada `poll` segundos.
+
+    Returns:
+        Código de salida de uvicorn
+    """
+    if not publish_in_subprocess(store, model_path, movies_path) or store.current_generation() is None:
+        print(f"✗ No se pudo publicar el modelo en {store.root}")
+        return 1
+    print(f"✓ Generación {store.current_generation()} publicada en {store.root}")
+
+    env = dict(os.environ)
+    env["SHARED_MODEL_STORE"] = os.path.abspath(store.root)
+    env.setdefault("MODEL_RELOAD_INTERVAL", str(poll))
+    command = [
+        sys.executable, "-m", "uvicorn", "main:app", "--app-dir", BACKEND_DIR,
+        "--host", host, "--port", str(port), "--workers", str(workers)
+    ]
+    print(f"✓ Arrancando {workers} workers en {host}:{port}")
+    process = subprocess.Popen(command, env=env)
+    # SIGTERM (systemd, docker stop) sale por el finally y para también a uvicorn
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        while True:
+            try:
+                return process.wait(timeout=poll)
+            except subprocess.TimeoutExpired:
+                pass
+            # Sin versión nueva en el registro no hace falta lanzar el proceso de publicación
+            version = ModelRegistry.for_model_path(model_path).current_version()
+            if version is None or version == store.current_generation():
+                continue
+            if publish_in_subprocess(store, model_path, movies_path):
+                print(f"✓ Nueva generación publicada: {store.current_generation()}")
+            else:
+                # Los workers siguen con la generación actual; se reintenta en la siguiente vuelta
+                print(f"✗ Error publicando la versión {version}")
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        if process.poll() is None:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Modelo de servicio compartido entre workers')
+    parser.add_argument('--model', default='models/svd_model_1m.pkl', help='Ruta del modelo (su registro)')
+    parser.add_argument('--movies', default='data/movies.dat', help='Fichero de películas')
+    parser.add_argument('--store', help='Directorio del almacén (por defecto, models/shared)')
+    parser.add_argument('--keep', type=int, default=2, help='Generaciones antiguas conservadas')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = subparsers.add_parser('serve', help='Supervisor: publica el modelo y arranca los workers')
+    serve_parser.add_argument('--workers', type=int, default=2, help='Número de workers de uvicorn')
+    serve_parser.add_argument('--host', default='0.0.0.0')
+    serve_parser.add_argument('--port', type=int, default=8000)
+    serve_parser.add_argument('--poll', type=float, default=5.0,
+                              help='Segundos entre comprobaciones de nuevas versiones')
+
+    subparsers.add_parser('publish', help='Publica la versión actual del registro')
+    subparsers.add_parser('list', help='Lista las generaciones publicadas')
+    args = parser.parse_args()
+
+    store = (SharedModelStore(args.store, keep=args.keep) if args.store
+             else SharedModelStore.for_model_path(args.model, keep=args.keep))
+
+    if args.command == 'serve':
+        sys.exit(serve(store, args.model, args.movies, args.workers, args.host, args.port, args.poll))
+    elif args.command == 'publish':
+        published = store.publish_registry_version(args.model, args.movies)
+        print(f"✓ Generación {published} publicada" if published
+              else f"ℹ️ La generación actual ({store.current_generation()}) ya está al día")
+    else:
+        current = store.current_generation()
+        for generation in store.list_generations():
+            print(f"{'→' if generation == current else ' '} {generation}")
@@ -0,0 +1,375 @@
+"""
+Trazas de Peticiones con Exportador Local
+Sistema de Recomendación de Películas - Grupo 8
+
+Spans ligeros propagados con contextvars a lo largo de la petición (también a
+los hilos del threadpool de FastAPI). Cada petición muestreada genera una
+traza con su span raíz (método + ruta) y los spans de las etapas internas
+(escritura en BD, recarga de ratings, puntuación del catálogo, títulos,
+serialización...). Las trazas terminadas se escriben en un JSONL local con
+rotación por tamaño, en formato propio o compatible con OTLP/JSON.
+
+Sin muestreo (TRACING_SAMPLE_RATE=0, por defecto) span() devuelve un context
+manager vacío y el coste es una lectura de contextvar.
+
+Variables de entorno:
+    TRACING_SAMPLE_RATE   Fracción de peticiones trazadas (0-1, por defecto 0)
+    TRACING_PATH          Fichero JSONL (por defecto logs/traces.jsonl)
+    TRACING_FORMAT        'jsonl' (por defecto) u 'otlp'
+    TRACING_MAX_BYTES     Tamaño antes de rotar (por defecto 10 MB)
+    TRACING_BACKUPS       Ficheros rotados que se conservan (por defecto 5)
+
+Resumen tipo flame graph por endpoint:
+    python tracing.py summarize logs/traces.jsonl*
+"""
+
+import contextvars
+import json
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List, Optional
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+_NOOP = nullcontext()
+
+
+class Span:
+    """Un tramo con nombre, atributos y tiempos en nanosegundos"""
+
+    __slots__ = ("trace", "span_id", "parent_id", "name", "attributes", "start_ns", "end_ns")
+
+    def __init__(self, trace: "Trace", name: str, parent_id: Optional[str], attributes: Dict):
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def to_dict(self) -> Dict:
+        return {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 4) if self.end_ns else None,
+            "attributes": self.attributes
+        }
+
+
+class Trace:
+    """Spans de una petición"""
+
+    def __init__(self, trace_id: str = None):
+        self.trace_id = trace_id or os.urandom(16).hex()
+        self.spans: List[Span] = []
+
+
+@contextmanager
+def _span_context(trace: Trace, name: str, parent_id: Optional[str], attributes: Dict):
+    current = Span(trace, name, parent_id, attributes)
+    trace.spans.append(current)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.attributes["error"] = type(e).__name__
+        raise
+    finally:
+        current.end_ns = time.time_ns()
+        _current_span.reset(token)
+
+
+def span(name: str, **attributes):
+    """
+    Span hijo del span actual. Fuera de una traza muestreada no hace nada:
+
+        with span("db.write_rating", movie_id=movie_id):
+            ...
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return _NOOP
+    return _span_context(parent.trace, name, parent.span_id, attributes)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+# ============================================================================
+# EXPORTADORES
+# ============================================================================
+
+class RotatingJSONLExporter:
+    """Escribe una línea JSON por traza y rota el fichero al superar max_bytes"""
+
+    def __init__(self, path: str = "logs/traces.jsonl", max_bytes: int = 10 * 1024 * 1024,
+                 backups: int = 5, otlp: bool = False, service_name: str = "movie-recommender-api"):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.otlp = otlp
+        self.service_name = service_name
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def _rotate(self):
+        for i in range(self.backups - 1, 0, -1):
+            source = f"{self.path}.{i}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    def export(self, trace: Trace):
+        line = json.dumps(self._otlp(trace) if self.otlp else {
+            "trace_id": trace.trace_id,
+            "spans": [s.to_dict() for s in trace.spans]
+        }, default=str)
+        with self._lock:
+            if os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+                self._rotate()
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def _otlp(self, trace: Trace) -> Dict:
+        """Traza en el formato JSON de OTLP (ExportTraceServiceRequest)"""
+        def attribute(key, value):
+            if isinstance(value, bool):
+                return {"key": key, "value": {"boolValue": value}}
+            if isinstance(value, int):
+                return {"key": key, "value": {"intValue": str(value)}}
+            if isinstance(value, float):
+                return {"key": key, "value": {"doubleValue": value}}
+            return {"key": key, "value": {"stringValue": str(value)}}
+
+        return {"resourceSpans": [{
+            "resource": {"attributes": [attribute("service.name", self.service_name)]},
+            "scopeSpans": [{
+                "scope": {"name": "tracing"},
+                "spans": [{
+                    "traceId": trace.trace_id,
+                    "spanId": s.span_id,
+                    "parentSpanId": s.parent_id or "",
+                    "name": s.name,
+                    "kind": 2 if s.parent_id is None else 1,
+                    "startTimeUnixNano": str(s.start_ns),
+                    "endTimeUnixNano": str(s.end_ns or s.start_ns),
+                    "attributes": [attribute(k, v) for k, v in s.attributes.items()]
+                } for s in trace.spans]
+            }]
+        }]}
+
+
+class Tracer:
+    """Decide el muestreo, abre la traza de cada petición y la exporta al terminar"""
+
+    def __init__(self, sample_rate: float = 0.0, exporter: RotatingJSONLExporter = None):
+        self.sample_rate = sample_rate
+        self.exporter = exporter
+
+    @classmethod
+    def from_env(cls) -> "Tracer":
+        sample_rate = float(os.getenv("TRACING_SAMPLE_RATE", "0"))
+        exporter = RotatingJSONLExporter(
+            path=os.getenv("TRACING_PATH", "logs/traces.jsonl"),
+            max_bytes=int(os.getenv("TRACING_MAX_BYTES", str(10 * 1024 * 1024))),
+            backups=int(os.getenv("TRACING_BACKUPS", "5")),
+            otlp=os.getenv("TRACING_FORMAT", "jsonl").lower() == "otlp"
+        ) if sample_rate > 0 else None
+        return cls(sample_rate, exporter)
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0 and self.exporter is not None
+
+    def should_sample(self) -> bool:
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    @contextmanager
+    def root(self, name: str, trace_id: str = None, parent_id: str = None, **attributes):
+        """Span raíz de una petición; exporta la traza completa al salir"""
+        trace = Trace(trace_id)
+        try:
+            with _span_context(trace, name, parent_id, attributes) as root_span:
+                yield root_span
+        finally:
+            if self.exporter is not None:
+                try:
+                    self.exporter.export(trace)
+                except OSError as e:
+                    print(f"⚠️ No se pudo exportar la traza: {e}")
+
+
+_TRACEPARENT_RE = re.compile(
+    r"^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})(-.*)?$"
+)
+
+
+def parse_traceparent(header: str):
+    """
+    (trace_id, parent_id, sampled) de una cabecera W3C traceparent, o None si
+    está mal formada: campos que no son hex en minúsculas, versión ff, ids a
+    cero o campos de más en la versión 00. Nunca lanza excepciones.
+    """
+    match = _TRACEPARENT_RE.match(header.strip())
+    if not match:
+        return None
+    version, trace_id, parent_id, flags, rest = match.groups()
+    if version == "ff" or (version == "00" and rest):
+        return None
+    if trace_id == "0" * 32 or parent_id == "0" * 16:
+        return None
+    return trace_id, parent_id, int(flags, 16) & 1 == 1
+
+
+class TracingMiddleware:
+    """
+    Middleware ASGI que abre la traza de cada petición muestreada. Respeta la
+    cabecera traceparent entrante (id de traza, padre y flag de muestreo).
+    """
+
+    def __init__(self, app, tracer: Tracer):
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.tracer.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        from metrics import route_template
+
+        trace_id = parent_id = None
+        sampled = None
+        for key, value in scope.get("headers", []):
+            if key == b"traceparent":
+                parsed = parse_traceparent(value.decode("latin-1"))
+                if parsed:
+                    trace_id, parent_id, sampled = parsed
+                break
+        if sampled is None:
+            sampled = self.tracer.should_sample()
+        if not sampled:
+            await self.app(scope, receive, send)
+            return
+
+        status_code = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_code[0] = message["status"]
+            await send(message)
+
+        with self.tracer.root(f"{scope['method']} {scope['path']}", trace_id, parent_id,
+                              **{"http.method": scope["method"], "http.target": scope["path"]}) as root:
+            await self.app(scope, receive, send_wrapper)
+            root.set_attribute("http.status_code", status_code[0])
+            template = route_template(scope)
+            if template != "unmatched":
+                root.name = f"{scope['method']} {template}"
+                root.set_attribute("http.route", template)
+
+
+# ============================================================================
+# RESUMEN
+# ============================================================================
+
+def _load_traces(paths: List[str]) -> List[List[Dict]]:
+    """Spans de cada traza, en formato propio u OTLP"""
+    traces = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                if "resourceSpans" in record:
+                    spans = []
+                    for resource in record["resourceSpans"]:
+                        for scope_spans in resource["scopeSpans"]:
+                            for s in scope_spans["spans"]:
+                                spans.append({
+                                    "span_id": s["spanId"],
+                                    "parent_id": s["parentSpanId"] or None,
+                                    "name": s["name"],
+                                    "duration_ms": (int(s["endTimeUnixNano"]) - int(s["startTimeUnixNano"])) / 1e6
+                                })
+                    traces.append(spans)
+                else:
+                    traces.append(record["spans"])
+    return traces
+
+
+def summarize_traces(paths: List[str]) -> Dict[str, Dict]:
+    """
+    Agrega las trazas por endpoint (span raíz): para cada ruta de spans
+    (raíz;hijo;nieto) el tiempo total, el tiempo propio y el número de llamadas
+    """
+    endpoints: Dict[str, Dict] = {}
+    for spans in _load_traces(paths):
+        ids = {s["span_id"] for s in spans}
+        children: Dict[Optional[str], List[Dict]] = {}
+        for s in spans:
+            parent = s["parent_id"] if s["parent_id"] in ids else None
+            children.setdefault(parent, []).append(s)
+        for root in children.get(None, []):
+            endpoint = endpoints.setdefault(root["name"], {"count": 0, "paths": {}})
+            endpoint["count"] += 1
+
+            def visit(node, path):
+                own_children = children.get(node["span_id"], [])
+                child_ms = sum(c["duration_ms"] or 0 for c in own_children)
+                entry = endpoint["paths"].setdefault(path, {"total_ms": 0.0, "self_ms": 0.0, "calls": 0})
+                entry["total_ms"] += node["duration_ms"] or 0
+                entry["self_ms"] += max(0.0, (node["duration_ms"] or 0) - child_ms)
+                entry["calls"] += 1
+                for child in own_children:
+                    visit(child, f"{path};{child['name']}")
+
+            visit(root, root["name"])
+    return endpoints
+
+
+def format_summary(endpoints: Dict[str, Dict]) -> List[str]:
+    lines = []
+    for name, endpoint in sorted(endpoints.items(), key=lambda kv: -kv[1]["count"]):
+        count = endpoint["count"]
+        root_total = endpoint["paths"][name]["total_ms"] or 1e-9
+        lines.append(f"{name}  ({count} trazas, media {endpoint['paths'][name]['total_ms'] / count:.2f} ms)")
+        lines.append(f"  {'Span':<52}{'ms/petición':>12}{'propio':>9}{'%':>7}{'llamadas':>10}")
+        for path, entry in sorted(endpoint["paths"].items()):
+            depth = path.count(";")
+            label = ("  " * depth + path.rsplit(";", 1)[-1])[:52]
+            lines.append(
+                f"  {label:<52}{entry['total_ms'] / count:>12.2f}{entry['self_ms'] / count:>9.2f}"
+                f"{100 * entry['total_ms'] / root_total:>6.1f}%{entry['calls'] / count:>10.1f}"
+            )
+        lines.append("")
+    return lines
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Resumen de trazas por endpoint')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    summarize_parser = subparsers.add_parser('summarize', help='Desglose tipo flame graph de los JSONL de trazas')
+    summarize_parser.add_argument('paths', nargs='+', help='Ficheros de trazas (admite los rotados)')
+    args = parser.parse_args()
+
+    print("="*70)
+    print("TRAZAS - DESGLOSE POR ENDPOINT")
+    print("="*70)
+    for line in format_summary(summarize_traces(args.paths)):
+        print(line)
@@ -3,19 +3,25 @@ Script para entrenar y exportar el modelo SVD con MovieLens 1M
 Sistema de Recomendación de Películas - Grupo 8
 """
 
-import pickle
 import time
 from surprise import SVD, Dataset, Reader
 from surprise.model_selection import cross_validate, train_test_split
 import pandas as pd
-import os
+
+from evaluation import evaluate_ratings, format_segments
+from item_neighbors import DEFAULT_K, NEIGHBORS_FILE, neighbor_arrays
+from model_registry import ModelRegistry, load_model_data, resolve_model_path
+from training_report import RUN_REPORT_NAME, TrainingRunReport, capture_epoch_timings, timed_stage
 
 class MovieRecommenderTrainer:
     def __init__(self):
         self.model = None
         self.trainset = None
         self.testset = None
+        self.model_version = None
+        self.report = TrainingRunReport('train')
         
+    @timed_stage('load_movielens_1m', rows=lambda self, data: len(data.raw_ratings))
     def load_movielens_1m(self):
         """
         Carga el dataset MovieLens 1M desde los archivos locales o desde Surprise
@@ -63,19 +69,24 @@ class MovieRecommenderTrainer:
         
         # Dividir en train y test
         print("\nDividiendo dataset en train (80%) y test (20%)...")
-        self.trainset, self.testset = train_test_split(data, test_size=0.2, random_state=42)
+        with self.report.stage('train_test_split') as stage:
+            self.trainset, self.testset = train_test_split(data, test_size=0.2, random_state=42)
+            stage['rows'] = self.trainset.n_ratings
         
         # Entrenar modelo
         print("\nIniciando entrenamiento del modelo...")
         start_time = time.time()
         
-        self.model.fit(self.trainset)
+        with self.report.stage('fit') as stage, capture_epoch_timings(self.report.epochs):
+            self.model.fit(self.trainset)
+            stage['rows'] = self.trainset.n_ratings
         
         training_time = time.time() - start_time
         print(f"\n✓ Modelo entrenado exitosamente en {training_time:.2f} segundos")
         
         return training_time
     
+    @timed_stage('evaluate_model', rows=lambda self, metrics: len(self.testset) if self.testset else None)
     def evaluate_model(self):
         """
         Evalúa el modelo en el conjunto de test
@@ -85,18 +96,15 @@ class MovieRecommenderTrainer:
             return None
         
         print("\nEvaluando modelo en conjunto de test...")
-        from surprise import accuracy
-        
-        predictions = self.model.test(self.testset)
-        
-        rmse = accuracy.rmse(predictions, verbose=False)
-        mae = accuracy.mae(predictions, verbose=False)
+        result = evaluate_ratings(self.model, self.trainset, self.testset)
         
         print(f"\nMétricas de evaluación:")
-        print(f"  RMSE: {rmse:.5f}")
-        print(f"  MAE:  {mae:.5f}")
+        print(f"  RMSE: {result['rmse']:.5f}")
+        print(f"  MAE:  {result['mae']:.5f}")
+        for line in format_segments(result):
+            print(line)
         
-        return {'rmse': rmse, 'mae': mae}
+        return {'rmse': result['rmse'], 'mae': result['mae'], 'segments': result['segments']}
     
     def cross_validate_model(self, data, cv=5):
         """
@@ -121,18 +129,18 @@ class MovieRecommenderTrainer:
         
         return results
     
-    def export_model(self, filepath='models/svd_model_1m.pkl'):
+    @timed_stage('export_model')
+    def export_model(self, filepath='models/svd_model_1m.pkl', metrics=None, neighbors_k=DEFAULT_K):
         """
-        Exporta el modelo entrenado a un archivo pickle
+        Publica el modelo entrenado como nueva versión del registro de modelos,
+        con la tabla de los neighbors_k vecinos de cada película (0 = sin tabla)
         """
         if self.model is None:
             print("Error: No hay modelo para exportar. Entrena el modelo primero.")
             return False
         
-        # Crear directorio si no existe
-        os.makedirs(os.path.dirname(filepath), exist_ok=True)
-        
-        print(f"\nExportando modelo a {filepath}...")
+        registry = ModelRegistry.for_model_path(filepath)
+        print(f"\nPublicando modelo en {registry.root}...")
         
         # Guardar el modelo completo con información adicional
         model_data = {
@@ -143,22 +151,36 @@ class MovieRecommenderTrainer:
             'global_mean': self.trainset.global_mean
         }
         
-        with open(filepath, 'wb') as f:
-            pickle.dump(model_data, f)
+        arrays = {NEIGHBORS_FILE: neighbor_arrays(self.model, neighbors_k)} if neighbors_k > 0 else None
+        version = registry.publish(model_data, {
+            'n_ratings': self.trainset.n_ratings,
+            'metrics': metrics,
+            'neighbors_k': neighbors_k
+        }, arrays=arrays)
+        self.model_version = version
         
-        file_size = os.path.getsize(filepath) / (1024 * 1024)  # MB
-        print(f"✓ Modelo exportado exitosamente ({file_size:.2f} MB)")
+        file_size = registry.get_manifest(version)['artifact']['size_bytes'] / (1024 * 1024)  # MB
+        print(f"✓ Modelo exportado exitosamente como versión {version} ({file_size:.2f} MB)")
         
         return True
     
+    def save_run_report(self, filepath='models/svd_model_1m.pkl', metrics=None):
+        """Guarda el informe de la ejecución junto a la versión publicada"""
+        self.report.extra.update({'model_version': self.model_version, 'metrics': metrics})
+        report = self.report.to_dict()
+        if self.model_version:
+            registry = ModelRegistry.for_model_path(filepath)
+            registry.attach_json(self.model_version, RUN_REPORT_NAME, report)
+        return report
+    
     def load_model(self, filepath='models/svd_model_1m.pkl'):
         """
-        Carga un modelo previamente entrenado
+        Carga un modelo previamente entrenado (versión actual del registro si existe)
         """
+        filepath = resolve_model_path(filepath)
         print(f"\nCargando modelo desde {filepath}...")
         
-        with open(filepath, 'rb') as f:
-            model_data = pickle.load(f)
+        model_data = load_model_data(filepath)
         
         self.model = model_data['model']
         self.trainset = model_data['trainset']
@@ -209,7 +231,8 @@ def main():
     metrics = trainer.evaluate_model()
     
     # 4. Exportar modelo
-    success = trainer.export_model('models/svd_model_1m.pkl')
+    success = trainer.export_model('models/svd_model_1m.pkl', metrics=metrics)
+    trainer.save_run_report('models/svd_model_1m.pkl', metrics=metrics)
     
     # Resumen final
     print("\n" + "="*70)
@@ -219,6 +242,9 @@ def main():
     print(f"RMSE: {metrics['rmse']:.5f}")
     print(f"MAE:  {metrics['mae']:.5f}")
     print(f"Modelo exportado: {'✓ Sí' if success else '✗ No'}")
+    print("-"*70)
+    for line in trainer.report.format_lines():
+        print(line)
     print("="*70)
     
     # Ejemplo de predicción
@@ -0,0 +1,223 @@
+"""
+Instrumentación del Pipeline de Entrenamiento
+Sistema de Recomendación de Películas - Grupo 8
+
+Registra por cada etapa del entrenamiento el tiempo de pared, el tiempo de
+CPU, la memoria (RSS) y el número de filas procesadas, además del tiempo de
+cada época del ajuste. El resultado es un informe JSON que se guarda junto
+al modelo en el registro (run_report.json).
+"""
+
+import functools
+import io
+import os
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+RUN_REPORT_NAME = "run_report.json"
+
+
+def current_rss_bytes() -> Optional[int]:
+    """RSS actual del proceso (None si el sistema no lo expone)"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """Pico de RSS del proceso desde su inicio"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux lo devuelve en KB, macOS en bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _to_mb(value: Optional[int]) -> Optional[float]:
+    return round(value / (1024 * 1024), 2) if value is not None else None
+
+
+class _RssSampler:
+    """Hilo que muestrea el RSS para conocer el pico dentro de una etapa"""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak = current_rss_bytes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            rss = current_rss_bytes()
+            if rss is not None and (self.peak is None or rss > self.peak):
+                self.peak = rss
+
+    def __enter__(self):
+        if self.peak is not None:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        rss = current_rss_bytes()
+        if rss is not None and (self.peak is None or rss > self.peak):
+            self.peak = rss
+
+
+class TrainingRunReport:
+    """Informe estructurado de una ejecución de entrenamiento"""
+
+    def __init__(self, run_name: str):
+        self.run_name = run_name
+        self.started_at = datetime.now()
+        self._start_wall = time.perf_counter()
+        self._start_cpu = time.process_time()
+        self.stages: List[Dict] = []
+        self.epochs: List[Dict] = []
+        self.extra: Dict = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Mide una etapa. El dict devuelto admite campos adicionales, p. ej.:
+
+            with report.stage('fit') as stage:
+                ...
+                stage['rows'] = trainset.n_ratings
+        """
+        record = {"name": name, "rows": None}
+        rss_start = current_rss_bytes()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        with _RssSampler() as sampler:
+            try:
+                yield record
+            except BaseException as e:
+                record["error"] = str(e)
+                raise
+            finally:
+                rss_end = current_rss_bytes()
+                peak = max((v for v in (sampler.peak, rss_end) if v is not None), default=None)
+                record["wall_seconds"] = round(time.perf_counter() - wall_start, 4)
+                record["cpu_seconds"] = round(time.process_time() - cpu_start, 4)
+                record["rss_start_mb"] = _to_mb(rss_start)
+                record["rss_end_mb"] = _to_mb(rss_end)
+                record["peak_rss_mb"] = _to_mb(peak)
+                self.stages.append(record)
+
+    def get_stage(self, name: str) -> Optional[Dict]:
+        for record in self.stages:
+            if record["name"] == name:
+                return record
+        return None
+
+    def to_dict(self) -> Dict:
+        return {
+            "run": self.run_name,
+            "started_at": self.started_at.isoformat(),
+            "finished_at": datetime.now().isoformat(),
+            "total_wall_seconds": round(time.perf_counter() - self._start_wall, 4),
+            "total_cpu_seconds": round(time.process_time() - self._start_cpu, 4),
+            "peak_rss_mb": _to_mb(peak_rss_bytes()),
+            "stages": self.stages,
+            "epochs": self.epochs,
+            **self.extra
+        }
+
+    def format_lines(self) -> List[str]:
+        """Tabla legible de las etapas para consola y logs"""
+        lines = [f"{'Etapa':<32}{'Pared (s)':>11}{'CPU (s)':>10}{'Pico RSS (MB)':>15}{'Filas':>11}"]
+        for record in self.stages:
+            peak = record["peak_rss_mb"]
+            rows = record["rows"]
+            lines.append(
+                f"{record['name']:<32}{record['wall_seconds']:>11.2f}{record['cpu_seconds']:>10.2f}"
+                f"{(f'{peak:.1f}' if peak is not None else 'N/A'):>15}"
+                f"{(str(rows) if rows is not None else '-'):>11}"
+            )
+        if self.epochs:
+            epoch_times = [e["seconds"] for e in self.epochs]
+            lines.append(
+                f"Épocas: {len(self.epochs)} | media {sum(epoch_times) / len(epoch_times):.2f}s "
+                f"| máx {max(epoch_times):.2f}s"
+            )
+        return lines
+
+
+def timed_stage(name: str, rows: Callable = None):
+    """
+    Decorador para métodos de los entrenadores: mide la llamada como una etapa
+    de self.report (si existe). rows(self, resultado) calcula las filas procesadas.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            report = getattr(self, "report", None)
+            if report is None:
+                return method(self, *args, **kwargs)
+            with report.stage(name) as stage:
+                result = method(self, *args, **kwargs)
+                if rows is not None:
+                    stage["rows"] = rows(self, result)
+            return result
+        return wrapper
+    return decorator
+
+
+class _EpochLineTimer(io.TextIOBase):
+    """
+    Reenvía la salida a stdout y anota el instante de cada línea
+    "Processing epoch N" que imprime Surprise con verbose=True
+    """
+
+    EPOCH_PATTERN = re.compile(r"Processing epoch (\d+)")
+
+    def __init__(self, target):
+        self.target = target
+        self.marks = []
+
+    def write(self, text):
+        for match in self.EPOCH_PATTERN.finditer(text):
+            self.marks.append((int(match.group(1)), time.perf_counter()))
+        return self.target.write(text)
+
+    def flush(self):
+        self.target.flush()
+
+
+@contextmanager
+def capture_epoch_timings(epochs: List[Dict]):
+    """
+    Mide la duración de cada época de un fit de Surprise (requiere verbose=True).
+    SVD no expone los factores intermedios, así que la pérdida por época queda a None.
+
+    El SGD compilado de Surprise no ofrece ningún callback por época, así que
+    esto sustituye sys.stdout de todo el proceso mientras dura el fit: úsese
+    solo desde scripts de línea de comandos, nunca dentro de la API.
+    """
+    timer = _EpochLineTimer(sys.stdout)
+    original_stdout = sys.stdout
+    sys.stdout = timer
+    try:
+        yield epochs
+    finally:
+        sys.stdout = original_stdout
+        end = time.perf_counter()
+        marks = timer.marks
+        for k, (epoch, start) in enumerate(marks):
+            stop = marks[k + 1][1] if k + 1 < len(marks) else end
+            epochs.append({"epoch": epoch, "seconds": round(stop - start, 4), "train_loss": None})
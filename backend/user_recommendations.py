@@ -0,0 +1,154 @@
+"""
+Recomendaciones por Usuario Recalculadas en Segundo Plano
+Sistema de Recomendación de Películas - Grupo 8
+
+/ratings/add escribe el rating, vuelve a leer todos los ratings del usuario,
+puntúa el catálogo y cuenta sus ratings antes de responder. En el onboarding
+el usuario valora ~15 películas seguidas y solo mira las recomendaciones al
+final. Con el modo "deferred", /ratings/add solo hace el upsert y pide aquí un
+recálculo en segundo plano:
+- El recálculo espera USER_RECS_REFRESH_DELAY_MS desde el último rating del
+  usuario. Una ráfaga de ratings produce un único recálculo, y nunca hay dos
+  a la vez para el mismo usuario.
+- El resultado (top USER_RECS_N) se guarda en un LRU de USER_RECS_STORE_SIZE
+  usuarios.
+
+/recommendations/from-db sirve desde aquí (un prefijo del top guardado) si
+la entrada es de la versión del modelo cargada y de los mismos ratings que
+el usuario tiene ahora en la BD (huella de sus ratings). Si no coincide, se
+calcula como siempre. Así nunca se sirve una entrada desfasada, aunque el
+rating se escribiera a través de otro worker. La caché es de cada proceso y
+se vacía al recargar el modelo.
+
+Métricas: cache_requests_total{cache="user_recommendations"} y
+user_recommendations_refresh_total por resultado.
+"""
+
+import asyncio
+import os
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from metrics import USER_RECS_REFRESHES, record_cache
+
+
+def ratings_fingerprint(user_ratings: Dict[str, float]) -> int:
+    """Huella de los ratings de un usuario (misma huella = mismos ratings)"""
+    return hash(frozenset(user_ratings.items()))
+
+
+class UserRecommendationStore:
+    """Top-N de cada usuario por (versión del modelo, huella de sus ratings), con recálculo diferido"""
+
+    def __init__(self, max_users: int = 10000, n: int = 20, delay_ms: float = 200):
+        """
+        Args:
+            max_users: Usuarios guardados (se descartan los menos usados; 0 = desactivado)
+            n: Recomendaciones guardadas por usuario
+            delay_ms: Espera desde el último rating antes de recalcular
+        """
+        self.max_users = max(0, max_users)
+        self.n = max(1, n)
+        self.delay = max(0.0, delay_ms) / 1000
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._running: Set[str] = set()
+        self._rerun: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    @classmethod
+    def from_env(cls) -> "UserRecommendationStore":
+        """USER_RECS_STORE_SIZE, USER_RECS_N y USER_RECS_REFRESH_DELAY_MS"""
+        return cls(
+            max_users=int(os.getenv("USER_RECS_STORE_SIZE", "10000")),
+            n=int(os.getenv("USER_RECS_N", "20")),
+            delay_ms=float(os.getenv("USER_RECS_REFRESH_DELAY_MS", "200"))
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_users > 0
+
+    def has(self, user_id: str) -> bool:
+        return user_id in self._entries
+
+    def get(self, user_id: str, model_version: str, user_ratings: Dict[str, float], n: int) -> Optional[List]:
+        """Las n primeras recomendaciones guardadas si siguen siendo válidas, o None"""
+        entry = self._entries.get(user_id)
+        valid = (
+            entry is not None
+            and entry[:2] == (model_version, ratings_fingerprint(user_ratings))
+            and (n <= len(entry[2]) or entry[3])
+        )
+        record_cache("user_recommendations", valid)
+        if not valid:
+            return None
+        self._entries.move_to_end(user_id)
+        return entry[2][:n]
+
+    def put(self, user_id: str, model_version: str, user_ratings: Dict[str, float], recommendations: List):
+        """Guarda el top de un usuario (calculado con n = self.n)"""
+        if not self.enabled:
+            return
+        # Con menos de n resultados la lista está completa: vale para cualquier n
+        complete = len(recommendations) < self.n
+        self._entries[user_id] = (model_version, ratings_fingerprint(user_ratings), recommendations, complete)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_users:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    # ------------------------------------------------------------------
+    # Recálculo diferido
+    # ------------------------------------------------------------------
+
+    def schedule_refresh(self, user_id: str, refresh: Callable[[str], Awaitable]):
+        """Programa refresh(user_id) tras la ventana; cada nuevo rating la reinicia"""
+        if not self.enabled:
+            return
+        timer = self._timers.pop(user_id, None)
+        if timer is not None:
+            timer.cancel()
+        self._timers[user_id] = asyncio.get_running_loop().call_later(
+            self.delay, self._start_refresh, user_id, refresh
+        )
+
+    def _start_refresh(self, user_id: str, refresh: Callable[[str], Awaitable]):
+        self._timers.pop(user_id, None)
+        if user_id in self._running:
+            # Llegó otro rating durante el recálculo: se repite al terminar
+            self._rerun.add(user_id)
+            return
+        self._running.add(user_id)
+        task = asyncio.get_running_loop().create_task(self._run_refresh(user_id, refresh))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_refresh(self, user_id: str, refresh: Callable[[str], Awaitable]):
+        try:
+            await refresh(user_id)
+            USER_RECS_REFRESHES.inc("success")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Sin entrada válida, /recommendations/from-db calcula como siempre
+            USER_RECS_REFRESHES.inc("error")
+            print(f"⚠️ No se pudieron recalcular las recomendaciones de {user_id}: {e}")
+        finally:
+            self._running.discard(user_id)
+            if user_id in self._rerun:
+                self._rerun.discard(user_id)
+                self._start_refresh(user_id, refresh)
+
+    def close(self):
+        """Cancela los recálculos programados y en curso"""
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        for task in self._tasks:
+            task.cancel()
@@ -6,6 +6,7 @@ import axios, { AxiosInstance } from 'axios';
 import {
   RecommendationsResponse,
   AddRatingResponse,
+  RecommendationsMode,
   UserRating,
   PopularMovie
 } from '../types';
@@ -39,18 +40,21 @@ class MovieAPIClient {
   }
 
   /**
-   * Añadir rating y obtener recomendaciones actualizadas
+   * Añadir rating. Por defecto no espera a las recomendaciones: el backend
+   * las recalcula en segundo plano y getRecommendationsFromDB las sirve ya hechas
    */
   async addRating(
     userId: string,
     movieId: string,
-    rating: number
+    rating: number,
+    recommendations: RecommendationsMode = 'deferred'
   ): Promise<AddRatingResponse> {
     try {
       const response = await this.client.post<AddRatingResponse>('/ratings/add', {
         user_id: userId,
         movie_id: movieId,
-        rating: rating
+        rating: rating,
+        recommendations
       });
       return response.data;
     } catch (error) {
@@ -99,9 +103,12 @@ class MovieAPIClient {
    */
   async getPopularMovies(n: number = 10, minRatings: number = 50) {
     try {
-      const response = await this.client.post('/movies/popular', {
-        n: n,
-        min_ratings: minRatings
+      // GET: el navegador la cachea y la revalida con el ETag del servidor
+      const response = await this.client.get('/movies/popular', {
+        params: {
+          n: n,
+          min_ratings: minRatings
+        }
       });
       return response.data.movies as PopularMovie[];
     } catch (error) {
@@ -135,11 +142,19 @@ class MovieAPIClient {
     userId?: string  // NUEVO: parámetro opcional
   ) {
     try {
-      const response = await this.client.post('/similar-movies', {
-        movie_id: movieId,
-        user_id: userId,  // NUEVO: enviar user_id si está disponible
-        n: n
-      });
+      // Sin usuario la respuesta es la misma para todos: GET cacheable con ETag
+      const response = userId
+        ? await this.client.post('/similar-movies', {
+            movie_id: movieId,
+            user_id: userId,  // NUEVO: enviar user_id si está disponible
+            n: n
+          })
+        : await this.client.get('/similar-movies', {
+            params: {
+              movie_id: movieId,
+              n: n
+            }
+          });
       return response.data.similar_movies;
     } catch (error) {
       console.error('Error obteniendo similares:', error);
@@ -44,12 +44,15 @@ export interface AddRatingResponse {
     timestamp: string;
   };
   user_stats: {
-    total_ratings: number;
+    total_ratings: number | null;
     user_id: string;
   };
   recommendations: MovieRecommendation[];
+  recommendations_status: 'fresh' | 'skipped' | 'pending';
 }
 
+export type RecommendationsMode = 'sync' | 'skip' | 'deferred';
+
 export interface SimilarMovie {
   movie_id: string;
   title: string;
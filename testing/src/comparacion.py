@@ -1,3 +1,31 @@
+"""
+Benchmark de Algoritmos de Surprise
+Sistema de Recomendación de Películas - Grupo 8
+
+Compara los algoritmos de Surprise en uno o varios datasets (MovieLens 100K,
+MovieLens 1M y el corpus sintético de backend/generate_synthetic_data.py).
+Cada combinación dataset/algoritmo se ejecuta en su propio proceso, con
+varios procesos en paralelo y un tiempo máximo por ejecución, y mide por
+separado:
+
+- Tiempo de entrenamiento (fit)
+- RMSE, MAE y tiempo de evaluación sobre el test
+- Latencia de una predicción individual (p50/p95 en µs)
+- Latencia de un top-N completo para un usuario (p50/p95 en ms)
+- Pico de memoria residente durante el fit
+
+Los resultados se guardan en JSON (con metadatos de la máquina y el commit,
+para seguirlos en el tiempo) y en el CSV de siempre. Por defecto no descarga
+nada: usa los datasets ya cacheados por Surprise (~/.surprise_data) o
+--download para descargarlos.
+
+Uso:
+    python src/comparacion.py                                  # ml-100k, todos los algoritmos
+    python src/comparacion.py --datasets ml-100k ml-1m --jobs 4 --timeout 600
+    python src/comparacion.py --datasets synthetic --algorithms SVD NMF Baseline
+    python src/comparacion.py --list
+"""
+
 # Solución para el error de numpy con surprise
 import numpy as np
 # Forzar la inicialización correcta de numpy antes de importar surprise
@@ -5,108 +33,358 @@ np.float_ = np.float64
 np.int_ = np.int64
 np.bool_ = np.bool_
 
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import time
+import traceback
+from datetime import datetime
+
 import pandas as pd
 from surprise import SVD, SVDpp, NMF, SlopeOne, KNNBasic, KNNWithMeans, KNNBaseline
 from surprise import CoClustering, BaselineOnly, NormalPredictor
 from surprise import Dataset, Reader, accuracy
+from surprise.builtin_datasets import BUILTIN_DATASETS
 from surprise.model_selection import train_test_split
-import time
 
-# Cargar el dataset MovieLens 100K
-print("Cargando dataset MovieLens 100K...")
-data = Dataset.load_builtin('ml-100k')
-
-# Dividir en train y test (80-20)
-trainset, testset = train_test_split(data, test_size=0.2, random_state=42)
-
-# Definir los algoritmos a comparar
-algorithms = {
-    'SVD': SVD(),
-    'SVD++ (cache_ratings=False)': SVDpp(cache_ratings=False),
-    'SVD++ (cache_ratings=True)': SVDpp(cache_ratings=True),
-    'NMF': NMF(),
-    'Slope One': SlopeOne(),
-    'k-NN': KNNBasic(),
-    'Centered k-NN': KNNWithMeans(),
-    'k-NN Baseline': KNNBaseline(),
-    'Co-Clustering': CoClustering(),
-    'Baseline': BaselineOnly(),
-    'Random': NormalPredictor()
+# Algoritmos a comparar: nombre -> (clase, parámetros). Se construyen dentro
+# de cada proceso para no compartir estado entre ejecuciones
+ALGORITHMS = {
+    'SVD': (SVD, {}),
+    'SVD++ (cache_ratings=False)': (SVDpp, {'cache_ratings': False}),
+    'SVD++ (cache_ratings=True)': (SVDpp, {'cache_ratings': True}),
+    'NMF': (NMF, {}),
+    'Slope One': (SlopeOne, {}),
+    'k-NN': (KNNBasic, {}),
+    'Centered k-NN': (KNNWithMeans, {}),
+    'k-NN Baseline': (KNNBaseline, {}),
+    'Co-Clustering': (CoClustering, {}),
+    'Baseline': (BaselineOnly, {}),
+    'Random': (NormalPredictor, {})
 }
 
-# Almacenar resultados
-results = []
-
-# Evaluar cada algoritmo
-for name, algo in algorithms.items():
-    print(f"\n{'='*60}")
-    print(f"Evaluando: {name}")
-    print(f"{'='*60}")
-    
-    start_time = time.time()
-    
-    # Entrenar el modelo
+DATASETS = ['ml-100k', 'ml-1m', 'synthetic']
+DEFAULT_SYNTHETIC_CORPUS = os.path.join(os.path.dirname(__file__), '..', '..', 'backend', 'data', 'synthetic')
+
+
+# ============================================================================
+# DATOS
+# ============================================================================
+
+def load_dataset(name, download=False, synthetic_corpus=DEFAULT_SYNTHETIC_CORPUS):
+    """
+    Carga un dataset sin acceder a la red salvo con download=True.
+    Devuelve None (con un aviso) si no está disponible localmente.
+    """
+    if name == 'synthetic':
+        columns = {}
+        for column in ('user_id', 'movie_id', 'rating'):
+            path = os.path.join(synthetic_corpus, f'{column}.npy')
+            if not os.path.exists(path):
+                print(f"⚠️ No hay corpus sintético en {synthetic_corpus} "
+                      f"(genéralo con backend/generate_synthetic_data.py)")
+                return None
+            columns[column] = np.load(path, mmap_mode='r')
+        df = pd.DataFrame({
+            'user': columns['user_id'].astype(str),
+            'item': columns['movie_id'].astype(str),
+            'rating': np.asarray(columns['rating'], dtype=np.float64)
+        })
+        return Dataset.load_from_df(df, Reader(rating_scale=(1, 5)))
+
+    if not os.path.exists(BUILTIN_DATASETS[name].path) and not download:
+        print(f"⚠️ {name} no está en la caché de Surprise ({BUILTIN_DATASETS[name].path}); usa --download")
+        return None
+    return Dataset.load_builtin(name, prompt=False)
+
+
+# ============================================================================
+# MEDICIÓN (se ejecuta en el proceso hijo)
+# ============================================================================
+
+def _reset_peak_rss():
+    """Reinicia el pico de memoria residente del proceso (Linux); False si no se puede"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_mb():
+    """Pico de memoria residente del proceso en MB"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _percentiles(values, scale):
+    values = np.asarray(values) * scale
+    return {
+        'p50': round(float(np.percentile(values, 50)), 3),
+        'p95': round(float(np.percentile(values, 95)), 3),
+        'mean': round(float(values.mean()), 3)
+    }
+
+
+def measure_algorithm(name, trainset, testset, n=10, predict_sample=2000, topn_users=20, seed=42):
+    """Entrena y mide un algoritmo; devuelve un dict con todas las métricas"""
+    algo_class, params = ALGORITHMS[name]
+    algo = algo_class(**params)
+    rng = np.random.default_rng(seed)
+
+    peak_reset = _reset_peak_rss()
+    rss_before = _peak_rss_mb()
+    start = time.perf_counter()
     algo.fit(trainset)
-    
-    # Hacer predicciones
+    fit_seconds = time.perf_counter() - start
+    peak_fit = _peak_rss_mb()
+
+    start = time.perf_counter()
     predictions = algo.test(testset)
-    
-    # Calcular métricas
-    rmse = accuracy.rmse(predictions, verbose=False)
-    mae = accuracy.mae(predictions, verbose=False)
-    
-    elapsed_time = time.time() - start_time
-    
-    # Guardar resultados
-    results.append({
-        'Algoritmo': name,
-        'RMSE': rmse,
-        'MAE': mae,
-        'Tiempo (segundos)': elapsed_time
-    })
-    
-    print(f"RMSE: {rmse:.4f}")
-    print(f"MAE: {mae:.4f}")
-    print(f"Tiempo: {elapsed_time:.2f} segundos")
-
-# Crear DataFrame con resultados
-df_results = pd.DataFrame(results)
-
-# Ordenar por RMSE
-df_results = df_results.sort_values('RMSE')
-
-# Mostrar tabla de resultados
-print("\n" + "="*80)
-print("RESULTADOS FINALES - COMPARACIÓN DE ALGORITMOS")
-print("="*80)
-print(df_results.to_string(index=False))
-
-# Guardar resultados en CSV con formato europeo (punto y coma como separador, coma decimal)
-df_results.to_csv('resultados_comparacion_algoritmos.csv', index=False, sep=';', decimal=',')
-print("\n✓ Resultados guardados en 'resultados_comparacion_algoritmos.csv' (formato europeo)")
-
-# Identificar el mejor algoritmo para cada métrica
-print("\n" + "="*80)
-print("MEJORES ALGORITMOS POR MÉTRICA")
-print("="*80)
-best_rmse = df_results.loc[df_results['RMSE'].idxmin()]
-best_mae = df_results.loc[df_results['MAE'].idxmin()]
-fastest = df_results.loc[df_results['Tiempo (segundos)'].idxmin()]
-
-print(f"\n🏆 Mejor RMSE: {best_rmse['Algoritmo']}")
-print(f"   RMSE: {best_rmse['RMSE']:.4f}")
-
-print(f"\n🏆 Mejor MAE: {best_mae['Algoritmo']}")
-print(f"   MAE: {best_mae['MAE']:.4f}")
-
-print(f"\n⚡ Más rápido: {fastest['Algoritmo']}")
-print(f"   Tiempo: {fastest['Tiempo (segundos)']:.2f} segundos")
-
-# Análisis adicional
-print("\n" + "="*80)
-print("ANÁLISIS ADICIONAL")
-print("="*80)
-print(f"\nDiferencia entre mejor y peor RMSE: {df_results['RMSE'].max() - df_results['RMSE'].min():.4f}")
-print(f"Diferencia entre mejor y peor MAE: {df_results['MAE'].max() - df_results['MAE'].min():.4f}")
-print(f"\nTiempo total de ejecución: {df_results['Tiempo (segundos)'].sum():.2f} segundos")
-print(f"Tiempo promedio por algoritmo: {df_results['Tiempo (segundos)'].mean():.2f} segundos")
\ No newline at end of file
+    test_seconds = time.perf_counter() - start
+
+    # Latencia de predicciones sueltas sobre una muestra del test
+    sample = rng.choice(len(testset), size=min(predict_sample, len(testset)), replace=False)
+    latencies = []
+    for idx in sample:
+        uid, iid, _ = testset[idx]
+        t0 = time.perf_counter()
+        algo.predict(uid, iid)
+        latencies.append(time.perf_counter() - t0)
+
+    # Top-N: puntuar todo el catálogo para un usuario y quedarse con los n mejores
+    all_items = [trainset.to_raw_iid(i) for i in range(trainset.n_items)]
+    users = rng.choice(trainset.n_users, size=min(topn_users, trainset.n_users), replace=False)
+    topn_latencies = []
+    for inner_uid in users:
+        uid = trainset.to_raw_uid(int(inner_uid))
+        t0 = time.perf_counter()
+        scores = np.array([algo.predict(uid, iid).est for iid in all_items])
+        np.argsort(-scores, kind='stable')[:n]
+        topn_latencies.append(time.perf_counter() - t0)
+
+    return {
+        'rmse': accuracy.rmse(predictions, verbose=False),
+        'mae': accuracy.mae(predictions, verbose=False),
+        'fit_seconds': round(fit_seconds, 4),
+        'test_seconds': round(test_seconds, 4),
+        'predict_latency_us': _percentiles(latencies, 1e6),
+        'topn_latency_ms': _percentiles(topn_latencies, 1e3),
+        'peak_rss_mb': round(peak_fit, 1),
+        'fit_memory_mb': round(peak_fit - rss_before, 1) if peak_reset else None
+    }
+
+
+def _run_child(conn, name, trainset, testset, options):
+    try:
+        conn.send({'status': 'ok', **measure_algorithm(name, trainset, testset, **options)})
+    except Exception as e:
+        conn.send({'status': 'error', 'error': f"{type(e).__name__}: {e}", 'traceback': traceback.format_exc()})
+    finally:
+        conn.close()
+
+
+# ============================================================================
+# EJECUCIÓN EN PARALELO
+# ============================================================================
+
+def run_benchmarks(splits, algorithms, jobs=1, timeout=1800, **options):
+    """
+    Ejecuta cada (dataset, algoritmo) en un proceso propio, con hasta `jobs`
+    procesos a la vez. Las ejecuciones que superan `timeout` segundos se
+    terminan y quedan con status 'timeout'.
+
+    splits: {dataset: (trainset, testset)}
+    """
+    # Con fork los hijos heredan los datos sin copiarlos ni serializarlos
+    methods = multiprocessing.get_all_start_methods()
+    ctx = multiprocessing.get_context('fork' if 'fork' in methods else 'spawn')
+    pending = [(dataset, name) for dataset in splits for name in algorithms]
+    running = {}
+    results = []
+
+    while pending or running:
+        while pending and len(running) < jobs:
+            dataset, name = pending.pop(0)
+            parent_conn, child_conn = ctx.Pipe(duplex=False)
+            trainset, testset = splits[dataset]
+            process = ctx.Process(target=_run_child, args=(child_conn, name, trainset, testset, options), daemon=True)
+            process.start()
+            child_conn.close()
+            running[(dataset, name)] = (process, parent_conn, time.perf_counter())
+            print(f"▶ {dataset} / {name}")
+
+        for key, (process, conn, started) in list(running.items()):
+            dataset, name = key
+            elapsed = time.perf_counter() - started
+            if conn.poll():
+                try:
+                    result = conn.recv()
+                except EOFError:
+                    result = {'status': 'error', 'error': 'El proceso terminó sin devolver resultados'}
+            elif not process.is_alive():
+                result = {'status': 'error', 'error': f'El proceso terminó con código {process.exitcode}'}
+            elif elapsed > timeout:
+                process.terminate()
+                result = {'status': 'timeout', 'error': f'Superado el tiempo máximo de {timeout} s'}
+            else:
+                continue
+
+            process.join(5)
+            conn.close()
+            del running[key]
+            result.update({'dataset': dataset, 'algorithm': name, 'wall_seconds': round(elapsed, 2)})
+            results.append(result)
+            if result['status'] == 'ok':
+                print(f"  ✓ {dataset} / {name}: RMSE {result['rmse']:.4f} | fit {result['fit_seconds']:.2f} s | "
+                      f"top-{options.get('n', 10)} p50 {result['topn_latency_ms']['p50']:.1f} ms | "
+                      f"pico {result['peak_rss_mb']:.0f} MB")
+            else:
+                print(f"  ✗ {dataset} / {name}: {result['status']} ({result['error']})")
+        time.sleep(0.05)
+
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def save_results(path, results, datasets_info, config):
+    """JSON con los resultados y los metadatos de la ejecución"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    payload = {
+        'generated_at': datetime.now().isoformat(),
+        'commit': _git_commit(),
+        'machine': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count()
+        },
+        'config': config,
+        'datasets': datasets_info,
+        'results': results
+    }
+    with open(path, 'w') as f:
+        json.dump(payload, f, indent=2)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark de algoritmos de Surprise')
+    parser.add_argument('--datasets', nargs='+', default=['ml-100k'], choices=DATASETS, help='Datasets a usar')
+    parser.add_argument('--algorithms', nargs='+', default=list(ALGORITHMS), metavar='NOMBRE',
+                        help='Algoritmos a comparar (por defecto todos; ver --list)')
+    parser.add_argument('--jobs', type=int, default=max(1, (os.cpu_count() or 1) // 2),
+                        help='Procesos en paralelo (más procesos que núcleos distorsiona los tiempos)')
+    parser.add_argument('--timeout', type=float, default=1800, help='Segundos máximos por ejecución')
+    parser.add_argument('--test-size', type=float, default=0.2, help='Fracción de test')
+    parser.add_argument('--seed', type=int, default=42, help='Semilla del split y de las muestras')
+    parser.add_argument('--n', type=int, default=10, help='Tamaño del top-N')
+    parser.add_argument('--topn-users', type=int, default=20, help='Usuarios para medir el top-N')
+    parser.add_argument('--predict-sample', type=int, default=2000, help='Predicciones sueltas a medir')
+    parser.add_argument('--synthetic-corpus', default=DEFAULT_SYNTHETIC_CORPUS, help='Directorio del corpus sintético')
+    parser.add_argument('--download', action='store_true', help='Descargar los datasets que no estén en caché')
+    parser.add_argument('--output', default=None,
+                        help='JSON de resultados (por defecto resultados/benchmark_<fecha>.json)')
+    parser.add_argument('--csv', default='resultados_comparacion_algoritmos.csv', help='CSV de resultados')
+    parser.add_argument('--list', action='store_true', help='Mostrar los algoritmos disponibles y salir')
+    args = parser.parse_args()
+
+    if args.list:
+        for name in ALGORITHMS:
+            print(name)
+        raise SystemExit(0)
+
+    unknown = [name for name in args.algorithms if name not in ALGORITHMS]
+    if unknown:
+        parser.error(f"Algoritmos desconocidos: {', '.join(unknown)} (ver --list)")
+
+    print("="*80)
+    print("BENCHMARK DE ALGORITMOS")
+    print("="*80)
+
+    splits = {}
+    datasets_info = {}
+    for name in args.datasets:
+        print(f"Cargando dataset {name}...")
+        data = load_dataset(name, args.download, args.synthetic_corpus)
+        if data is None:
+            continue
+        trainset, testset = train_test_split(data, test_size=args.test_size, random_state=args.seed)
+        splits[name] = (trainset, testset)
+        datasets_info[name] = {
+            'ratings': len(data.raw_ratings),
+            'users': trainset.n_users,
+            'items': trainset.n_items,
+            'train_ratings': trainset.n_ratings,
+            'test_ratings': len(testset)
+        }
+        print(f"✓ {name}: {trainset.n_users} usuarios, {trainset.n_items} películas, "
+              f"{trainset.n_ratings} ratings de train, {len(testset)} de test")
+
+    if not splits:
+        print("❌ Ningún dataset disponible")
+        raise SystemExit(1)
+
+    start = time.perf_counter()
+    results = run_benchmarks(
+        splits, args.algorithms, jobs=args.jobs, timeout=args.timeout,
+        n=args.n, predict_sample=args.predict_sample, topn_users=args.topn_users, seed=args.seed
+    )
+    total_seconds = time.perf_counter() - start
+
+    output = args.output or os.path.join('resultados', f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.json")
+    config = {k: v for k, v in vars(args).items() if k not in ('list', 'output', 'csv')}
+    save_results(output, results, datasets_info, config)
+
+    # CSV con el formato europeo de siempre (punto y coma, coma decimal)
+    ok = [r for r in results if r['status'] == 'ok']
+    df_results = pd.DataFrame([{
+        'Dataset': r['dataset'],
+        'Algoritmo': r['algorithm'],
+        'RMSE': r['rmse'],
+        'MAE': r['mae'],
+        'Tiempo (segundos)': r['fit_seconds'] + r['test_seconds'],
+        'Fit (segundos)': r['fit_seconds'],
+        'Predicción p50 (µs)': r['predict_latency_us']['p50'],
+        f'Top-{args.n} p50 (ms)': r['topn_latency_ms']['p50'],
+        'Pico memoria (MB)': r['peak_rss_mb']
+    } for r in ok])
+    if not df_results.empty:
+        df_results = df_results.sort_values(['Dataset', 'RMSE'])
+        df_results.to_csv(args.csv, index=False, sep=';', decimal=',')
+
+    print("\n" + "="*80)
+    print("RESULTADOS FINALES - COMPARACIÓN DE ALGORITMOS")
+    print("="*80)
+    if not df_results.empty:
+        print(df_results.to_string(index=False))
+        for dataset, group in df_results.groupby('Dataset'):
+            best = group.loc[group['RMSE'].idxmin()]
+            fastest = group.loc[group['Fit (segundos)'].idxmin()]
+            print(f"\n[{dataset}] 🏆 Mejor RMSE: {best['Algoritmo']} ({best['RMSE']:.4f}) | "
+                  f"⚡ Fit más rápido: {fastest['Algoritmo']} ({fastest['Fit (segundos)']:.2f} s)")
+    failed = [r for r in results if r['status'] != 'ok']
+    for r in failed:
+        print(f"✗ {r['dataset']} / {r['algorithm']}: {r['status']} - {r['error']}")
+
+    print(f"\nTiempo total: {total_seconds:.2f} segundos")
+    print(f"✓ Resultados guardados en '{output}'" + (f" y '{args.csv}'" if not df_results.empty else ""))